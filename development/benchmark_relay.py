@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+"""Compare the busy-polling message relay used by earlier versions of
+SoS_Kernel.run_cell with the ChannelPoller based relay.
+
+The script starts a subkernel (python3 by default) and measures
+
+1. CPU time consumed by the relaying process while the subkernel runs a
+   cell that sleeps without producing any output, and
+2. the latency between the time a line is printed by the subkernel and the
+   time the message is picked up by the relay.
+
+Usage:
+
+    python development/benchmark_relay.py [--kernel python3] [--lines 200]
+"""
+
+import argparse
+import statistics
+import time
+
+from jupyter_client import manager
+
+from sos_notebook.relay import ChannelPoller
+
+
+def busy_relay(KC, msg_id, on_message):
+    """the relay loop of sos-notebook <= 0.24.7"""
+    iopub_ended = False
+    shell_ended = False
+    while not (iopub_ended and shell_ended):
+        while KC.stdin_channel.msg_ready():
+            KC.stdin_channel.get_msg()
+        while KC.iopub_channel.msg_ready():
+            sub_msg = KC.iopub_channel.get_msg()
+            if sub_msg["parent_header"].get("msg_id") != msg_id:
+                continue
+            on_message(sub_msg)
+            if (
+                sub_msg["header"]["msg_type"] == "status"
+                and sub_msg["content"]["execution_state"] == "idle"
+            ):
+                iopub_ended = True
+        if KC.shell_channel.msg_ready():
+            KC.get_shell_msg()
+            shell_ended = True
+        time.sleep(0.001)
+
+
+def poller_relay(KC, msg_id, on_message):
+    """the relay loop driven by ChannelPoller"""
+    iopub_ended = False
+    shell_ended = False
+    poller = ChannelPoller(KC)
+    while not (iopub_ended and shell_ended):
+        poller.wait()
+        while KC.stdin_channel.msg_ready():
+            KC.stdin_channel.get_msg()
+        while KC.iopub_channel.msg_ready():
+            sub_msg = KC.iopub_channel.get_msg()
+            if sub_msg["parent_header"].get("msg_id") != msg_id:
+                continue
+            on_message(sub_msg)
+            if (
+                sub_msg["header"]["msg_type"] == "status"
+                and sub_msg["content"]["execution_state"] == "idle"
+            ):
+                iopub_ended = True
+        if KC.shell_channel.msg_ready():
+            KC.get_shell_msg()
+            shell_ended = True
+
+
+def measure_idle_cpu(KC, relay, seconds):
+    msg_id = KC.execute(f"import time; time.sleep({seconds})")
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    relay(KC, msg_id, lambda msg: None)
+    return (time.process_time() - cpu) / (time.perf_counter() - wall)
+
+
+def measure_latency(KC, relay, lines):
+    latencies = []
+
+    def on_message(msg):
+        if msg["header"]["msg_type"] != "stream":
+            return
+        received = time.time()
+        for line in msg["content"]["text"].splitlines():
+            if line.startswith("T "):
+                latencies.append(received - float(line[2:]))
+
+    msg_id = KC.execute(
+        "import sys, time\n"
+        f"for i in range({lines}):\n"
+        "    print(f'T {time.time()!r}')\n"
+        "    sys.stdout.flush()\n"
+        "    time.sleep(0.005)\n"
+    )
+    relay(KC, msg_id, on_message)
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--kernel", default="python3", help="subkernel to start")
+    parser.add_argument(
+        "--seconds", type=float, default=3, help="duration of the idle cell"
+    )
+    parser.add_argument(
+        "--lines", type=int, default=200, help="number of lines to print"
+    )
+    args = parser.parse_args()
+
+    KM, KC = manager.start_new_kernel(kernel_name=args.kernel)
+    try:
+        print(f"{'relay':<10}{'idle CPU':>12}{'median latency':>18}{'p95 latency':>15}")
+        for name, relay in (("busy-poll", busy_relay), ("poller", poller_relay)):
+            cpu = measure_idle_cpu(KC, relay, args.seconds)
+            median, p95 = measure_latency(KC, relay, args.lines)
+            print(f"{name:<10}{cpu:>11.1%}{median:>16.3f}ms{p95:>13.3f}ms")
+    finally:
+        KC.stop_channels()
+        KM.shutdown_kernel(now=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,13 @@
 # Distributed under the terms of the Modified BSD License.
 
 import logging
-import time
 
 import traitlets
 import traitlets.config
 from ipykernel.comm.manager import CommManager
 
+from .relay import ChannelPoller, recv_message, unpack_content
+
 logger = logging.getLogger("soskernel.comm")
 
 
@@ -23,10 +24,13 @@ class CommProxyHandler:
         # wait for subkernel to handle
         comm_msg_started = False
         comm_msg_ended = False
+        poller = ChannelPoller(self._KC, channels=("iopub",))
         while not (comm_msg_started and comm_msg_ended):
+            poller.wait()
             while self._KC.iopub_channel.msg_ready():
-                sub_msg = self._KC.iopub_channel.get_msg()
+                sub_msg = recv_message(self._KC.iopub_channel, content=False)
                 if sub_msg["header"]["msg_type"] == "status":
+                    unpack_content(self._KC.session, sub_msg)
                     if sub_msg["content"]["execution_state"] == "busy":
                         comm_msg_started = True
                     elif (
@@ -36,7 +40,6 @@ class CommProxyHandler:
                         comm_msg_ended = True
                     continue
                 self._sos_kernel.session.send(self._sos_kernel.iopub_socket, sub_msg)
-            time.sleep(0.001)
 
 
 class SoSCommManager(CommManager):
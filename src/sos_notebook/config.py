@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+
+import sos.utils
+from sos.utils import env
+
+
+class ConfigCache:
+    """Cache of SoS configurations, keyed on the paths and modification times of
+    the site, global (hosts.yml and config.yml), and user-specified configuration
+    files so that configuration files are parsed again only if one of them is
+    created, modified, or removed."""
+
+    def __init__(self):
+        self._key = None
+        self._cfg = None
+
+    def config_files(self, filename=None):
+        """Configuration files that are read by sos.utils.load_config_files"""
+        if filename is None and "config_file" in env.config:
+            filename = env.config["config_file"]
+        files = [
+            os.path.join(os.path.dirname(sos.utils.__file__), "site_config.yml"),
+            os.path.join(os.path.expanduser("~"), ".sos", "hosts.yml"),
+            os.path.join(os.path.expanduser("~"), ".sos", "config.yml"),
+        ]
+        if filename is not None:
+            files.append(os.path.expanduser(filename))
+        return files
+
+    def _signature(self, filename):
+        signature = []
+        for path in self.config_files(filename):
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return (filename, tuple(signature), repr(env.config.get("extra_config", None)))
+
+    def load(self, filename=None):
+        """Return the configuration dictionary, which is also set to CONFIG in
+        sos_dict, loading it from configuration files if any of them has changed"""
+        key = self._signature(filename)
+        if key != self._key:
+            # sos caches configurations only by the user-specified file
+            sos.utils.config_cache.clear()
+            self._cfg = sos.utils.load_config_files(filename)
+            self._key = key
+        else:
+            env.sos_dict.set("CONFIG", self._cfg)
+        return self._cfg
+
+    def clear(self):
+        self._key = None
+        self._cfg = None
+
+
+config_cache = ConfigCache()
+
+
+def load_config_files(filename=None):
+    """Cached version of sos.utils.load_config_files"""
+    return config_cache.load(filename)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+"""Transfer of tabular and array data between kernels through files that are
+memory-mapped by the receiving kernel, instead of through pickled objects or
+statements that are executed by the receiving kernel.
+
+A language module supports the protocol by defining
+
+    data_formats
+        A list of formats the module can read and write, in the order of
+        preference, from "arrow" (Arrow IPC files of tables and data frames)
+        and "npy" (numpy arrays).
+
+    import_data(self, files, fmt)
+        Load variables from files, a dictionary of variable names and paths
+        of files in format fmt, preferably by memory-mapping the files. The
+        method can be a coroutine.
+
+    export_data(self, items, fmt, directory)
+        Save variables in items that can be saved in format fmt to files in
+        directory, and return a dictionary of variable names and paths of the
+        files. Variables that are not returned are transferred by put_vars.
+
+Variables that cannot be transferred this way, and modules that do not
+support the protocol, use get_vars and put_vars of the language modules.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+
+def available_formats():
+    """Formats that can be read and written by the SoS kernel"""
+    formats = []
+    try:
+        import pyarrow  # noqa: F401
+
+        formats.append("arrow")
+    except ImportError:
+        pass
+    try:
+        import numpy  # noqa: F401
+
+        formats.append("npy")
+    except ImportError:
+        pass
+    return formats
+
+
+def negotiate(formats, other_formats):
+    """Return the first format in formats that is also in other_formats, or None"""
+    return next((x for x in formats if x in other_formats), None)
+
+
+def data_formats(plugin):
+    """Formats supported by a language module, empty if it does not support the
+    data transfer protocol"""
+    return list(getattr(plugin, "data_formats", []) or [])
+
+
+def transfer_directory():
+    """A temporary directory for transferred data, under /dev/shm if available so
+    that files are kept in shared memory"""
+    shm = "/dev/shm"
+    return tempfile.mkdtemp(
+        prefix="sos_data_",
+        dir=shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None,
+    )
+
+
+def remove_directory(directory):
+    # files that are memory-mapped can be removed because the mapped data are
+    # kept until they are unmapped
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def can_write(obj, fmt):
+    if fmt == "arrow":
+        cls = type(obj)
+        return (cls.__module__.split(".")[0], cls.__name__) in (
+            ("pandas", "DataFrame"),
+            ("pyarrow", "Table"),
+        )
+    if fmt == "npy":
+        # numpy is not imported if obj cannot be an array
+        np = sys.modules.get("numpy", None)
+        # arrays received as memory-mapped files are np.memmap, whereas masked
+        # arrays and matrices would be saved as plain arrays
+        return (
+            np is not None
+            and isinstance(obj, np.ndarray)
+            and not isinstance(obj, (np.ma.MaskedArray, np.matrix))
+            and not obj.dtype.hasobject
+        )
+    return False
+
+
+def write_vars(values, fmt, directory):
+    """Save values (a dictionary of names and objects) that can be saved in
+    format fmt to directory, and return a dictionary of names and paths"""
+    files = {}
+    for name, obj in values.items():
+        if not can_write(obj, fmt):
+            continue
+        if fmt == "arrow":
+            import pyarrow as pa
+
+            table = obj if isinstance(obj, pa.Table) else pa.Table.from_pandas(obj)
+            path = os.path.join(directory, f"{name}.arrow")
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            import numpy as np
+
+            path = os.path.join(directory, f"{name}.npy")
+            np.save(path, obj, allow_pickle=False)
+        files[name] = path
+    return files
+
+
+def read_vars(files, fmt):
+    """Memory-map files (a dictionary of names and paths) in format fmt and
+    return a dictionary of names and objects. Arrow tables that are saved from
+    pandas data frames are converted back to data frames."""
+    values = {}
+    for name, path in files.items():
+        if fmt == "arrow":
+            import pyarrow as pa
+
+            with pa.memory_map(path, "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            values[name] = (
+                table.to_pandas() if table.schema.pandas_metadata is not None else table
+            )
+        elif fmt == "npy":
+            import numpy as np
+
+            # copy-on-write so that the array can be modified
+            values[name] = np.load(path, mmap_mode="c", allow_pickle=False)
+        else:
+            raise ValueError(f"Unsupported data format {fmt}")
+    return values
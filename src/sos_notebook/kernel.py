@@ -8,17 +8,15 @@ import contextlib
 import inspect
 import logging
 import os
-import pprint
 import subprocess
 import sys
 import threading
 import time
 from collections import defaultdict
-from importlib import metadata
 from textwrap import dedent
 
 import comm
-import pandas as pd
+import traitlets
 from ipykernel._version import version_info as ipykernel_version_info
 from ipykernel.ipkernel import IPythonKernel
 from IPython.utils.tokenutil import line_at_cursor, token_at_cursor
@@ -27,14 +25,31 @@ from sos._version import __sos_version__, __version__
 from sos.eval import SoS_eval, interpolate
 from sos.executor_utils import prepare_env
 from sos.syntax import SOS_DIRECTIVE, SOS_SECTION_HEADER
-from sos.utils import env, load_config_files, short_repr
+from sos.utils import env, expand_size, short_repr
 
+from . import data_plane
 from ._version import __version__ as __notebook_version__
 from .comm_manager import SoSCommManager
 from .completer import SoS_Completer
+from .config import load_config_files
 from .inspector import SoS_Inspector
+from .kernel_pool import HealthMonitor, KernelEvictor, KernelPool, start_subkernel
+from .kernelspecs import kernelspec_index
+from .languages import LanguageModules, LanguagePlugins
 from .magics import SoS_Magics
+from .namespace import DictChanges, TransferredVars, fingerprint
+from .relay import (
+    OUTPUT_MSG_TYPES,
+    ChannelPoller,
+    OutputBudget,
+    ResponseCollector,
+    StreamCoalescer,
+    needs_content,
+    recv_message,
+    unpack_content,
+)
 from .subkernel import Subkernels
+from .tracing import tracer
 from .workflow_executor import (
     NotebookLoggingHandler,
     execute_scratch_cell,
@@ -44,37 +59,101 @@ from .workflow_executor import (
 
 
 class FlushableStringIO:
-    def __init__(self, kernel, name, *args, **kwargs):
+    """Stream that replaces sys.stdout and sys.stderr when SoS code and shell
+    commands are executed. Output is buffered and sent to the frontend as a
+    single stream message when the buffer holds max_lines lines or max_size
+    characters, when interval seconds have passed since the first buffered
+    write, or when the stream is flushed."""
+
+    def __init__(
+        self,
+        kernel,
+        name,
+        *args,
+        max_lines=100,
+        max_size=65536,
+        interval=0.2,
+        lock=None,
+    ):
         self.kernel = kernel
         self.name = name
+        self.max_lines = max_lines
+        self.max_size = max_size
+        self.interval = interval
+        self._buffer = []
+        self._lines = 0
+        self._size = 0
+        self._timer = None
+        # stdout and stderr share a lock, which is also held by the kernel
+        # when it sends messages, because output can be flushed from a timer
+        # thread and flushing one of them can flush the other
+        self._lock = threading.RLock() if lock is None else lock
 
     def write(self, content):
         if content.startswith("HINT: "):
             content = content.splitlines()
             hint_line = content[0][6:].strip()
             content = "\n".join(content[1:])
-            self.kernel.send_response(
-                self.kernel.iopub_socket,
-                "display_data",
-                {
-                    "metadata": {},
-                    "data": {"text/html": f'<div class="sos_hint">{hint_line}</div>'},
-                },
-            )
-        if content:
-            if self.kernel._meta["capture_result"] is not None:
-                self.kernel._meta["capture_result"].append(
-                    ("stream", {"name": self.name, "text": content})
-                )
-            if self.kernel._meta["render_result"] is False:
+            with self._lock:
+                self.flush()
                 self.kernel.send_response(
                     self.kernel.iopub_socket,
-                    "stream",
-                    {"name": self.name, "text": content},
+                    "display_data",
+                    {
+                        "metadata": {},
+                        "data": {
+                            "text/html": f'<div class="sos_hint">{hint_line}</div>'
+                        },
+                    },
                 )
+        if not content:
+            return
+        with self._lock:
+            # keep the order of interleaved stdout and stderr output
+            for stream in (sys.stdout, sys.stderr):
+                if stream is not self and isinstance(stream, FlushableStringIO):
+                    stream.flush()
+            self._buffer.append(content)
+            self._lines += content.count("\n")
+            self._size += len(content)
+            if self._lines >= self.max_lines or self._size >= self.max_size:
+                self.flush()
+            elif self._timer is None and self.interval > 0:
+                # send the output even if nothing else is written for a while,
+                # e.g. when a shell command is waiting for input
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            elif self.interval <= 0:
+                self.flush()
 
     def flush(self):
-        pass
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            content = "".join(self._buffer)
+            self._buffer = []
+            self._lines = 0
+            self._size = 0
+            self._send(content)
+
+    def _send(self, content):
+        if not self.kernel.charge_output(len(content)):
+            self.kernel.suppress_output("stream", {"name": self.name, "text": content})
+            return
+        if self.kernel._meta["capture_result"] is not None:
+            self.kernel._meta["capture_result"].append(
+                ("stream", {"name": self.name, "text": content})
+            )
+        if self.kernel._meta["render_result"] is False:
+            self.kernel.send_response(
+                self.kernel.iopub_socket,
+                "stream",
+                {"name": self.name, "text": content},
+            )
 
 
 __all__ = ["SoS_Kernel"]
@@ -124,24 +203,102 @@ class SoS_Kernel(IPythonKernel):
     }
     banner = "SoS kernel - script of scripts"
 
+    stream_coalesce_window = traitlets.Float(
+        0,
+        help="""Time window in seconds within which consecutive stream messages
+        from a subkernel are merged before they are sent to the frontend.
+        Coalescing is disabled if set to 0.""",
+    ).tag(config=True)
+    stream_coalesce_size = traitlets.Integer(
+        65536,
+        help="""Maximum number of characters of a coalesced stream message.""",
+    ).tag(config=True)
+    output_budget_bytes = traitlets.Integer(
+        0,
+        help="""Maximum number of bytes of output a cell can send to the frontend
+        or capture, unlimited if set to 0. Can be overridden by notebook metadata
+        and magic %limit.""",
+    ).tag(config=True)
+    output_budget_messages = traitlets.Integer(
+        0,
+        help="""Maximum number of output messages a cell can send to the frontend
+        or capture, unlimited if set to 0.""",
+    ).tag(config=True)
+    output_spool = traitlets.Bool(
+        False,
+        help="""Save output beyond the output budget of a cell to a temporary file.""",
+    ).tag(config=True)
+    response_timeout = traitlets.Float(
+        0,
+        help="""Seconds to wait for a subkernel to respond to statements executed
+        by SoS, for example to preview or transfer variables, before the subkernel
+        is interrupted. No timeout if set to 0.""",
+    ).tag(config=True)
+    kernel_pool_size = traitlets.Integer(
+        0,
+        help="""Number of subkernels declared by the notebook that are started in
+        the background, with their language modules initialized, before they are
+        used. No subkernel is started in advance if set to 0.""",
+    ).tag(config=True)
+    kernel_pool_idle_timeout = traitlets.Float(
+        600,
+        help="""Seconds after which a subkernel started in advance is shut down if
+        it has not been used. Such subkernels are kept until the SoS kernel is
+        shut down if set to 0.""",
+    ).tag(config=True)
+    subkernel_check_interval = traitlets.Float(
+        5,
+        help="""Seconds between checks, in the background, of whether running
+        subkernels are alive. Crashed subkernels are detected only when cells are
+        executed in them if set to 0.""",
+    ).tag(config=True)
+    restart_crashed_subkernels = traitlets.Bool(
+        True,
+        help="""Restart subkernels that are found crashed by the background checks
+        right away, instead of when the next cell is executed in them.""",
+    ).tag(config=True)
+    subkernel_memory_budget = traitlets.Integer(
+        0,
+        help="""Megabytes of resident memory that can be used by all running
+        subkernels. Idle subkernels are shut down, least recently used first, if
+        the budget is exceeded, and are started again when they are used. No
+        subkernel is shut down for memory if set to 0.""",
+    ).tag(config=True)
+    subkernel_idle_timeout = traitlets.Float(
+        600,
+        help="""Seconds after which a subkernel that has not been used can be shut
+        down to keep subkernels within subkernel_memory_budget. A subkernel in
+        which cells have been executed is shut down only if it stays idle for
+        another subkernel_idle_timeout seconds after a warning is sent.""",
+    ).tag(config=True)
+    sos_output_lines = traitlets.Integer(
+        100,
+        help="""Number of lines of output from SoS cells and shell commands that
+        are buffered before they are sent to the frontend.""",
+    ).tag(config=True)
+    sos_output_size = traitlets.Integer(
+        65536,
+        help="""Number of characters of output from SoS cells and shell commands
+        that are buffered before they are sent to the frontend.""",
+    ).tag(config=True)
+    sos_output_interval = traitlets.Float(
+        0.2,
+        help="""Maximum time in seconds output from SoS cells and shell commands
+        is buffered before it is sent to the frontend. Output is sent without
+        buffering if set to 0.""",
+    ).tag(config=True)
+
+    data_transfer_formats = traitlets.List(
+        ["arrow", "npy"],
+        help="""Formats, in the order of preference, that are used to transfer
+        data frames and arrays between SoS and language modules that support
+        them, through memory-mapped files. Set to an empty list to transfer all
+        variables with get_vars and put_vars of language modules.""",
+    ).tag(config=True)
+
     def get_supported_languages(self):
-        if self._supported_languages is not None:
-            return self._supported_languages
-        group = "sos_languages"
-        self._supported_languages = {}
-
-        for entrypoint in metadata.entry_points(group=group):
-            # Grab the function that is the actual plugin.
-            name = entrypoint.name
-            env.log_to_file("KERNEL", f"Found registered language {name}")
-            try:
-                plugin = entrypoint.load()
-                self._supported_languages[name] = plugin
-            except Exception as e:
-                env.log_to_file(
-                    "KERNEL", f"Failed to load registered language {name}: {e}"
-                )
-                self._failed_languages[name] = e
+        if self._supported_languages is None:
+            self._supported_languages = LanguagePlugins(self._failed_languages)
         return self._supported_languages
 
     supported_languages = property(lambda self: self.get_supported_languages())
@@ -173,6 +330,9 @@ class SoS_Kernel(IPythonKernel):
         super().__init__(**kwargs)
         self.options = ""
         self.kernel = "SoS"
+        # buffered output of SoS code can be sent from a timer thread, so
+        # messages are sent by one thread at a time
+        self._output_lock = threading.RLock()
         # a dictionary of started kernels, with the format of
         #
         # 'R': ['ir', 'sos.R.sos_R', '#FFEEAABB']
@@ -190,6 +350,18 @@ class SoS_Kernel(IPythonKernel):
         )
 
         self.kernels = {}
+        self.kernel_pool = KernelPool(
+            self.kernel_pool_size, self.kernel_pool_idle_timeout
+        )
+        self.health_monitor = HealthMonitor(
+            self, self.subkernel_check_interval, self.restart_crashed_subkernels
+        )
+        self.kernel_evictor = KernelEvictor(
+            self,
+            self.subkernel_memory_budget * 1024 * 1024,
+            self.subkernel_idle_timeout,
+            self.subkernel_check_interval,
+        )
         self._shutting_down = False
         atexit.register(self._atexit_shutdown)
         # self.shell = InteractiveShell.instance()
@@ -209,8 +381,14 @@ class SoS_Kernel(IPythonKernel):
             "cell_kernel": "SoS",
             "batch_mode": False,
         }
+        self._output_budget = None
+        self._data_formats = None
+        self._sos_dict_tracker = DictChanges()
+        self.transferred_vars = TransferredVars()
+        self.sos_dict_changes = ([], [], [])
         self._debug_mode = False
         self._supported_languages = None
+        self.language_modules = LanguageModules(self)
         self._completer = None
         self._inspector = None
         self._real_execution_count = 1
@@ -284,7 +462,12 @@ class SoS_Kernel(IPythonKernel):
                 if k == "list-kernel":
                     if v:
                         self.subkernels.update(v)
-                    self.subkernels.notify_frontend()
+                        self.prestart_subkernels([x[0] for x in v])
+                    self.subkernels.notify_frontend(full=True)
+                elif k == "kernel-list-delta":
+                    # frontend accepts delta updates of the kernel list
+                    self.subkernels.delta_updates = bool(v)
+                    self.subkernels.notify_frontend(full=True)
                 elif k == "set-editor-kernel":
                     self.editor_kernel = v
                 elif k == "cancel-workflow":
@@ -350,6 +533,7 @@ class SoS_Kernel(IPythonKernel):
                     self.send_frontend_msg("update-duration", {})
                 elif k == "paste-table":
                     try:
+                        import pandas as pd
                         from tabulate import tabulate
 
                         df = pd.read_clipboard()
@@ -368,6 +552,7 @@ class SoS_Kernel(IPythonKernel):
                     self.warn(f"Unknown message {k}: {v}")
 
     def notify_error(self, e):
+        self.flush_sos_io()
         msg = {
             "status": "error",
             "ename": e.__class__.__name__,
@@ -385,7 +570,12 @@ class SoS_Kernel(IPythonKernel):
             self.send_response(self.iopub_socket, "error", msg)
         return msg
 
+    def send_response(self, *args, **kwargs):
+        with self._output_lock:
+            return super().send_response(*args, **kwargs)
+
     def send_frontend_msg(self, msg_type, msg=None):
+        self.flush_sos_io()
         # if comm is never created by frontend, the kernel is in test mode without frontend
         if msg_type in ("display_data", "stream"):
             if self._meta["use_panel"] is False or self._meta["cell_id"] == -1:
@@ -443,13 +633,34 @@ class SoS_Kernel(IPythonKernel):
     def redirect_sos_io(self):
         save_stdout = sys.stdout
         save_stderr = sys.stderr
-        sys.stdout = FlushableStringIO(self, "stdout")
-        sys.stderr = FlushableStringIO(self, "stderr")
-        yield
-        sys.stdout = save_stdout
-        sys.stderr = save_stderr
-
-    async def get_vars_from(self, items, from_kernel=None, explicit=False, as_var=None):
+        sys.stdout, sys.stderr = (
+            FlushableStringIO(
+                self,
+                name,
+                max_lines=self.sos_output_lines,
+                max_size=self.sos_output_size,
+                interval=self.sos_output_interval,
+                lock=self._output_lock,
+            )
+            for name in ("stdout", "stderr")
+        )
+        try:
+            yield
+        finally:
+            self.flush_sos_io()
+            sys.stdout = save_stdout
+            sys.stderr = save_stderr
+
+    def flush_sos_io(self):
+        """Send buffered output of SoS code so that it appears before messages
+        sent by the kernel"""
+        for stream in (sys.stdout, sys.stderr):
+            if isinstance(stream, FlushableStringIO):
+                stream.flush()
+
+    async def get_vars_from(
+        self, items, from_kernel=None, explicit=False, as_var=None, force=False
+    ):
         if as_var is not None:
             if not isinstance(as_var, str):
                 self.warn("Option --as should be a string.")
@@ -472,18 +683,56 @@ class SoS_Kernel(IPythonKernel):
                     return
             kinfo = self.subkernels.find(self.kernel)
             if kinfo.language in self.supported_languages:
-                lan = self.supported_languages[kinfo.language]
+                # variables that have been sent to the kernel are not sent again
+                # unless they have been changed. Variables that are forced to be
+                # sent are not fingerprinted, and are recorded without digests
+                # so that they will be sent again.
+                digests = {}
+                if not force:
+                    digests = {x: fingerprint(env.sos_dict[x]) for x in items}
+                    skipped = [
+                        x
+                        for x in items
+                        if self.transferred_vars.unchanged(
+                            self.kernel, as_var or x, x, digests[x]
+                        )
+                    ]
+                    if skipped:
+                        self.send_response(
+                            self.iopub_socket,
+                            "stream",
+                            {
+                                "name": "stdout",
+                                "text": f"Unchanged {', '.join(skipped)} not sent again "
+                                f"to {self.kernel}, use option --force to send anyway\n",
+                            },
+                        )
+                        items = [x for x in items if x not in skipped]
+                        if not items:
+                            return
                 try:
-                    get_vars_func = lan(self, kinfo.kernel).get_vars
-                    args = inspect.getfullargspec(get_vars_func).args
-                    if "as_var" in args:
-                        await get_vars_func(items, as_var=as_var)
+                    module = self.language_modules.get(kinfo)
+                    sent = items
+                    items = await self.import_data_to(module.instance, items, as_var)
+                    for item in sent:
+                        if item not in items:
+                            self.transferred_vars.record(
+                                self.kernel, as_var or item, item, digests.get(item)
+                            )
+                    if not items:
+                        return
+                    if module.get_vars_as_var:
+                        await module.instance.get_vars(items, as_var=as_var)
                     else:
                         if as_var is not None:
                             self.warn(
                                 f"Subkernel {kinfo.language} does not support option --as"
                             )
-                        await get_vars_func(items)
+                        await module.instance.get_vars(items)
+                    for item in items:
+                        self.transferred_vars.record(
+                            self.kernel, as_var or item, item, digests.get(item)
+                        )
                 except Exception as e:
                     self.warn(f"Failed to get variable: {e}\n")
                     return
@@ -510,21 +759,37 @@ class SoS_Kernel(IPythonKernel):
                 await self.switch_kernel("SoS")
         else:
             # if another kernel is specified, we should try to let that kernel pass
-            # the variables to this one directly
+            # the variables to this one directly. Names of variables that are
+            # received are returned.
+            self.transferred_vars.forget(self.kernel, [as_var] if as_var else items)
+            remaining = await self.transfer_data_between(
+                items, from_kernel, self.kernel, as_var
+            )
+            received = [as_var or x for x in items if x not in remaining]
+            if not remaining:
+                return received
             try:
                 my_kernel = self.kernel
                 await self.switch_kernel(from_kernel)
                 # put stuff to sos or my_kernel directly
-                await self.put_vars_to(
-                    items, to_kernel=my_kernel, explicit=explicit, as_var=as_var
+                received += (
+                    await self.put_vars_to(
+                        remaining, to_kernel=my_kernel, explicit=explicit, as_var=as_var
+                    )
+                    or []
                 )
             except Exception as e:
-                self.warn(f"Failed to get {', '.join(items)} from {from_kernel}: {e}")
+                self.warn(
+                    f"Failed to get {', '.join(remaining)} from {from_kernel}: {e}"
+                )
             finally:
                 # then switch back
                 await self.switch_kernel(my_kernel)
+            return received
 
-    async def put_vars_to(self, items, to_kernel=None, explicit=False, as_var=None):
+    async def put_vars_to(
+        self, items, to_kernel=None, explicit=False, as_var=None, force=False
+    ):
         if not items:
             return
         if as_var is not None:
@@ -543,7 +808,9 @@ class SoS_Kernel(IPythonKernel):
             # if another kernel is specified and the current kernel is sos
             try:
                 # switch to kernel and bring in items
-                await self.switch_kernel(to_kernel, in_vars=items, as_var=as_var)
+                await self.switch_kernel(
+                    to_kernel, in_vars=items, as_var=as_var, force=force
+                )
             except Exception as e:
                 self.warn(f"Failed to put {', '.join(items)} to {to_kernel}: {e}")
             finally:
@@ -557,26 +824,52 @@ class SoS_Kernel(IPythonKernel):
                     self.warn(f"Subkernel {self.kernel} does not support magic %put.")
                 return
             #
-            lan = self.supported_languages[kinfo.language]
             # pass language name to to_kernel
             try:
-                put_vars_func = lan(self, kinfo.kernel).put_vars
-                args = inspect.getfullargspec(put_vars_func).args
+                module = self.language_modules.get(kinfo)
                 to_kernel_name = (
                     self.subkernels.find(to_kernel).language if to_kernel else "SoS"
                 )
-                if "as_var" in args:
-                    objects = put_vars_func(
-                        items, to_kernel=to_kernel_name, as_var=as_var
+                # names of variables that are put directly to to_kernel
+                sent = []
+                if to_kernel_name == "SoS":
+                    transferred = await self.export_data_from(
+                        module.instance, items, as_var
                     )
+                    remaining = [
+                        x for x in items if (as_var if as_var else x) not in transferred
+                    ]
                 else:
-                    objects = put_vars_func(items, to_kernel=to_kernel_name)
+                    self.transferred_vars.forget(
+                        self.subkernels.find(to_kernel).name,
+                        [as_var] if as_var else items,
+                    )
+                    transferred = {}
+                    remaining = await self.transfer_data_between(
+                        items, self.kernel, to_kernel, as_var
+                    )
+                    sent = [as_var or x for x in items if x not in remaining]
+                    if not remaining:
+                        return sent
+                if not remaining:
+                    objects = {}
+                elif module.put_vars_as_var:
+                    objects = module.instance.put_vars(
+                        remaining, to_kernel=to_kernel_name, as_var=as_var
+                    )
+                else:
+                    objects = module.instance.put_vars(
+                        remaining, to_kernel=to_kernel_name
+                    )
+                if transferred and isinstance(objects, dict):
+                    objects = {**transferred, **objects}
 
             except Exception as e:
                 # if somethign goes wrong in the subkernel does not matter
                 env.log_to_file(
                     "MAGIC", f"Failed to call put_var({items}) from {kinfo.kernel}: {e}"
                 )
+                sent = []
                 objects = {}
             if isinstance(objects, dict):
                 # returns a SOS dictionary
@@ -602,10 +895,10 @@ class SoS_Kernel(IPythonKernel):
                 # we need to first put to sos then to another kernel
                 my_kernel = self.kernel
                 try:
-                    # switch to the destination kernel and bring in vars
-                    await self.switch_kernel(
-                        to_kernel, in_vars=[as_var] if as_var else items
-                    )
+                    # switch to the destination kernel through SoS and bring in
+                    # vars from SoS
+                    await self.switch_kernel("SoS")
+                    await self.switch_kernel(to_kernel, in_vars=list(objects.keys()))
                 except Exception as e:
                     self.warn(f"Failed to put {', '.join(items)} to {to_kernel}: {e}")
                 finally:
@@ -615,6 +908,7 @@ class SoS_Kernel(IPythonKernel):
                     for missing_var in missing_vars:
                         env.sos_dict.pop(missing_var)
                     env.sos_dict.update(existing_vars)
+                return sent + list(objects.keys())
             elif isinstance(objects, str):
                 # an statement that will be executed in the destination kernel
                 if to_kernel is None or to_kernel == "SoS":
@@ -631,16 +925,132 @@ class SoS_Kernel(IPythonKernel):
                     await self.switch_kernel(to_kernel)
                     # execute the statement to pass variables directly to destination kernel
                     await self.run_cell(objects, True, False)
+                    sent += [as_var or x for x in remaining]
                 except Exception as e:
                     self.warn(f"Failed to put {', '.join(items)} to {to_kernel}: {e}")
                 finally:
                     # switch back to the original kernel
                     await self.switch_kernel(my_kernel)
+                return sent
             else:
                 self.warn(
                     f"Unrecognized return value of type {object.__class__.__name__} for action %put"
                 )
 
+    def negotiate_data_format(self, lan_module):
+        """Format used to transfer data with a language module, None if the
+        module does not support any of the formats supported by SoS"""
+        if self._data_formats is None:
+            available = data_plane.available_formats()
+            self._data_formats = [
+                x for x in self.data_transfer_formats if x in available
+            ]
+        return data_plane.negotiate(
+            self._data_formats, data_plane.data_formats(lan_module)
+        )
+
+    async def import_data_to(self, lan_module, items, as_var=None):
+        """Transfer variables in items from SoS to a subkernel through memory-mapped
+        files if its language module supports it, and return items that are not
+        transferred"""
+        fmt = self.negotiate_data_format(lan_module)
+        if fmt is None:
+            return items
+        directory = data_plane.transfer_directory()
+        try:
+            files = data_plane.write_vars(
+                {(as_var if as_var else x): env.sos_dict[x] for x in items},
+                fmt,
+                directory,
+            )
+            if files:
+                ret = lan_module.import_data(files, fmt)
+                if inspect.isawaitable(ret):
+                    await ret
+        except Exception as e:
+            env.log_to_file("MAGIC", f"Failed to transfer {items} as {fmt}: {e}")
+            return items
+        finally:
+            data_plane.remove_directory(directory)
+        return [x for x in items if (as_var if as_var else x) not in files]
+
+    async def export_data_from(self, lan_module, items, as_var=None):
+        """Transfer variables in items from a subkernel through memory-mapped files
+        if its language module supports it, and return a dictionary of variables
+        that are transferred"""
+        fmt = self.negotiate_data_format(lan_module)
+        if fmt is None:
+            return {}
+        directory = data_plane.transfer_directory()
+        try:
+            files = lan_module.export_data(items, fmt, directory)
+            if inspect.isawaitable(files):
+                files = await files
+            values = data_plane.read_vars(files, fmt)
+        except Exception as e:
+            env.log_to_file("MAGIC", f"Failed to transfer {items} as {fmt}: {e}")
+            return {}
+        finally:
+            data_plane.remove_directory(directory)
+        if as_var is not None and values:
+            # only one item is allowed with as_var
+            values = {as_var: next(iter(values.values()))}
+        return values
+
+    async def transfer_data_between(self, items, from_kernel, to_kernel, as_var=None):
+        """Transfer variables in items from subkernel from_kernel to subkernel
+        to_kernel through files that are written by the language module of
+        from_kernel and read by that of to_kernel, without passing them through
+        SoS. The current kernel is restored afterwards. Return items that are
+        not transferred, which is all items if the language modules do not
+        support a common data format."""
+        try:
+            src = self.subkernels.find(from_kernel)
+            dest = self.subkernels.find(to_kernel)
+        except Exception:
+            # errors are reported when variables are transferred through SoS
+            return items
+        if (
+            src.language not in self.supported_languages
+            or dest.language not in self.supported_languages
+        ):
+            return items
+        src_module = self.language_modules.get(src).instance
+        dest_module = self.language_modules.get(dest).instance
+        fmt = data_plane.negotiate(
+            [
+                x
+                for x in self.data_transfer_formats
+                if x in data_plane.data_formats(src_module)
+            ],
+            data_plane.data_formats(dest_module),
+        )
+        if fmt is None:
+            return items
+        my_kernel = self.kernel
+        directory = data_plane.transfer_directory()
+        try:
+            await self.switch_kernel(src.name)
+            files = src_module.export_data(items, fmt, directory)
+            if inspect.isawaitable(files):
+                files = await files
+            if not files:
+                return items
+            if as_var is not None:
+                # only one item is allowed with as_var
+                files = {as_var: next(iter(files.values()))}
+            await self.switch_kernel(dest.name)
+            ret = dest_module.import_data(files, fmt)
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception as e:
+            env.log_to_file("MAGIC", f"Failed to transfer {items} as {fmt}: {e}")
+            return items
+        finally:
+            data_plane.remove_directory(directory)
+            await self.switch_kernel(my_kernel)
+        return [x for x in items if (as_var if as_var else x) not in files]
+
     async def expand_text_in(self, text, sigil=None, kernel="SoS"):
         """
         Expand a piece of (markdown) text in specified kernel, used by
@@ -668,14 +1078,14 @@ class SoS_Kernel(IPythonKernel):
         if kinfo.language not in self.supported_languages:
             self.warn(f"Subkernel {kernel} does not support magic %expand --in")
             return text
-        lan = self.supported_languages[kinfo.language](self, kinfo.kernel)
-        if not hasattr(lan, "expand"):
+        module = self.language_modules.get(kinfo)
+        if not module.expand:
             self.warn(f"Subkernel {kernel} does not support magic %expand --in")
             return text
         orig_kernel = self.kernel
         try:
             await self.switch_kernel(kernel)
-            return lan.expand(text, sigil)
+            return module.instance.expand(text, sigil)
         except Exception as e:
             self.warn(
                 f"Failed to expand {text} with sigin {sigil} in kernel {kernel}: {e}"
@@ -847,20 +1257,77 @@ class SoS_Kernel(IPythonKernel):
     def warn(self, message):
         message = str(message).rstrip() + "\n"
         if message.strip():
+            self.flush_sos_io()
             self.send_response(
                 self.iopub_socket, "stream", {"name": "stderr", "text": message}
             )
 
+    def new_output_budget(self, options=None):
+        """Create an output budget for a cell from kernel configuration, which
+        can be overridden by options (bytes, messages and spool) from notebook
+        metadata or magic %limit"""
+        if options is None:
+            options = {}
+        max_bytes = str(options.get("bytes", self.output_budget_bytes))
+        return OutputBudget(
+            max_bytes=int(max_bytes) if max_bytes.isdigit() else expand_size(max_bytes),
+            max_messages=int(options.get("messages", self.output_budget_messages)),
+            spool=options.get("spool", self.output_spool),
+        )
+
+    def charge_output(self, size):
+        """Return False if an output message of size bytes exceeds the output
+        budget of the current cell"""
+        budget = self._output_budget
+        return budget is None or not budget.limited or budget.charge(size)
+
+    def suppress_output(self, msg_type, content, session=None):
+        """Save output beyond the output budget to the spool file, if needed,
+        and notify the user when output starts to be suppressed"""
+        budget = self._output_budget
+        if budget.suppressed_messages == 1:
+            self.warn(
+                f"Output exceeds the output budget of {budget.describe()}. "
+                + (
+                    "Further output is saved to a spool file."
+                    if budget.spool
+                    else "Further output is discarded."
+                )
+            )
+        if budget.spool:
+            if isinstance(content, bytes):
+                content = session.unpack(content)
+            budget.save(msg_type, content)
+
+    def close_output_budget(self):
+        budget = self._output_budget
+        if budget is None:
+            return
+        summary = budget.close()
+        if summary:
+            self.warn(summary)
+
     async def run_cell(self, code, silent, store_history, on_error=None):
-        #
-        if not self.KM.is_alive():
+        # wait for the subkernel to be restarted if the health monitor found it
+        # crashed, and check it in case it crashed after the last check
+        crashed = await self.health_monitor.wait_for(self.kernel)
+        self.kernel_evictor.touch(self.kernel)
+        if crashed:
+            self.send_response(
+                self.iopub_socket,
+                "stream",
+                {"name": "stdout", "text": f'Kernel "{self.kernel}" {crashed}\n'},
+            )
+        if not await self.KM.is_alive():
             self.send_response(
                 self.iopub_socket,
                 "stream",
                 {"name": "stdout", "text": f'Restarting kernel "{self.kernel}"\n'},
             )
-            self.KM.restart_kernel(now=False)
+            await self.KM.restart_kernel(now=False)
             self.KC = self.KM.client()
+            self.transferred_vars.forget(self.kernel)
+            self.language_modules.invalidate(self.kernel)
         # flush stale replies, which could have been ignored, due to missed heartbeats
         while self.KC.shell_channel.msg_ready():
             self.KC.shell_channel.get_msg()
@@ -889,18 +1356,33 @@ class SoS_Kernel(IPythonKernel):
         iopub_ended = False
         shell_ended = False
         res = None
+        poller = ChannelPoller(self.KC)
+        iopub = StreamCoalescer(
+            self.session,
+            self.iopub_socket,
+            self.stream_coalesce_window,
+            self.stream_coalesce_size,
+        )
         while not (iopub_started and iopub_ended and shell_ended):
             try:
+                # wait until the subkernel sends something through any channel,
+                # or until coalesced stream messages have to be sent
+                poller.wait(iopub.timeout())
+                iopub.flush_expired()
                 # display intermediate print statements, etc.
                 while self.KC.stdin_channel.msg_ready():
                     sub_msg = self.KC.stdin_channel.get_msg()
-                    env.log_to_file(
+                    tracer.debug(
                         "MESSAGE",
-                        f"MSG TYPE {sub_msg['header']['msg_type']} CONTENT\n  {pprint.pformat(sub_msg)}",
+                        "MSG TYPE %s CONTENT\n  %s",
+                        sub_msg["header"]["msg_type"],
+                        sub_msg,
                     )
                     if sub_msg["header"]["msg_type"] != "input_request":
                         self.session.send(self.stdin_socket, sub_msg)
                     else:
+                        # show pending output before the prompt
+                        iopub.flush()
                         content = sub_msg["content"]
                         if content["password"]:
                             res = self.getpass(prompt=content["prompt"])
@@ -908,11 +1390,21 @@ class SoS_Kernel(IPythonKernel):
                             res = self.raw_input(prompt=content["prompt"])
                         self.KC.input(res)
                 while self.KC.iopub_channel.msg_ready():
-                    sub_msg = self.KC.iopub_channel.get_msg()
+                    # the content of messages such as large display_data is only
+                    # unpacked if SoS needs it, otherwise it is relayed as it is
+                    sub_msg = recv_message(self.KC.iopub_channel, content=False)
                     msg_type = sub_msg["header"]["msg_type"]
-                    env.log_to_file(
-                        "MESSAGE",
-                        f"IOPUB MSG TYPE {sub_msg['header']['msg_type']} CONTENT  \n {pprint.pformat(sub_msg)}",
+                    size = len(sub_msg["content"]) + sum(
+                        x.nbytes for x in sub_msg["buffers"]
+                    )
+                    if needs_content(
+                        msg_type,
+                        capture=self._meta["capture_result"] is not None,
+                        coalesce=iopub.enabled,
+                    ):
+                        unpack_content(self.KC.session, sub_msg)
+                    tracer.debug(
+                        "MESSAGE", "IOPUB MSG TYPE %s CONTENT  \n %s", msg_type, sub_msg
                     )
                     if msg_type == "status":
                         if sub_msg["content"]["execution_state"] == "busy":
@@ -928,13 +1420,20 @@ class SoS_Kernel(IPythonKernel):
                         # not sure if it is needed
                         sub_msg["content"]["execution_count"] = self._execution_count
                     #
-                    if msg_type in [
-                        "display_data",
-                        "stream",
-                        "execute_result",
-                        "update_display_data",
-                        "error",
-                    ]:
+                    if msg_type in OUTPUT_MSG_TYPES:
+                        if (
+                            msg_type not in ("execute_result", "error")
+                            and (
+                                self._meta["capture_result"] is not None
+                                or (not silent and self._meta["render_result"] is False)
+                            )
+                            and not self.charge_output(size)
+                        ):
+                            iopub.flush()
+                            self.suppress_output(
+                                msg_type, sub_msg["content"], self.KC.session
+                            )
+                            continue
                         if self._meta["capture_result"] is not None:
                             self._meta["capture_result"].append(
                                 (msg_type, sub_msg["content"])
@@ -943,6 +1442,7 @@ class SoS_Kernel(IPythonKernel):
                             not silent and self._meta["render_result"] is False
                         ):
                             if msg_type == "error" and self._meta["suppress_error"]:
+                                iopub.flush()
                                 self.send_response(
                                     self.iopub_socket,
                                     "stream",
@@ -952,31 +1452,27 @@ class SoS_Kernel(IPythonKernel):
                                     },
                                 )
                             else:
-                                self.session.send(self.iopub_socket, sub_msg)
+                                iopub.send(sub_msg)
                     else:
                         # if the subkernel tried to create a customized comm
                         if msg_type == "comm_open":
                             self.comm_manager.register_subcomm(
                                 sub_msg["content"]["comm_id"], self.KC, self
                             )
-                        self.session.send(self.iopub_socket, sub_msg)
+                        iopub.send(sub_msg)
                 if self.KC.shell_channel.msg_ready():
                     # now get the real result
                     reply = self.KC.get_shell_msg()
                     reply["content"]["execution_count"] = self._execution_count
-                    env.log_to_file("MESSAGE", f"GET SHELL MSG {pprint.pformat(reply)}")
+                    tracer.debug("MESSAGE", "GET SHELL MSG %s", reply)
                     res = reply["content"]
                     shell_ended = True
-                time.sleep(0.001)
             except KeyboardInterrupt:
-                self.KM.interrupt_kernel()
+                self.KM.sync_interrupt_kernel()
+        iopub.flush()
         return res
 
     def get_info_of_subkernels(self):
-        from jupyter_client.kernelspec import KernelSpecManager
-
-        km = KernelSpecManager()
-
         available_subkernels = """<table>
             <tr>
                 <th>Subkernel</th>
@@ -986,20 +1482,25 @@ class SoS_Kernel(IPythonKernel):
                 <th  style="text-align:left">Interpreter</th>
             </tr>"""
         for sk in self.subkernels.kernel_list():
-            spec = km.get_kernel_spec(sk.kernel)
+            spec = kernelspec_index.get(sk.kernel)
             if sk.name in ("SoS", "Markdown"):
                 lan_module = ""
-            elif sk.language in self.supported_languages:
-                lan_module = f"<code>{self.supported_languages[sk.language].__module__.split('.')[0]}</code>"
+            elif (
+                sk.language in self.supported_languages.keys()
+                and sk.language not in self._failed_languages
+            ):
+                lan_module = (
+                    f"<code>{self.supported_languages.module(sk.language)}</code>"
+                )
             else:
                 lan_module = '<font style="color:red">Unavailable</font>'
             available_subkernels += f"""\
         <tr>
         <td>{sk.name}</td>
         <td><code>{sk.kernel}</code></td>
-        <td>{spec.language}</td>
+        <td>{spec["language"]}</td>
         <td>{lan_module}</td>
-        <td style="text-align:left"><code>{spec.argv[0]}</code></td>
+        <td style="text-align:left"><code>{spec["argv"][0]}</code></td>
         </tr>"""
         available_subkernels += "</table>"
         return available_subkernels
@@ -1012,6 +1513,7 @@ class SoS_Kernel(IPythonKernel):
         language=None,
         color=None,
         as_var=None,
+        force=False,
     ):
         # switching to a non-sos kernel
         if not kernel:
@@ -1032,78 +1534,166 @@ class SoS_Kernel(IPythonKernel):
             self.kernel = "SoS"
         elif self.kernel != "SoS":
             # Non-SoS to Non-SoS
-            await self.switch_kernel("SoS", in_vars)
-            await self.switch_kernel(kinfo.name, in_vars)
+            if in_vars:
+                # variables are passed directly if the language modules of both
+                # kernels support a common data format, and through SoS otherwise
+                self.transferred_vars.forget(kinfo.name, in_vars)
+                in_vars = await self.transfer_data_between(
+                    in_vars, self.kernel, kinfo.name
+                )
+            if in_vars:
+                await self.switch_kernel("SoS", in_vars)
+                await self.switch_kernel(kinfo.name, in_vars, force=force)
+            else:
+                await self._activate_subkernel(kinfo, kernel)
         else:
             # SoS to non-SoS
-            env.log_to_file("KERNEL", f"Switch from {self.kernel} to {kinfo.name}")
-            # case when self.kernel == 'sos', kernel != 'sos'
-            # to a subkernel
-            new_kernel = False
-            if kinfo.name not in self.kernels:
-                # start a new kernel
-                try:
-                    env.log_to_file("KERNEL", f"Starting subkernel {kinfo.name}")
-                    self.kernels[kinfo.name] = manager.start_new_kernel(
-                        startup_timeout=30, kernel_name=kinfo.kernel, cwd=os.getcwd()
-                    )
-                    new_kernel = True
-                except Exception:
-                    env.log_to_file(
-                        "KERNEL",
-                        f"Failed to start kernel {kinfo.kernel}. Trying again...",
-                    )
-                    # try toget error message
-                    import tempfile
+            await self._activate_subkernel(kinfo, kernel)
+            # passing
+            if in_vars:
+                await self.get_vars_from(in_vars, as_var=as_var, force=force)
+
+    async def _activate_subkernel(self, kinfo, kernel):
+        """Make subkernel kinfo the current kernel, starting it if needed"""
+        env.log_to_file("KERNEL", f"Switch from {self.kernel} to {kinfo.name}")
+        await self._ensure_subkernel(kinfo, kernel)
+        self.KM, self.KC = self.kernels[kinfo.name]
+        self.kernel = kinfo.name
+        self.kernel_evictor.touch(kinfo.name, executed=False)
+
+    async def _ensure_subkernel(self, kinfo, kernel):
+        """Start subkernel kinfo if it is not running"""
+        if kinfo.name in self.kernels:
+            return
+        lan_module = None
+        if kinfo.language in self.supported_languages:
+            lan_module = self.language_modules.get(kinfo).instance
+            if hasattr(lan_module, "__version__"):
+                module_version = f" (version {lan_module.__version__})"
+            else:
+                module_version = " (version unavailable)"
 
-                    with tempfile.TemporaryFile() as ferr:
-                        try:
-                            # this should fail, but sometimes the second attempt will succeed #282
-                            self.kernels[kinfo.name] = manager.start_new_kernel(
-                                startup_timeout=60,
-                                kernel_name=kinfo.kernel,
-                                cwd=os.getcwd(),
-                                stdout=subprocess.DEVNULL,
-                                stderr=ferr,
-                            )
-                            new_kernel = True
-                            env.log_to_file(
-                                "KERNEL",
-                                f"Kernel {kinfo.kernel} started with the second attempt.",
-                            )
-                        except Exception as e:
-                            ferr.seek(0)
-                            raise RuntimeError(
-                                f'Failed to start kernel "{kernel}". {e}\nError Message:\n{ferr.read().decode()}'
-                            ) from e
-            self.KM, self.KC = self.kernels[kinfo.name]
-            self.kernel = kinfo.name
-            if new_kernel and not kinfo.codemirror_mode:
-                self.KC.kernel_info()
-                kinfo.codemirror_mode = self.KC.get_shell_msg(timeout=10)["content"][
-                    "language_info"
-                ].get("codemirror_mode", "")
-                self.subkernels.notify_frontend()
-            if new_kernel and kinfo.language in self.supported_languages:
-                lan_module = self.supported_languages[kinfo.language](
-                    self, kinfo.kernel
-                )
-                init_stmts = lan_module.init_statements
+            env.log_to_file(
+                "KERNEL",
+                f"Loading language module for kernel {kinfo.name}{module_version}",
+            )
+        started = await self.kernel_pool.take(kinfo.name, kinfo.kernel)
+        if started is not None:
+            env.log_to_file("KERNEL", f"Using prestarted subkernel {kinfo.name}")
+        else:
+            # init statements are executed by start_subkernel
+            started = await self._start_subkernel(
+                kinfo,
+                kernel,
+                lan_module.init_statements if lan_module else None,
+            )
+        self.kernels[kinfo.name] = started[:2]
+        self.health_monitor.start()
+        self.kernel_evictor.start()
+        if self.kernel_evictor.evicted(kinfo.name):
+            self.send_response(
+                self.iopub_socket,
+                "stream",
+                {
+                    "name": "stdout",
+                    "text": f'Kernel "{kinfo.name}" was shut down while idle '
+                    "to free memory and is restarted\n",
+                },
+            )
+        if not kinfo.codemirror_mode:
+            kinfo.codemirror_mode = started[2]
+            self.subkernels.notify_frontend()
+
+    async def start_subkernels(self, names):
+        """Start subkernels that are not running at the same time, so that it
+        takes about as long as starting the slowest of them"""
+        kinfos = {}
+        for name in names:
+            try:
+                kinfo = self.subkernels.find(name)
+            except Exception as e:
+                self.warn(f"Failed to start subkernel {name}: {e}")
+                continue
+            if kinfo.name != "SoS" and kinfo.name not in self.kernels:
+                kinfos.setdefault(kinfo.name, (kinfo, name))
+        results = await asyncio.gather(
+            *(self._ensure_subkernel(kinfo, name) for kinfo, name in kinfos.values()),
+            return_exceptions=True,
+        )
+        for name, result in zip(kinfos, results):
+            if isinstance(result, Exception):
+                self.warn(f"Failed to start subkernel {name}: {result}")
 
-                if hasattr(lan_module, "__version__"):
-                    module_version = f" (version {lan_module.__version__})"
-                else:
-                    module_version = " (version unavailable)"
+    async def _start_subkernel(self, kinfo, kernel, init_statements):
+        try:
+            env.log_to_file("KERNEL", f"Starting subkernel {kinfo.name}")
+            return await start_subkernel(
+                kinfo.kernel,
+                startup_timeout=30,
+                init_statements=init_statements,
+                cwd=os.getcwd(),
+            )
+        except Exception:
+            env.log_to_file(
+                "KERNEL",
+                f"Failed to start kernel {kinfo.kernel}. Trying again...",
+            )
+        # try toget error message
+        import tempfile
 
+        with tempfile.TemporaryFile() as ferr:
+            try:
+                # this should fail, but sometimes the second attempt will succeed #282
+                started = await start_subkernel(
+                    kinfo.kernel,
+                    startup_timeout=60,
+                    init_statements=init_statements,
+                    cwd=os.getcwd(),
+                    stdout=subprocess.DEVNULL,
+                    stderr=ferr,
+                )
                 env.log_to_file(
                     "KERNEL",
-                    f"Loading language module for kernel {kinfo.name}{module_version}",
+                    f"Kernel {kinfo.kernel} started with the second attempt.",
                 )
-                if init_stmts:
-                    await self.run_cell(init_stmts, True, False)
-            # passing
-            if in_vars:
-                await self.get_vars_from(in_vars, as_var=as_var)
+                return started
+            except Exception as e:
+                ferr.seek(0)
+                raise RuntimeError(
+                    f'Failed to start kernel "{kernel}". {e}\nError Message:\n{ferr.read().decode()}'
+                ) from e
+
+    def prestart_subkernels(self, names):
+        """Start subkernels in the background so that they are ready when they
+        are used, if the warm pool of subkernels is enabled"""
+        if not self.kernel_pool.enabled:
+            return
+        for name in names:
+            try:
+                kinfo = self.subkernels.find(name, notify_frontend=False)
+            except Exception as e:
+                env.log_to_file("KERNEL", f"Cannot prestart subkernel {name}: {e}")
+                continue
+            if (
+                kinfo.name == "SoS"
+                or kinfo.name in self.kernels
+                or kinfo.name in self.kernel_pool
+            ):
+                continue
+            init_statements = None
+            if kinfo.language in self.supported_languages:
+                init_statements = self.language_modules.get(
+                    kinfo
+                ).instance.init_statements
+            if not self.kernel_pool.prestart(kinfo.name, kinfo.kernel, init_statements):
+                break
+
+    def discard_subkernel(self, kernel):
+        """Forget subkernel kernel, which is or is being shut down"""
+        self.kernels.pop(kernel, None)
+        self.health_monitor.forget(kernel)
+        self.transferred_vars.forget(kernel)
+        self.language_modules.invalidate(kernel)
 
     def shutdown_kernel(self, kernel, restart=False):
         kernel = self.subkernels.find(kernel).name
@@ -1132,11 +1722,11 @@ class SoS_Kernel(IPythonKernel):
                 if self.kernel == kernel:
                     asyncio.run(self.switch_kernel("SoS"))
                 try:
-                    self.kernels[kernel][0].shutdown_kernel(restart=False)
+                    self.kernels[kernel][0].sync_shutdown_kernel(restart=False)
                 except Exception as e:
                     self.warn(f"Failed to shutdown kernel {kernel}: {e}\n")
                 finally:
-                    self.kernels.pop(kernel)
+                    self.discard_subkernel(kernel)
         else:
             self.send_response(
                 self.iopub_socket,
@@ -1150,73 +1740,114 @@ class SoS_Kernel(IPythonKernel):
             )
         # stop_controller(self.controller)
 
-    # def get_response(self, statement, msg_types, name=None):
-    #     return asyncio.run(self._async_get_response(statement, msg_types, name))
-
-    def get_response(self, statement, msg_types, name=None):
-        # get response of statement of specific msg types.
+    def _execute_requests(self, statements):
+        # discard messages left by previous requests
         while self.KC.shell_channel.msg_ready():
             self.KC.shell_channel.get_msg()
         while self.KC.iopub_channel.msg_ready():
             sub_msg = self.KC.iopub_channel.get_msg()
             if sub_msg["header"]["msg_type"] != "status":
-                env.log_to_file(
+                tracer.debug(
                     "MESSAGE",
-                    f"Overflow message in iopub {sub_msg['header']['msg_type']} {sub_msg['content']}",
+                    "Overflow message in iopub %s %s",
+                    sub_msg["header"]["msg_type"],
+                    sub_msg["content"],
                 )
-        responses = []
-        self.KC.execute(statement, silent=False, store_history=False)
-        # first thing is wait for any side effects (output, stdin, etc.)
-        iopub_started = False
-        iopub_ended = False
-        shell_ended = False
-        while not (iopub_started and iopub_ended and shell_ended):
-            # display intermediate print statements, etc.
-            while self.KC.iopub_channel.msg_ready():
-                sub_msg = self.KC.iopub_channel.get_msg()
-                msg_type = sub_msg["header"]["msg_type"]
-                env.log_to_file("MESSAGE", f"Received {msg_type} {sub_msg['content']}")
-                if msg_type == "status":
-                    if sub_msg["content"]["execution_state"] == "busy":
-                        iopub_started = True
-                    elif (
-                        iopub_started
-                        and sub_msg["content"]["execution_state"] == "idle"
-                    ):
-                        iopub_ended = True
-                    continue
-                if msg_type in msg_types and (
-                    name is None
-                    or sub_msg["content"].get("name", None) in name
-                    or any(x in name for x in sub_msg["content"].keys())
-                ):
-                    env.log_to_file(
-                        "MESSAGE", f"Capture response: {msg_type}: {sub_msg['content']}"
-                    )
-                    responses.append([msg_type, sub_msg["content"]])
-                else:
-                    env.log_to_file(
-                        "MESSAGE", f"Non-response: {msg_type}: {sub_msg['content']}"
-                    )
-                    #
-                    # we ignore the messages we are not interested.
-                    #
-                    # self.send_response(
-                    #    self.iopub_socket, msg_type, sub_msg['content'])
-            if self.KC.shell_channel.msg_ready():
-                # now get the real result
-                reply = self.KC.get_shell_msg()
-                env.log_to_file("MESSAGE", f"GET SHELL MSG {reply}")
-                shell_ended = True
-            time.sleep(0.001)
-
-        if not responses:
-            env.log_to_file(
-                "MESSAGE",
-                f"Failed to get a response from message type {msg_types} for the execution of {statement}",
+        # statements are executed independently, as if they were sent one by one
+        return [
+            self.KC.execute(
+                statement, silent=False, store_history=False, stop_on_error=False
             )
+            for statement in statements
+        ]
+
+    def _get_deadline(self, timeout):
+        if timeout is None:
+            timeout = self.response_timeout
+        return time.monotonic() + timeout if timeout else None
+
+    def _abort_requests(self, collector, statements, reason):
+        # the subkernel is interrupted so that it can process later requests
+        pending = [
+            statement
+            for msg_id, statement in zip(collector.responses, statements)
+            if msg_id in collector.pending
+        ]
+        tracer.info("MESSAGE", "Interrupt kernel %s: %s", self.kernel, reason)
+        self.KM.sync_interrupt_kernel()
+        return f"{reason} from kernel {self.kernel} for the execution of {pending}"
+
+    def _wait_for_interrupted(self, collector, poller, grace=5):
+        # wait for the replies to interrupted requests so that they will not
+        # be mistaken as responses to later requests
+        deadline = time.monotonic() + grace
+        while not collector.done and time.monotonic() < deadline:
+            collector.process(poller.wait(deadline - time.monotonic()))
+
+    def _collected_responses(self, collector, statements):
+        responses = list(collector.responses.values())
+        for statement, response in zip(statements, responses):
+            if not response:
+                env.log_to_file(
+                    "MESSAGE",
+                    f"Failed to get a response from message type {collector.msg_types} for the execution of {statement}",
+                )
         return responses
 
+    def get_response(self, statement, msg_types, name=None, timeout=None):
+        """Execute statement in the current subkernel and return a list of
+        [msg_type, content] of iopub messages of specified msg_types, and with
+        stream names or content keys in name if specified. A TimeoutError is
+        raised after interrupting the subkernel if it does not complete the
+        execution in timeout seconds (option response_timeout by default)."""
+        return self.get_responses([statement], msg_types, name, timeout)[0]
+
+    def get_responses(self, statements, msg_types, name=None, timeout=None):
+        """Execute statements in the current subkernel without waiting for the
+        completion of previous ones and return responses to each statement.
+        See get_response for details."""
+        collector = ResponseCollector(
+            self.KC, self._execute_requests(statements), msg_types, name
+        )
+        deadline = self._get_deadline(timeout)
+        poller = ChannelPoller(self.KC, channels=("iopub", "shell"))
+        while not collector.done:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                reason = self._abort_requests(collector, statements, "No response")
+                self._wait_for_interrupted(collector, poller)
+                raise TimeoutError(reason)
+            collector.process(poller.wait(remaining))
+        return self._collected_responses(collector, statements)
+
+    async def async_get_response(self, statement, msg_types, name=None, timeout=None):
+        """Awaitable version of get_response. The subkernel is interrupted if
+        the awaiting task is cancelled."""
+        return (await self.async_get_responses([statement], msg_types, name, timeout))[
+            0
+        ]
+
+    async def async_get_responses(self, statements, msg_types, name=None, timeout=None):
+        """Awaitable version of get_responses"""
+        collector = ResponseCollector(
+            self.KC, self._execute_requests(statements), msg_types, name
+        )
+        deadline = self._get_deadline(timeout)
+        poller = ChannelPoller(self.KC, channels=("iopub", "shell"))
+        try:
+            while not collector.done:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    reason = self._abort_requests(collector, statements, "No response")
+                    self._wait_for_interrupted(collector, poller)
+                    raise TimeoutError(reason)
+                collector.process(await poller.async_wait(remaining))
+        except asyncio.CancelledError:
+            self._abort_requests(collector, statements, "Cancelled request")
+            self._wait_for_interrupted(collector, poller)
+            raise
+        return self._collected_responses(collector, statements)
+
     def run_sos_code(self, code, silent):
         code = dedent(code)
         with self.redirect_sos_io():
@@ -1264,14 +1895,14 @@ class SoS_Kernel(IPythonKernel):
         return res
 
     def send_result(self, res, silent=False):
+        # output of the cell is sent before its result
+        self.flush_sos_io()
         # this is Ok, send result back
         if not silent and res is not None:
             format_dict, md_dict = self.format_obj(self.render_result(res))
             if self._meta["capture_result"] is not None:
                 self._meta["capture_result"].append(("execute_result", format_dict))
-            env.log_to_file(
-                "MESSAGE", f"IOPUB execute_result with content {format_dict}"
-            )
+            tracer.debug("MESSAGE", "IOPUB execute_result with content %s", format_dict)
             self.send_response(
                 self.iopub_socket,
                 "execute_result",
@@ -1284,7 +1915,7 @@ class SoS_Kernel(IPythonKernel):
 
     def init_metadata(self, metadata):
         super().init_metadata(metadata)
-        env.log_to_file("KERNEL", f"GOT METADATA {metadata}")
+        tracer.debug("KERNEL", "GOT METADATA %s", metadata)
         if "sos" in metadata["metadata"]:
             # jupyterlab-sos sends meta data through metadata
             meta = metadata["metadata"]["sos"]
@@ -1310,9 +1941,10 @@ class SoS_Kernel(IPythonKernel):
                 "batch_mode": False,
                 "suppress_error": False,
             }
+            self._output_budget = self.new_output_budget()
             return self._meta
 
-        env.log_to_file("KERNEL", f"Meta info: {meta}")
+        tracer.debug("KERNEL", "Meta info: %s", meta)
         self._meta = {
             "workflow": meta["workflow"] if "workflow" in meta else "",
             "workflow_mode": False,
@@ -1331,6 +1963,7 @@ class SoS_Kernel(IPythonKernel):
             "batch_mode": meta.get("batch_mode", False),
             "suppress_error": False,
         }
+        self._output_budget = self.new_output_budget(meta.get("output_budget", None))
         # remove path and extension
         self._meta["notebook_name"] = os.path.basename(
             self._meta["notebook_path"]
@@ -1348,12 +1981,20 @@ class SoS_Kernel(IPythonKernel):
     async def do_execute(
         self, code, silent, store_history=True, user_expressions=None, allow_stdin=True
     ):
-        env.log_to_file("KERNEL", f"execute: {code}")
+        # changes to the kernel list are sent to the frontend once per request
+        with self.subkernels.batch_notifications():
+            return await self._do_execute_request(
+                code, silent, store_history, user_expressions, allow_stdin
+            )
+
+    async def _do_execute_request(
+        self, code, silent, store_history=True, user_expressions=None, allow_stdin=True
+    ):
+        tracer.debug("KERNEL", "execute: %s", code)
         if not self.controller:
             self.controller = start_controller(self)
         # load basic configuration each time in case user modifies the configuration during
-        # runs. This is not very efficient but should not matter much during interactive
-        # data analysis
+        # runs. Configuration files are parsed again only if they have been changed.
         try:
             load_config_files()
         except Exception as e:
@@ -1390,6 +2031,8 @@ class SoS_Kernel(IPythonKernel):
             )
         except Exception as e:
             return self.notify_error(e)
+        finally:
+            self.close_output_budget()
         if ret is None:
             ret = {
                 "status": "ok",
@@ -1414,12 +2057,27 @@ class SoS_Kernel(IPythonKernel):
             self._real_execution_count += 1
         self._execution_count = self._real_execution_count
         # make sure post_executed is triggered after the completion of all cell content
-        self.shell.user_ns.update(env.sos_dict._dict)
+        self.sync_user_ns()
         # trigger post processing of object and display matplotlib figures
         self.shell.events.trigger("post_execute")
         # tell the frontend the kernel for the "next" cell
         return ret
 
+    def sync_user_ns(self):
+        """Copy variables that are added to or changed in sos_dict since the
+        last cell to the IPython namespace, and remove deleted variables from
+        it. Added, changed and removed variables are kept in sos_dict_changes
+        for hooks such as post_execute."""
+        sos_dict = env.sos_dict._dict
+        self.sos_dict_changes = self._sos_dict_tracker.changes(sos_dict)
+        added, changed, removed = self.sos_dict_changes
+        user_ns = self.shell.user_ns
+        for key in added + changed:
+            user_ns[key] = sos_dict[key]
+        for key in removed:
+            if not key.startswith("__"):
+                user_ns.pop(key, None)
+
     async def _do_execute(
         self, code, silent, store_history=True, user_expressions=None, allow_stdin=True
     ):
@@ -1429,11 +2087,11 @@ class SoS_Kernel(IPythonKernel):
             # this is a special probing command from vim-ipython. Let us handle it specially
             # so that vim-python can get the pid.
             return
-        for magic in self.magics.values():
-            if magic.match(code):
-                return await magic.apply(
-                    code, silent, store_history, user_expressions, allow_stdin
-                )
+        magic = self.magics.match(code)
+        if magic is not None:
+            return await magic.apply(
+                code, silent, store_history, user_expressions, allow_stdin
+            )
         if self.kernel != "SoS":
             # handle string interpolation before sending to the underlying kernel
             if self._meta["cell_id"] != "0" and not self._meta["batch_mode"]:
@@ -1442,6 +2100,9 @@ class SoS_Kernel(IPythonKernel):
                 )
             if code is None or not code.strip():
                 return
+            # variables that have been sent to the kernel could be changed by
+            # the cell so they will be sent again
+            self.transferred_vars.forget(self.kernel)
             try:
                 # We remove leading new line in case that users have a SoS
                 # magic and a cell magic, separated by newline.
@@ -1499,9 +2160,14 @@ class SoS_Kernel(IPythonKernel):
             return
         self._shutting_down = True
         try:
+            self.health_monitor.stop()
+            self.kernel_evictor.stop()
+            self.kernel_pool.shutdown()
             for name, (km, _) in self.kernels.items():
+                self.transferred_vars.forget(name)
+                self.language_modules.invalidate(name)
                 try:
-                    km.shutdown_kernel(restart=restart)
+                    km.sync_shutdown_kernel(restart=restart)
                 except Exception as e:
                     self.warn(f"Failed to shutdown kernel {name}: {e}")
         finally:
@@ -1538,7 +2204,88 @@ def _get_comm_manager(*args, **kwargs):
 
 comm.get_comm_manager = _get_comm_manager
 
+
+def profile_startup(top=15, budget=None, kernel_name="sos"):
+    """Report the time spent on importing sos_notebook.kernel, the slowest
+    modules imported by sos_notebook, and the time taken by a SoS kernel to
+    reply to kernel_info and to execute its first cell. Return 1 if the time
+    to kernel_info exceeds budget (in seconds)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sos_notebook.kernel"],
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:") :].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((level, name.strip(), int(self_us), int(cumulative)))
+    # modules are listed after the modules they import
+    parents = {}
+    current = {}
+    for level, name, _, _ in reversed(entries):
+        current[level] = name
+        parents[name] = current.get(level - 1, "")
+    total = max(x[3] for x in entries if x[1] == "sos_notebook.kernel")
+    print(f"Importing sos_notebook.kernel: {total / 1000:.0f} ms")
+    print("\nSlowest imports by sos_notebook modules:")
+    print(f"{'cumulative':>12}{'self':>10}  module (imported by)")
+    imports = sorted(
+        (x for x in entries if parents[x[1]].startswith("sos_notebook")),
+        key=lambda x: -x[3],
+    )
+    for _, name, self_us, cumulative in imports[:top]:
+        print(
+            f"{cumulative / 1000:>10.1f}ms{self_us / 1000:>8.1f}ms  {name} ({parents[name]})"
+        )
+
+    km = manager.KernelManager(kernel_name=kernel_name)
+    start_time = time.monotonic()
+    km.start_kernel()
+    kc = km.client()
+    try:
+        kc.start_channels()
+        kc.wait_for_ready(timeout=120)
+        ready = time.monotonic() - start_time
+        kc.execute_interactive("", output_hook=lambda msg: None, timeout=120)
+        first_cell = time.monotonic() - start_time
+    finally:
+        kc.stop_channels()
+        km.shutdown_kernel(now=True)
+    print(f"\nStarting kernel {kernel_name}:")
+    print(f"{ready * 1000:>10.0f}ms  reply to kernel_info")
+    print(f"{first_cell * 1000:>10.0f}ms  execution of first cell")
+    if budget is not None and ready > budget:
+        print(f"\nStartup time exceeds the budget of {budget} seconds")
+        return 1
+    return 0
+
+
 if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        import argparse
+
+        parser = argparse.ArgumentParser(
+            prog="python -m sos_notebook.kernel",
+            description="""Report import and startup time of the SoS kernel""",
+        )
+        parser.add_argument("--profile-startup", action="store_true")
+        parser.add_argument(
+            "--top", type=int, default=15, help="Number of slowest imports to show"
+        )
+        parser.add_argument(
+            "--budget",
+            type=float,
+            help="""Maximum time in seconds for the kernel to reply to kernel_info,
+            exit with status 1 if exceeded.""",
+        )
+        parser.add_argument("--kernel", default="sos", help="Kernel to start")
+        args = parser.parse_args()
+        sys.exit(profile_startup(args.top, args.budget, args.kernel))
+
     from ipykernel.kernelapp import IPKernelApp
 
     IPKernelApp.launch_instance(kernel_class=SoS_Kernel)
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import asyncio
+import os
+import signal
+import time
+
+from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_core.utils import run_sync
+from sos.utils import env
+from traitlets import DottedObjectName, Type
+
+from .kernelspecs import kernel_info_cache
+from .relay import ChannelPoller
+
+
+class SubkernelManager(AsyncKernelManager):
+    """Asynchronous manager of subkernels, so that several subkernels can be
+    started at the same time, with synchronous versions of the methods that
+    are called from synchronous code of SoS. Its clients are blocking clients
+    that are used by the message relay of SoS."""
+
+    client_class = DottedObjectName("jupyter_client.blocking.BlockingKernelClient")
+    client_factory = Type(klass="jupyter_client.blocking.BlockingKernelClient")
+
+    sync_is_alive = run_sync(AsyncKernelManager.is_alive)
+    sync_interrupt_kernel = run_sync(AsyncKernelManager.interrupt_kernel)
+    sync_shutdown_kernel = run_sync(AsyncKernelManager.shutdown_kernel)
+
+
+async def wait_for_channels(kc, timeout=60):
+    """Wait for the channels of a blocking client to a running kernel to be
+    connected, namely when the kernel replies to a kernel_info request and the
+    client receives messages from iopub, without blocking the event loop.
+    Return the content of the kernel_info reply."""
+    poller = ChannelPoller(kc, channels=("iopub", "shell"))
+    deadline = time.monotonic() + timeout
+    msg_id = kc.kernel_info()
+    replied = None
+    connected = False
+    while not (replied and connected):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError(f"Kernel didn't respond in {timeout} seconds")
+        ready = await poller.async_wait(min(remaining, 1))
+        while kc.iopub_channel.msg_ready():
+            kc.iopub_channel.get_msg()
+            connected = True
+        if "shell" in ready:
+            reply = kc.get_shell_msg()
+            if reply["parent_header"].get("msg_id") == msg_id:
+                replied = reply["content"]
+        elif not ready and not connected:
+            # status messages of the last request might have been sent before
+            # the iopub channel was connected
+            msg_id = kc.kernel_info()
+            replied = None
+    return replied
+
+
+async def start_subkernel(
+    kernel_name, startup_timeout=60, init_statements=None, **kwargs
+):
+    """Start a subkernel and wait for it to be ready without blocking the event
+    loop, execute init_statements in it, and return its manager, a blocking
+    client for the message relay of SoS, and its codemirror mode. The kernel
+    should be ready in startup_timeout seconds, but init statements can take
+    as long as they need. The codemirror mode is read from the kernel_info
+    reply that signals the readiness of the client, and is saved to
+    kernel_info_cache. Keyword arguments are passed to
+    AsyncKernelManager.start_kernel."""
+    km = SubkernelManager(kernel_name=kernel_name)
+    await km.start_kernel(**kwargs)
+    kc = None
+    try:
+        akc = AsyncKernelClient(
+            **km.get_connection_info(session=True),
+            connection_file=km.connection_file,
+            parent=km,
+        )
+        akc.start_channels()
+        try:
+            await akc.wait_for_ready(timeout=startup_timeout)
+            if init_statements:
+                await akc.execute_interactive(
+                    init_statements,
+                    silent=True,
+                    store_history=False,
+                    output_hook=lambda msg: None,
+                    timeout=None,
+                )
+        finally:
+            akc.stop_channels()
+        kc = km.client()
+        kc.start_channels()
+        reply = await wait_for_channels(kc, timeout=startup_timeout)
+    except BaseException:
+        # including cancellation of the starting task
+        if kc is not None:
+            kc.stop_channels()
+        km.sync_shutdown_kernel(now=True)
+        raise
+    language_info = reply.get("language_info", {})
+    kernel_info_cache.set(kernel_name, language_info)
+    return km, kc, language_info.get("codemirror_mode", "")
+
+
+class PrestartedKernel:
+    def __init__(self, name, kernel_name, cwd, task):
+        self.name = name
+        self.kernel_name = kernel_name
+        self.cwd = cwd
+        self.task = task
+        self.timer = None
+
+
+class KernelPool:
+    """A warm pool of subkernels that are started in the background, with
+    init statements of their language modules executed, before they are
+    used. Up to size kernels are kept in the pool, and kernels that are not
+    used within idle_timeout seconds after they are started are shut down.
+    Kernels in the pool are started concurrently as tasks of the event loop
+    of the SoS kernel."""
+
+    def __init__(self, size=0, idle_timeout=600):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._kernels = {}
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def __contains__(self, name):
+        return name in self._kernels
+
+    def prestart(self, name, kernel_name, init_statements=None):
+        """Start kernel kernel_name for subkernel name in the background if the
+        pool is not full"""
+        if name in self._kernels or len(self._kernels) >= self.size:
+            return False
+        env.log_to_file("KERNEL", f"Prestarting subkernel {name} ({kernel_name})")
+        kernel = PrestartedKernel(name, kernel_name, os.getcwd(), None)
+        kernel.task = asyncio.ensure_future(
+            start_subkernel(
+                kernel_name, init_statements=init_statements, cwd=kernel.cwd
+            )
+        )
+        kernel.task.add_done_callback(lambda task: self._started(kernel))
+        self._kernels[name] = kernel
+        return True
+
+    def _started(self, kernel):
+        if (
+            self._kernels.get(kernel.name, None) is not kernel
+            or kernel.task.cancelled()
+            or kernel.task.exception() is not None
+            or self.idle_timeout <= 0
+        ):
+            return
+        kernel.timer = asyncio.get_event_loop().call_later(
+            self.idle_timeout, self._expire, kernel
+        )
+
+    def _expire(self, kernel):
+        if self._kernels.get(kernel.name, None) is not kernel:
+            return
+        env.log_to_file(
+            "KERNEL", f"Shutting down idle prestarted subkernel {kernel.name}"
+        )
+        self._kernels.pop(kernel.name)
+        self._shutdown(kernel)
+
+    async def take(self, name, kernel_name):
+        """Remove the kernel for subkernel name from the pool and return its
+        kernel manager, client, and codemirror mode, waiting for it to be ready
+        if it is still starting. None is returned if no such kernel is in the
+        pool, or if it can no longer be used because it failed to start or the
+        kernel name or working directory have changed."""
+        kernel = self._kernels.pop(name, None)
+        if kernel is None:
+            return None
+        if kernel.timer is not None:
+            kernel.timer.cancel()
+        if kernel.kernel_name != kernel_name or kernel.cwd != os.getcwd():
+            self._shutdown(kernel)
+            return None
+        try:
+            return await kernel.task
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to prestart subkernel {name}: {e}")
+            return None
+
+    def _shutdown(self, kernel):
+        if kernel.timer is not None:
+            kernel.timer.cancel()
+        if not kernel.task.done():
+            # the kernel is shut down by start_subkernel
+            kernel.task.cancel()
+            return
+        if kernel.task.cancelled() or kernel.task.exception() is not None:
+            return
+        km, kc, _ = kernel.task.result()
+        try:
+            kc.stop_channels()
+            km.sync_shutdown_kernel(now=True)
+        except Exception as e:
+            env.log_to_file(
+                "KERNEL", f"Failed to shutdown prestarted kernel {kernel.name}: {e}"
+            )
+
+    def shutdown(self):
+        """Shut down all kernels in the pool"""
+        kernels = list(self._kernels.values())
+        self._kernels.clear()
+        for kernel in kernels:
+            self._shutdown(kernel)
+
+
+def exit_reason(km):
+    """Describe how the kernel process of km exited"""
+    code = getattr(getattr(km.provisioner, "process", None), "returncode", None)
+    if code is None:
+        return "exited"
+    if code >= 0:
+        return f"exited with code {code}"
+    try:
+        reason = f"was killed by {signal.Signals(-code).name}"
+    except ValueError:
+        reason = f"was killed by signal {-code}"
+    if -code == signal.SIGKILL:
+        reason += ", possibly because the system ran out of memory"
+    return reason
+
+
+class HealthMonitor:
+    """Check every interval seconds in the background whether running
+    subkernels are alive, so that subkernels that crashed, or were killed
+    when the system ran out of memory, are detected before cells are executed
+    in them. Crashes are reported to the frontend with kernel-status messages
+    and, if auto_restart is set, crashed subkernels are restarted in the
+    background with init statements of their language modules. The checks
+    are scheduled on the event loop of the SoS kernel and are therefore not
+    run while a cell is being executed."""
+
+    def __init__(self, sos_kernel, interval=5, auto_restart=True):
+        self.sos_kernel = sos_kernel
+        self.interval = interval
+        self.auto_restart = auto_restart
+        self._timer = None
+        self._restarting = {}
+        self._crashed = {}
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and self._timer is None:
+            self._schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in self._restarting.values():
+            task.cancel()
+        self._restarting.clear()
+
+    def _schedule(self):
+        self._timer = asyncio.get_event_loop().call_later(self.interval, self._check)
+
+    def _check(self):
+        try:
+            for name, (km, kc) in list(self.sos_kernel.kernels.items()):
+                if name not in self._restarting and not km.sync_is_alive():
+                    self._crash(name, km, kc)
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to check health of subkernels: {e}")
+        finally:
+            self._schedule()
+
+    def _notify(self, name, status, reason=""):
+        self.sos_kernel.send_frontend_msg(
+            "kernel-status", {"name": name, "status": status, "reason": reason}
+        )
+
+    def _crash(self, name, km, kc):
+        reason = exit_reason(km)
+        env.log_to_file("KERNEL", f"Subkernel {name} {reason}")
+        self._crashed[name] = reason
+        self.sos_kernel.transferred_vars.forget(name)
+        self.sos_kernel.language_modules.invalidate(name)
+        self._notify(name, "dead", reason)
+        if self.auto_restart:
+            self._restarting[name] = asyncio.ensure_future(self._restart(name, km, kc))
+
+    async def _restart(self, name, km, kc):
+        try:
+            kc.stop_channels()
+            await km.cleanup_resources()
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to clean up subkernel {name}: {e}")
+        try:
+            kinfo = self.sos_kernel.subkernels.find(name)
+            module = self.sos_kernel.language_modules.get(kinfo)
+            started = await start_subkernel(
+                kinfo.kernel,
+                startup_timeout=30,
+                init_statements=module.instance.init_statements if module else None,
+                cwd=os.getcwd(),
+            )
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to restart subkernel {name}: {e}")
+            self._notify(name, "failed", str(e))
+            return
+        finally:
+            self._restarting.pop(name, None)
+        kernels = self.sos_kernel.kernels
+        if kernels.get(name, None) != (km, kc):
+            # the subkernel has been shut down or restarted otherwise
+            started[1].stop_channels()
+            await started[0].shutdown_kernel(now=True)
+            return
+        kernels[name] = started[:2]
+        if self.sos_kernel.KM is km:
+            self.sos_kernel.KM, self.sos_kernel.KC = started[:2]
+        env.log_to_file("KERNEL", f"Restarted subkernel {name}")
+        self._notify(name, "restarted")
+
+    async def wait_for(self, name):
+        """Wait for subkernel name to be restarted if it crashed, and return
+        how it crashed, or None if it has not crashed since the last call"""
+        task = self._restarting.get(name, None)
+        if task is not None:
+            await asyncio.wait([task])
+        return self._crashed.pop(name, None)
+
+    def forget(self, name):
+        """Stop restarting subkernel name, which is shut down"""
+        task = self._restarting.pop(name, None)
+        if task is not None:
+            task.cancel()
+        self._crashed.pop(name, None)
+
+
+def kernel_rss(km):
+    """Resident memory in bytes of the kernel process of km and its children"""
+    import psutil
+
+    try:
+        proc = psutil.Process(km.provisioner.pid)
+        procs = [proc, *proc.children(recursive=True)]
+    except Exception:
+        return 0
+    rss = 0
+    for proc in procs:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+class KernelEvictor:
+    """Shut down idle subkernels, least recently used first, when the resident
+    memory of all running subkernels exceeds budget bytes. Subkernels that have
+    not been used for idle_timeout seconds can be shut down, except for the
+    current kernel. Subkernels in which cells have been executed, and which
+    are therefore likely to hold variables, are shut down only if they are
+    still idle idle_timeout seconds after a kernel-status message warns about
+    the eviction. Memory usage is checked every interval seconds in the
+    background, and evicted subkernels are started again when they are used."""
+
+    def __init__(self, sos_kernel, budget=0, idle_timeout=600, interval=5):
+        self.sos_kernel = sos_kernel
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self._timer = None
+        self._last_used = {}
+        self._executed = set()
+        self._warned = {}
+        self._evicted = set()
+
+    @property
+    def enabled(self):
+        return self.budget > 0 and self.interval > 0
+
+    def start(self):
+        if self.enabled and self._timer is None:
+            self._schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self):
+        self._timer = asyncio.get_event_loop().call_later(self.interval, self._check)
+
+    def _check(self):
+        try:
+            self.evict()
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to evict idle subkernels: {e}")
+        finally:
+            self._schedule()
+
+    def touch(self, name, executed=True):
+        """Mark subkernel name as used, and as holding variables if a cell is
+        executed in it"""
+        self._last_used[name] = time.monotonic()
+        if executed:
+            self._executed.add(name)
+
+    def evicted(self, name):
+        """Return True if subkernel name has been evicted since the last call"""
+        if name in self._evicted:
+            self._evicted.discard(name)
+            return True
+        return False
+
+    def _notify(self, name, status, reason):
+        env.log_to_file("KERNEL", f"Subkernel {name}: {reason}")
+        self.sos_kernel.send_frontend_msg(
+            "kernel-status", {"name": name, "status": status, "reason": reason}
+        )
+
+    def evict(self):
+        """Shut down idle subkernels until their memory usage is within budget,
+        and return the names of the subkernels that are shut down"""
+        kernels = self.sos_kernel.kernels
+        usage = {name: kernel_rss(km) for name, (km, _) in kernels.items()}
+        total = sum(usage.values())
+        if total <= self.budget:
+            self._warned.clear()
+            return []
+        now = time.monotonic()
+        evicted = []
+        for name in sorted(usage, key=lambda x: self._last_used.get(x, 0)):
+            if total <= self.budget:
+                break
+            last_used = self._last_used.get(name, 0)
+            if now - last_used < self.idle_timeout:
+                break
+            if name == self.sos_kernel.kernel:
+                continue
+            if name in self._executed:
+                warned = self._warned.get(name, None)
+                if warned is None or warned[0] != last_used:
+                    self._warned[name] = (last_used, now)
+                    self._notify(
+                        name,
+                        "idle",
+                        f"uses {usage[name] // 1048576} MB and will be shut down, "
+                        f"with its variables, if it is not used in "
+                        f"{self.idle_timeout:.0f} seconds",
+                    )
+                    continue
+                if now - warned[1] < self.idle_timeout:
+                    continue
+            km, kc = kernels[name]
+            self.sos_kernel.discard_subkernel(name)
+            try:
+                kc.stop_channels()
+                km.sync_shutdown_kernel(now=True)
+            except Exception as e:
+                env.log_to_file("KERNEL", f"Failed to shut down subkernel {name}: {e}")
+            self._last_used.pop(name, None)
+            self._executed.discard(name)
+            self._warned.pop(name, None)
+            self._evicted.add(name)
+            self._notify(
+                name, "evicted", f"is shut down to free {usage[name] // 1048576} MB"
+            )
+            total -= usage[name]
+            evicted.append(name)
+        return evicted
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import json
+import os
+
+from jupyter_client.kernelspec import KernelSpecManager, NoSuchKernel
+from sos.utils import env
+
+
+class KernelSpecIndex:
+    """Index of installed kernelspecs with their names, languages, display names,
+    argv and resource directories. The index is saved to index_file so that it
+    can be reused by other SoS kernels, and is rebuilt only if any of the
+    kernelspec directories, or the kernel.json file of any indexed kernelspec,
+    has been modified. By default the index is saved under ~/.sos, in a file
+    specific to the kernelspec directories of the current environment."""
+
+    def __init__(self, index_file=None):
+        self._index_file = index_file
+        self._manager = None
+        self._signature = None
+        self._specs = None
+
+    @property
+    def manager(self):
+        if self._manager is None:
+            self._manager = KernelSpecManager()
+        return self._manager
+
+    @property
+    def index_file(self):
+        if self._index_file is None:
+            dirs = hashlib.md5(
+                "\n".join(self.manager.kernel_dirs).encode()
+            ).hexdigest()[:8]
+            self._index_file = os.path.join(
+                os.path.expanduser("~"), ".sos", f"kernelspecs_{dirs}.json"
+            )
+        return self._index_file
+
+    def _get_signature(self, specs):
+        signature = []
+        for path in self.manager.kernel_dirs + [
+            os.path.join(x["resource_dir"], "kernel.json") for x in specs.values()
+        ]:
+            try:
+                st = os.stat(path)
+                signature.append([path, st.st_mtime_ns, st.st_size])
+            except OSError:
+                signature.append([path, None, None])
+        return signature
+
+    def _load(self):
+        try:
+            with open(self.index_file) as index:
+                saved = json.load(index)
+            return saved["signature"], saved["specs"]
+        except Exception:
+            return None, None
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp_file = f"{self.index_file}.{os.getpid()}"
+            with open(tmp_file, "w") as index:
+                json.dump({"signature": self._signature, "specs": self._specs}, index)
+            os.replace(tmp_file, self.index_file)
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to save kernelspec index: {e}")
+
+    def _build(self):
+        specs = {}
+        for name, resource_dir in self.manager.find_kernel_specs().items():
+            try:
+                spec = self.manager.get_kernel_spec(name)
+            except Exception as e:
+                env.log_to_file("KERNEL", f"Failed to load kernelspec {name}: {e}")
+                continue
+            specs[name] = {
+                "name": name,
+                "language": spec.language,
+                "display_name": spec.display_name,
+                "argv": spec.argv,
+                "resource_dir": resource_dir,
+            }
+        return specs
+
+    def specs(self):
+        """Return a dictionary of kernel names and information of their
+        kernelspecs, rebuilding the index if kernelspecs have been changed"""
+        if self._specs is None:
+            self._signature, self._specs = self._load()
+        if self._specs is None or self._signature != self._get_signature(self._specs):
+            self._specs = self._build()
+            self._signature = self._get_signature(self._specs)
+            self._save()
+        return self._specs
+
+    def get(self, name):
+        """Return information of kernelspec name, raise NoSuchKernel if the
+        kernel is not installed"""
+        specs = self.specs()
+        if name not in specs:
+            raise NoSuchKernel(name)
+        return specs[name]
+
+    def invalidate(self):
+        """Force the rebuild of the index"""
+        self._signature = None
+        self._specs = None
+        try:
+            os.remove(self.index_file)
+        except OSError:
+            pass
+
+
+kernelspec_index = KernelSpecIndex()
+
+
+class KernelInfoCache:
+    """language_info of kernels, as replied to kernel_info requests, saved to
+    cache_file (~/.sos/kernel_info.json by default) so that codemirror modes
+    of subkernels are known before the subkernels are started. An entry is
+    keyed on the argv and the kernel.json file of the kernelspec and is not
+    used if the kernelspec has been modified."""
+
+    def __init__(self, cache_file=None, index=None):
+        self.cache_file = cache_file or os.path.join(
+            os.path.expanduser("~"), ".sos", "kernel_info.json"
+        )
+        self.index = index or kernelspec_index
+        self._cache = None
+
+    def _get_signature(self, name, signatures=None):
+        if signatures is not None and name in signatures:
+            return signatures[name]
+        spec = self.index.specs().get(name, None)
+        if spec is None:
+            return None
+        return self._spec_signature(spec)
+
+    def _spec_signature(self, spec):
+        try:
+            st = os.stat(os.path.join(spec["resource_dir"], "kernel.json"))
+        except OSError:
+            return None
+        return [spec["argv"], st.st_mtime_ns, st.st_size]
+
+    def signatures(self, specs=None):
+        """Return signatures of kernelspecs in specs (all indexed kernelspecs by
+        default), which can be passed to get and codemirror_mode so that the
+        index is not checked for each of many kernels"""
+        if specs is None:
+            specs = self.index.specs()
+        return {name: self._spec_signature(spec) for name, spec in specs.items()}
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_file) as cache:
+                    self._cache = json.load(cache)
+            except Exception:
+                self._cache = {}
+        return self._cache
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.{os.getpid()}"
+            with open(tmp_file, "w") as cache:
+                json.dump(self._cache, cache)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to save kernel info: {e}")
+
+    def get(self, name, signatures=None):
+        """Return saved language_info of kernel name, or None if it has not
+        been saved or the kernelspec has been modified. Signatures returned
+        by signatures() are used if specified."""
+        entry = self._load().get(name, None)
+        if entry is None or entry["signature"] != self._get_signature(name, signatures):
+            return None
+        return entry["language_info"]
+
+    def set(self, name, language_info):
+        signature = self._get_signature(name)
+        if signature is None:
+            return
+        entry = {"signature": signature, "language_info": language_info}
+        if self._load().get(name, None) != entry:
+            self._cache[name] = entry
+            self._save()
+
+    def codemirror_mode(self, name, signatures=None):
+        """Saved codemirror mode of kernel name, or an empty string if unknown"""
+        language_info = self.get(name, signatures)
+        return (language_info or {}).get("codemirror_mode", "") or ""
+
+
+kernel_info_cache = KernelInfoCache()
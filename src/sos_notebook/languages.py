@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import importlib
+import inspect
+import json
+import os
+from importlib import metadata
+
+from sos.utils import env
+
+
+class PluginInfo:
+    """Attributes of a language module that are needed to list subkernels,
+    read from the manifest of language modules without importing it"""
+
+    def __init__(self, module, supported_kernels, background_color, options):
+        self.module = module
+        self.supported_kernels = supported_kernels
+        self.background_color = background_color
+        self.options = options
+
+
+class LanguagePlugins:
+    """Language modules registered as sos_languages entry points. Names, supported
+    kernels, background colors and options of the modules are read from a
+    manifest saved to manifest_file (~/.sos/language_plugins.json by default),
+    which is keyed on the entry points and versions of their distributions, so
+    that a language module is imported only when a subkernel of the language is
+    used. Modules that are not in the manifest are imported once to record
+    their attributes. Modules that fail to load are recorded in failed and are
+    not imported again by the kernel unless retry is called."""
+
+    def __init__(self, failed=None, manifest_file=None):
+        self.failed = {} if failed is None else failed
+        self.manifest_file = manifest_file or os.path.join(
+            os.path.expanduser("~"), ".sos", "language_plugins.json"
+        )
+        self._entrypoints = {}
+        self._info = {}
+        self._plugins = {}
+        self._discover()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file) as manifest:
+                return json.load(manifest)
+        except Exception:
+            return {}
+
+    def _save_manifest(self, manifest):
+        try:
+            os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+            tmp_file = f"{self.manifest_file}.{os.getpid()}"
+            with open(tmp_file, "w") as out:
+                json.dump(manifest, out, indent=1)
+            os.replace(tmp_file, self.manifest_file)
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to save language manifest: {e}")
+
+    def _discover(self):
+        saved = self._load_manifest()
+        manifest = {}
+        for entrypoint in metadata.entry_points(group="sos_languages"):
+            name = entrypoint.name
+            env.log_to_file("KERNEL", f"Found registered language {name}")
+            self._entrypoints[name] = entrypoint
+            dist = entrypoint.dist
+            key = f"{name}={entrypoint.value}" + (
+                f" ({dist.name} {dist.version})" if dist is not None else ""
+            )
+            if key in saved:
+                manifest[key] = saved[key]
+                self._info[name] = PluginInfo(**saved[key])
+                continue
+            try:
+                plugin = self.load(name)
+            except Exception:
+                # failures are not saved because they can be caused by problems,
+                # such as missing dependencies, that are fixed later
+                continue
+            entry = {
+                "module": plugin.__module__,
+                "supported_kernels": plugin.supported_kernels,
+                "background_color": plugin.background_color,
+                "options": getattr(plugin, "options", {}),
+            }
+            try:
+                json.dumps(entry)
+            except Exception:
+                # attributes that cannot be saved are read from the module
+                continue
+            manifest[key] = entry
+        if manifest != saved:
+            self._save_manifest(manifest)
+
+    def load(self, name):
+        """Import and return the language module, raising the exception of
+        importing the module if it fails to load"""
+        if name in self._plugins:
+            return self._plugins[name]
+        if name in self.failed:
+            raise self.failed[name]
+        if name not in self._entrypoints:
+            raise KeyError(name)
+        try:
+            plugin = self._entrypoints[name].load()
+        except Exception as e:
+            env.log_to_file("KERNEL", f"Failed to load registered language {name}: {e}")
+            self.failed[name] = e
+            raise
+        env.log_to_file("KERNEL", f"Loaded language module of {name}")
+        self._plugins[name] = plugin
+        self._info[name] = plugin
+        return plugin
+
+    def retry(self, name):
+        """Import language module name again if it has failed to load, for
+        example because its dependencies were not installed, and return True if
+        the module is loaded"""
+        if name not in self.failed:
+            return name in self._plugins
+        self.failed.pop(name)
+        importlib.invalidate_caches()
+        try:
+            self.load(name)
+            return True
+        except Exception:
+            return False
+
+    def info(self, name):
+        """Return the loaded language module, or information about the module
+        from the manifest if it has not been loaded"""
+        return self._info[name]
+
+    def module(self, name):
+        """Name of the package of the language module"""
+        info = self._info[name]
+        module = info.module if isinstance(info, PluginInfo) else info.__module__
+        return module.split(".")[0]
+
+    def registered(self, name):
+        return name in self._entrypoints
+
+    def keys(self):
+        return self._info.keys()
+
+    def __contains__(self, name):
+        if name in self._plugins:
+            return True
+        if name not in self._info:
+            return False
+        try:
+            self.load(name)
+            return True
+        except Exception:
+            return False
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def __setitem__(self, name, plugin):
+        self._plugins[name] = plugin
+        self._info[name] = plugin
+
+
+def _accepts(func, arg):
+    try:
+        return arg in inspect.getfullargspec(func).args
+    except TypeError:
+        return False
+
+
+class LanguageModule:
+    """An instance of a language module for a subkernel, with the optional
+    methods and attributes of the instance that are detected once when it is
+    created"""
+
+    def __init__(self, plugin, sos_kernel, kernel):
+        self.plugin = plugin
+        self.kernel = kernel
+        self.instance = plugin(sos_kernel, kernel)
+        self.get_vars_as_var = _accepts(
+            getattr(self.instance, "get_vars", None), "as_var"
+        )
+        self.put_vars_as_var = _accepts(
+            getattr(self.instance, "put_vars", None), "as_var"
+        )
+        self.expand = hasattr(self.instance, "expand")
+        self.preview = callable(getattr(self.instance, "preview", None))
+        self.sessioninfo = hasattr(self.instance, "sessioninfo")
+        self.cd_command = getattr(self.instance, "cd_command", None)
+
+
+class LanguageModules:
+    """Instances of language modules of subkernels, one for each subkernel, so
+    that language modules are not instantiated each time variables are
+    transferred. An instance is created again if the subkernel is redefined
+    with another language or kernel, and should be invalidated if the
+    subkernel is restarted or shut down."""
+
+    def __init__(self, sos_kernel):
+        self.sos_kernel = sos_kernel
+        self._modules = {}
+
+    def _plugin(self, kinfo):
+        languages = self.sos_kernel.supported_languages
+        for name in (kinfo.language, kinfo.name):
+            if name in languages:
+                return languages[name]
+        return None
+
+    def get(self, kinfo):
+        """Return the LanguageModule of subkernel kinfo, or None if the language
+        of the subkernel is not supported"""
+        plugin = self._plugin(kinfo)
+        if plugin is None:
+            self._modules.pop(kinfo.name, None)
+            return None
+        module = self._modules.get(kinfo.name)
+        if (
+            module is None
+            or module.plugin is not plugin
+            or module.kernel != kinfo.kernel
+        ):
+            module = LanguageModule(plugin, self.sos_kernel, kinfo.kernel)
+            self._modules[kinfo.name] = module
+        return module
+
+    def invalidate(self, name=None):
+        """Remove the instance for subkernel name, or instances for all subkernels"""
+        if name is None:
+            self._modules.clear()
+        else:
+            self._modules.pop(name, None)
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import builtins
 import copy
 import fnmatch
@@ -6,6 +7,7 @@ import os
 import pydoc
 import re
 import shlex
+import signal
 import subprocess
 import sys
 from collections import OrderedDict
@@ -13,19 +15,16 @@ from collections.abc import Sequence, Sized
 from io import StringIO
 from types import ModuleType
 
-import pandas as pd
 from IPython.core.error import UsageError
-from IPython.lib.clipboard import (
-    ClipboardEmpty,
-    osx_clipboard_get,
-    tkinter_clipboard_get,
-)
 from jupyter_client import find_connection_file
 from sos._version import __version__
 from sos.eval import interpolate
 from sos.syntax import SOS_SECTION_HEADER
 from sos.targets import path
-from sos.utils import env, load_config_files, pexpect_run, pretty_size, short_repr
+from sos.utils import env, pexpect_run, pretty_size, short_repr
+
+from .config import load_config_files
+from .kernelspecs import kernelspec_index
 
 
 class SoS_Magic:
@@ -254,6 +253,8 @@ class Capture_Magic(SoS_Magic):
             elif args.as_type == "csv":
                 try:
                     if isinstance(content, str):
+                        import pandas as pd
+
                         with StringIO(content) as ifile:
                             content = pd.read_csv(ifile)
                     else:
@@ -267,6 +268,8 @@ class Capture_Magic(SoS_Magic):
             elif args.as_type == "tsv":
                 try:
                     if isinstance(content, str):
+                        import pandas as pd
+
                         with StringIO(content) as ifile:
                             content = pd.read_csv(ifile, sep="\t")
                     else:
@@ -303,7 +306,10 @@ class Capture_Magic(SoS_Magic):
                         self.sos_kernel.warn(
                             f"Cannot append new content of type {type(content).__name__} to {args.__append__} of type {type(env.sos_dict[args.__append__]).__name__}"
                         )
-                elif isinstance(env.sos_dict[args.__append__], pd.DataFrame):
+                elif type(env.sos_dict[args.__append__]).__name__ == "DataFrame":
+                    # a DataFrame can only be created with pandas imported
+                    import pandas as pd
+
                     if isinstance(content, pd.DataFrame):
                         env.sos_dict.set(
                             args.__append__,
@@ -373,16 +379,18 @@ class Cd_Magic(SoS_Magic):
         cur_kernel = self.sos_kernel.kernel
         try:
             for kernel in self.sos_kernel.kernels.keys():
-                if kernel not in self.sos_kernel.supported_languages:
+                module = self.sos_kernel.language_modules.get(
+                    self.sos_kernel.subkernels.find(kernel)
+                )
+                if module is None:
                     self.sos_kernel.warn(
                         f"Current directory of kernel {kernel} is not changed: unsupported language"
                     )
                     continue
-                lan = self.sos_kernel.supported_languages[kernel]
-                if hasattr(lan, "cd_command"):
+                if module.cd_command is not None:
                     try:
                         await self.sos_kernel.switch_kernel(kernel)
-                        cmd = interpolate(lan.cd_command, {"dir": str(path(to_dir))})
+                        cmd = interpolate(module.cd_command, {"dir": str(path(to_dir))})
                         await self.sos_kernel.run_cell(
                             cmd,
                             True,
@@ -937,6 +945,12 @@ class Get_Magic(SoS_Magic):
             help="""Name of the variable that will be saved in the destination
                 kernel, default to the name of the original variable.""",
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="""Transfer variables from the SoS kernel even if they have not
+                been changed since they were last transferred to the kernel.""",
+        )
         parser.add_argument(
             "vars",
             nargs="*",
@@ -957,13 +971,80 @@ class Get_Magic(SoS_Magic):
         except Exception as e:
             return self.sos_kernel.notify_error(e)
         await self.sos_kernel.get_vars_from(
-            args.vars, args.__from__, explicit=True, as_var=args.__as__
+            args.vars,
+            args.__from__,
+            explicit=True,
+            as_var=args.__as__,
+            force=args.force,
         )
         return await self.sos_kernel._do_execute(
             remaining_code, silent, store_history, user_expressions, allow_stdin
         )
 
 
+class Limit_Magic(SoS_Magic):
+    name = "limit"
+
+    def __init__(self, kernel):
+        super().__init__(kernel)
+
+    def get_parser(self):
+        parser = argparse.ArgumentParser(
+            prog="%limit",
+            description="""Limit the size and number of output messages the cell can
+            send to the frontend or capture. Output beyond the limits is discarded,
+            or saved to a spool file, with a summary at the end of the cell. Default
+            limits can be set in notebook metadata or with options
+            SoS_Kernel.output_budget_bytes and SoS_Kernel.output_budget_messages.""",
+        )
+        parser.add_argument(
+            "--bytes",
+            help="""Maximum size of output, which can be a number of bytes or a
+            size with unit such as 10MB. 0 for unlimited.""",
+        )
+        parser.add_argument(
+            "--messages",
+            type=int,
+            help="""Maximum number of output messages, 0 for unlimited.""",
+        )
+        parser.add_argument(
+            "--spool",
+            nargs="?",
+            const=True,
+            help="""Save output beyond the limits to specified file, or a temporary
+            file if no filename is specified.""",
+        )
+        parser.error = self._parse_error
+        return parser
+
+    async def apply(self, code, silent, store_history, user_expressions, allow_stdin):
+        options, remaining_code = self.get_magic_and_code(code, False)
+        parser = self.get_parser()
+        try:
+            args = parser.parse_args(shlex.split(options))
+        except SystemExit:
+            return
+        limits = {
+            x: getattr(args, x)
+            for x in ("bytes", "messages", "spool")
+            if getattr(args, x) is not None
+        }
+        try:
+            budget = self.sos_kernel.new_output_budget(limits)
+        except Exception as e:
+            self.sos_kernel.warn(f"Invalid output limit: {e}")
+            return
+        original_budget = self.sos_kernel._output_budget
+        self.sos_kernel._output_budget = budget
+        try:
+            return await self.sos_kernel._do_execute(
+                remaining_code, silent, store_history, user_expressions, allow_stdin
+            )
+        finally:
+            self.sos_kernel.close_output_budget()
+            self.sos_kernel._output_budget = original_budget
+
+
 class Matplotlib_Magic(SoS_Magic):
     name = "matplotlib"
 
@@ -1068,6 +1149,12 @@ class Paste_Magic(SoS_Magic):
     async def apply(self, code, silent, store_history, user_expressions, allow_stdin):
         if self.sos_kernel._meta.get("batch_mode", False):
             return
+        from IPython.lib.clipboard import (
+            ClipboardEmpty,
+            osx_clipboard_get,
+            tkinter_clipboard_get,
+        )
+
         options, _ = self.get_magic_and_code(code, True)
         try:
             self.sos_kernel.options = options
@@ -1403,38 +1490,32 @@ class Preview_Magic(SoS_Magic):
                         self.show_preview_result(preview)
                         continue
                     # not sos
-                    if self.sos_kernel.kernel in self.sos_kernel.supported_languages:
-                        lan = self.sos_kernel.supported_languages[
-                            self.sos_kernel.kernel
-                        ]
-                        kinfo = self.sos_kernel.subkernels.find(self.sos_kernel.kernel)
-                        lan_obj = lan(self.sos_kernel, kinfo.kernel)
-                        if hasattr(lan_obj, "preview") and callable(lan_obj.preview):
-                            try:
-                                obj_desc, preview = lan_obj.preview(item)
-                                if (
-                                    preview.startswith("Unknown variable")
-                                    and handled[idx]
-                                ):
-                                    continue
-                                self.sos_kernel.send_frontend_msg(
-                                    "display_data",
-                                    {
-                                        "metadata": {},
-                                        "data": {
-                                            "text/plain": ">>> " + item + ":\n",
-                                            "text/html": f'<div class="sos_hint">> {item}: {obj_desc}</div>',
-                                        },
+                    module = self.sos_kernel.language_modules.get(
+                        self.sos_kernel.subkernels.find(self.sos_kernel.kernel)
+                    )
+                    if module is not None and module.preview:
+                        try:
+                            obj_desc, preview = module.instance.preview(item)
+                            if preview.startswith("Unknown variable") and handled[idx]:
+                                continue
+                            self.sos_kernel.send_frontend_msg(
+                                "display_data",
+                                {
+                                    "metadata": {},
+                                    "data": {
+                                        "text/plain": ">>> " + item + ":\n",
+                                        "text/html": f'<div class="sos_hint">> {item}: {obj_desc}</div>',
                                     },
-                                )
-                                self.show_preview_result(preview)
-                            except Exception:
-                                pass
-                                # self.sos_kernel.warn(f'Failed to preview {item}: {e}')
-                            continue
+                                },
+                            )
+                            self.show_preview_result(preview)
+                        except Exception:
+                            pass
+                            # self.sos_kernel.warn(f'Failed to preview {item}: {e}')
+                        continue
                     # if no preview function defined
                     # evaluate the expression itself
-                    responses = self.sos_kernel.get_response(
+                    responses = await self.sos_kernel.async_get_response(
                         item, ["stream", "display_data", "execute_result", "error"]
                     )
                     if responses:
@@ -1757,6 +1838,12 @@ class Put_Magic(SoS_Magic):
             help="""Name of the variable that will be saved in the destination
                 kernel, default to the name of the original variable.""",
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="""Transfer variables from the SoS kernel even if they have not
+                been changed since they were last transferred to the kernel.""",
+        )
         parser.add_argument(
             "vars",
             nargs="*",
@@ -1782,7 +1869,11 @@ class Put_Magic(SoS_Magic):
             )
         finally:
             await self.sos_kernel.put_vars_to(
-                args.vars, args.__to__, explicit=True, as_var=args.__as__
+                args.vars,
+                args.__to__,
+                explicit=True,
+                as_var=args.__as__,
+                force=args.force,
             )
 
 
@@ -2362,12 +2453,15 @@ class SessionInfo_Magic(SoS_Magic):
                     ("Kernel", kinfo.kernel),
                     ("Language", kinfo.language),
                 ]
-                if kernel not in self.sos_kernel.supported_languages:
+                spec = kernelspec_index.specs().get(kinfo.kernel, None)
+                if spec is not None:
+                    result[kernel].append(("Interpreter", spec["argv"][0]))
+                module = self.sos_kernel.language_modules.get(kinfo)
+                if module is None:
                     continue
-                lan = self.sos_kernel.supported_languages[kernel]
-                if hasattr(lan, "sessioninfo"):
+                if module.sessioninfo:
                     try:
-                        sinfo = lan(self.sos_kernel, kinfo.kernel).sessioninfo()
+                        sinfo = module.instance.sessioninfo()
                         if isinstance(sinfo, str):
                             result[kernel].append([sinfo])
                         elif isinstance(sinfo, dict):
@@ -3224,6 +3318,142 @@ class Toc_Magic(SoS_Magic):
         )
 
 
+class Top_Magic(SoS_Magic):
+    name = "top"
+
+    def __init__(self, kernel):
+        super().__init__(kernel)
+        self.usage = None
+
+    def get_parser(self):
+        parser = argparse.ArgumentParser(
+            prog="%top",
+            description="""Display resident memory, CPU usage, number of threads and
+            open files, and uptime of the SoS kernel, running subkernels, and
+            workflows that are running in the background, including processes
+            started by the subkernels and workflows. The usage is also sent to the
+            frontend as a resource-usage message.""",
+        )
+        parser.add_argument(
+            "-i",
+            "--interval",
+            type=float,
+            help="""Refresh the usage every specified seconds, for the number of
+            times specified by option -n (10 by default).""",
+        )
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            help="""Number of times the usage is displayed, refreshed every 2
+            seconds if --interval is not specified.""",
+        )
+        parser.error = self._parse_error
+        return parser
+
+    def get_processes(self):
+        from .workflow_executor import running_workflows
+
+        processes = [("SoS", os.getpid(), False)]
+        for name, (km, _) in self.sos_kernel.kernels.items():
+            pid = getattr(km.provisioner, "pid", None) if km.provisioner else None
+            if pid is not None:
+                processes.append((name, pid, True))
+        for cell_id, proc in running_workflows():
+            processes.append((f"workflow {cell_id}", proc.pid, True))
+        return processes
+
+    def format_usage(self, usages):
+        from sos.utils import format_duration
+
+        header = ["Process", "PID", "RSS", "CPU%", "Threads", "Files", "Uptime"]
+        rows = [
+            [
+                x["name"],
+                str(x["pid"]),
+                pretty_size(x["rss"]),
+                f"{x['cpu']:.1f}",
+                str(x["threads"]),
+                str(x["open_files"]),
+                format_duration(x["uptime"], short=True),
+            ]
+            for x in usages
+        ]
+        widths = [max(len(row[i]) for row in [header, *rows]) for i in range(7)]
+        text = "\n".join(
+            "  ".join(
+                x.ljust(w) if i == 0 else x.rjust(w)
+                for i, (x, w) in enumerate(zip(row, widths))
+            )
+            for row in [header, *rows]
+        )
+        html = '<table class="resource_usage">\n<tr>{}</tr>\n{}</table>'.format(
+            "".join(f"<th>{x}</th>" for x in header),
+            "".join(
+                "<tr>{}</tr>\n".format("".join(f"<td>{x}</td>" for x in row))
+                for row in rows
+            ),
+        )
+        return {"text/plain": text, "text/html": html}
+
+    async def apply(self, code, silent, store_history, user_expressions, allow_stdin):
+        options, remaining_code = self.get_magic_and_code(code, False)
+        parser = self.get_parser()
+        try:
+            args = parser.parse_args(shlex.split(options))
+        except SystemExit:
+            return
+        if args.interval is not None and args.interval <= 0:
+            self.sos_kernel.warn(f"Invalid refresh interval {args.interval}")
+            return
+        if self.usage is None:
+            from .resources import ResourceUsage
+
+            self.usage = ResourceUsage()
+        if args.iterations is not None:
+            iterations = args.iterations
+        else:
+            iterations = 10 if args.interval else 1
+        interval = args.interval if args.interval else 2
+        display_id = f"resource_usage_{id(self)}_{self.sos_kernel._execution_count}"
+        count = 0
+        # SIGINT would raise KeyboardInterrupt in the event loop while waiting,
+        # so an interrupt of the kernel stops the wait instead
+        loop = asyncio.get_running_loop()
+        interrupted = asyncio.Event()
+        save_sigint = signal.signal(
+            signal.SIGINT, lambda *args: loop.call_soon_threadsafe(interrupted.set)
+        )
+        try:
+            while True:
+                usages = self.usage.measure(self.get_processes())
+                self.sos_kernel.send_frontend_msg("resource-usage", usages)
+                self.sos_kernel.send_response(
+                    self.sos_kernel.iopub_socket,
+                    "display_data" if count == 0 else "update_display_data",
+                    {
+                        "data": self.format_usage(usages),
+                        "metadata": {},
+                        "transient": {"display_id": display_id},
+                    },
+                )
+                count += 1
+                if iterations > 0 and count >= iterations:
+                    break
+                # let the kernel process other events, such as messages of
+                # subkernels and checks of the health monitor, while waiting
+                try:
+                    await asyncio.wait_for(interrupted.wait(), interval)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            signal.signal(signal.SIGINT, save_sigint)
+        return await self.sos_kernel._do_execute(
+            remaining_code, silent, store_history, user_expressions, allow_stdin
+        )
+
+
 class Use_Magic(SoS_Magic):
     name = "use"
 
@@ -3238,14 +3468,15 @@ class Use_Magic(SoS_Magic):
         )
         parser.add_argument(
             "name",
-            nargs="?",
-            default="",
+            nargs="*",
             help="""Displayed name of kernel to start (if no kernel with name is
             specified) or switch to (if a kernel with this name is already started).
             The name is usually a kernel name (e.g. %%use ir) or a language name
             (e.g. %%use R) in which case the language name will be used. One or
             more parameters --language or --kernel will need to be specified
-            if a new name is used to start a separate instance of a kernel.""",
+            if a new name is used to start a separate instance of a kernel. If
+            several existing names are specified, the kernels are started at the
+            same time and the last one is used.""",
         )
         parser.add_argument(
             "-k",
@@ -3297,12 +3528,27 @@ class Use_Magic(SoS_Magic):
                 "traceback": [],
                 "execution_count": self.sos_kernel._execution_count,
             }
-        if args.restart and args.name in self.sos_kernel.kernels:
-            self.sos_kernel.shutdown_kernel(args.name)
-            self.sos_kernel.warn(f"{args.name} is shutdown")
+        name = args.name[-1] if args.name else ""
+        if len(args.name) > 1 and (args.kernel or args.language or args.color):
+            self.sos_kernel.warn(
+                "Options --kernel, --language and --color can only be used with one kernel"
+            )
+            return
+        if args.restart:
+            for x in args.name:
+                if x in self.sos_kernel.kernels:
+                    self.sos_kernel.shutdown_kernel(x)
+                    self.sos_kernel.warn(f"{x} is shutdown")
+        # language modules that have failed to load are imported again if they
+        # are used explicitly, in case the problems have been fixed
+        for x in [*args.name, args.language]:
+            if x in self.sos_kernel._failed_languages:
+                self.sos_kernel.subkernels.retry_language(x)
         try:
+            if len(args.name) > 1:
+                await self.sos_kernel.start_subkernels(args.name)
             await self.sos_kernel.switch_kernel(
-                args.name, None, args.kernel, args.language, args.color
+                name, None, args.kernel, args.language, args.color
             )
             return await self.sos_kernel._do_execute(
                 remaining_code, silent, store_history, user_expressions, allow_stdin
@@ -3341,6 +3587,12 @@ class With_Magic(SoS_Magic):
             help="""Output variables (variables to put back to SoS kernel
             before switching back to the SoS kernel""",
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="""Transfer input variables even if they have not been changed
+            since they were last transferred to the kernel.""",
+        )
         parser.error = self._parse_error
         return parser
 
@@ -3357,7 +3609,9 @@ class With_Magic(SoS_Magic):
 
         original_kernel = self.sos_kernel.kernel
         try:
-            await self.sos_kernel.switch_kernel(args.name, args.in_vars)
+            await self.sos_kernel.switch_kernel(
+                args.name, args.in_vars, force=args.force
+            )
         except Exception as e:
             return self.sos_kernel.notify_error(e)
         try:
@@ -3384,6 +3638,7 @@ class SoS_Magics:
         Env_Magic,
         Expand_Magic,
         Get_Magic,
+        Limit_Magic,
         Matplotlib_Magic,
         Preview_Magic,
         Pull_Magic,
@@ -3402,6 +3657,7 @@ class SoS_Magics:
         SoSSave_Magic,
         Task_Magic,
         Toc_Magic,
+        Top_Magic,
         Sandbox_Magic,
         Use_Magic,
         With_Magic,
@@ -3409,10 +3665,25 @@ class SoS_Magics:
     names = [x.name for x in magics if x.name != "!"]
 
     def __init__(self, kernel=None):
-        self._magics = {x.name: x(kernel) for x in self.magics}
+        # magics are instantiated when they are used
+        self._kernel = kernel
+        self._classes = {x.name: x for x in self.magics}
+        self._magics = {}
 
     def get(self, name):
+        if name not in self._magics:
+            self._magics[name] = self._classes[name](self._kernel)
         return self._magics[name]
 
     def values(self):
-        return self._magics.values()
+        return [self.get(x) for x in self._classes]
+
+    def match(self, code):
+        """Return the magic that handles code, or None if code does not start
+        with a magic"""
+        if code.startswith("!"):
+            return self.get("!")
+        m = re.match(r"%(\S+)(\s|$)", code)
+        if m and m.group(1) in self._classes:
+            return self.get(m.group(1))
+        return None
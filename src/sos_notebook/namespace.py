@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import pickle
+from itertools import compress, repeat
+from operator import is_not, not_
+
+_MISSING = object()
+
+
+class DictChanges:
+    """Track keys of a dictionary that are added, changed (set to another
+    object), or removed since the last call to changes(). SoS executes
+    statements directly in the dictionary of sos_dict so assignments cannot be
+    intercepted. Changes are instead detected by comparing the keys and the
+    identities of values with a snapshot of the dictionary, without looping
+    in Python. The snapshot keeps references to the values so that the
+    identities of released objects are not reused by new objects."""
+
+    def __init__(self):
+        self._keys = []
+        self._values = []
+
+    def changes(self, current):
+        """Return lists of added, changed, and removed keys of dictionary
+        current, and take a snapshot of it for the next call"""
+        keys = list(current)
+        values = list(current.values())
+        old_keys = self._keys
+        old_values = self._values
+        removed = []
+        if keys[: len(old_keys)] != old_keys:
+            # removing keys from a dictionary does not change the order of
+            # other keys, and new keys are appended to the end
+            kept = list(map(current.__contains__, old_keys))
+            removed = list(compress(old_keys, map(not_, kept)))
+            old_keys = list(compress(old_keys, kept))
+            old_values = list(compress(old_values, kept))
+        if keys[: len(old_keys)] == old_keys:
+            added = keys[len(old_keys) :]
+            changed = list(compress(keys, map(is_not, values, old_values)))
+        else:
+            # keys that are removed and added again are moved to the end
+            previous = dict(zip(old_keys, old_values))
+            modified = compress(
+                keys, map(is_not, values, map(previous.get, keys, repeat(_MISSING)))
+            )
+            added = []
+            changed = []
+            for key in modified:
+                (changed if key in previous else added).append(key)
+        self._keys = keys
+        self._values = values
+        return added, changed, removed
+
+
+def _update_values(digest, values):
+    import numpy as np
+
+    if isinstance(values, np.ndarray) and not values.dtype.hasobject:
+        digest.update(f"{values.dtype.str}{values.shape}".encode())
+        digest.update(memoryview(np.ascontiguousarray(values)).cast("B"))
+    else:
+        import pandas as pd
+
+        digest.update(pd.util.hash_array(np.asarray(values, dtype=object)))
+
+
+def fingerprint(obj):
+    """Return a digest of the content of obj, or None if it cannot be computed.
+    Arrays and columns of data frames are hashed from their data buffers, and
+    other objects from their pickles."""
+    cls = type(obj)
+    module = cls.__module__.split(".")[0]
+    digest = hashlib.sha256()
+    try:
+        if module == "numpy" and cls.__name__ == "ndarray" and not obj.dtype.hasobject:
+            _update_values(digest, obj)
+        elif module == "pandas" and cls.__name__ in ("DataFrame", "Series"):
+            import pandas as pd
+
+            if cls.__name__ == "DataFrame":
+                names, dtypes = list(obj.columns), list(obj.dtypes)
+                columns = (obj.iloc[:, i] for i in range(obj.shape[1]))
+            else:
+                names, dtypes = [obj.name], [obj.dtype]
+                columns = [obj]
+            # reprs of indexes and series are truncated so lists are used
+            digest.update(
+                repr((cls.__name__, names, dtypes, list(obj.index.names))).encode()
+            )
+            if isinstance(obj.index, pd.RangeIndex):
+                digest.update(repr(obj.index).encode())
+            else:
+                digest.update(pd.util.hash_pandas_object(obj.index).to_numpy())
+            for column in columns:
+                _update_values(digest, column.to_numpy())
+        else:
+            digest.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+class TransferredVars:
+    """Fingerprints of variables that have been sent from SoS to subkernels, so
+    that a variable is not sent again if its content has not been changed. The
+    destination kernel is assumed to hold the variables that have been sent to
+    it, so variables of a kernel are forgotten if a cell is executed in the
+    kernel, if they are sent from another kernel, or if the kernel is
+    restarted."""
+
+    def __init__(self):
+        self._sent = {}
+
+    def unchanged(self, kernel, name, source, digest):
+        """If variable source with digest has been sent to kernel as name"""
+        return digest is not None and self._sent.get(kernel, {}).get(name) == (
+            source,
+            digest,
+        )
+
+    def record(self, kernel, name, source, digest):
+        if digest is None:
+            self.forget(kernel, [name])
+        else:
+            self._sent.setdefault(kernel, {})[name] = (source, digest)
+
+    def forget(self, kernel, names=None):
+        """Forget variables names, or all variables, sent to kernel"""
+        if names is None:
+            self._sent.pop(kernel, None)
+            return
+        sent = self._sent.get(kernel, {})
+        for name in names:
+            sent.pop(name, None)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import tempfile
+import time
+
+import zmq
+import zmq.asyncio
+from sos.utils import pretty_size
+
+from .tracing import tracer
+
+
+class ChannelPoller:
+    """Wait on the channels of a subkernel client at the same time so that
+    messages can be relayed as soon as they arrive, without polling each
+    channel in a busy loop."""
+
+    def __init__(self, KC, channels=("stdin", "iopub", "shell")):
+        self.KC = KC
+        self._poller = zmq.Poller()
+        self._async_poller = None
+        self._sockets = []
+        for name in channels:
+            socket = getattr(KC, f"{name}_channel").socket
+            self._poller.register(socket, zmq.POLLIN)
+            self._sockets.append((name, socket))
+
+    def wait(self, timeout=None):
+        """Block until at least one of the channels has a pending message, or
+        until timeout (in seconds) expires. Names of ready channels are returned
+        in the order of registration (by default stdin, iopub, and shell) so
+        that callers can keep the order in which messages are processed."""
+        events = dict(
+            self._poller.poll(None if timeout is None else int(timeout * 1000))
+        )
+        return [name for name, socket in self._sockets if socket in events]
+
+    async def async_wait(self, timeout=None):
+        """Awaitable version of wait, which lets the event loop of the kernel
+        run while waiting for messages"""
+        if self._async_poller is None:
+            self._async_poller = zmq.asyncio.Poller()
+            for _, socket in self._sockets:
+                self._async_poller.register(socket, zmq.POLLIN)
+        events = dict(
+            await self._async_poller.poll(
+                None if timeout is None else int(timeout * 1000)
+            )
+        )
+        return [name for name, socket in self._sockets if socket in events]
+
+
+# messages from subkernels that SoS has to look into before they are relayed,
+# other messages are forwarded to the frontend with their content untouched
+INSPECTED_MSG_TYPES = {
+    "status",
+    "execute_input",
+    "execute_result",
+    "error",
+    "comm_open",
+}
+
+# messages that can be captured by magics such as %capture
+OUTPUT_MSG_TYPES = {
+    "display_data",
+    "stream",
+    "execute_result",
+    "update_display_data",
+    "error",
+}
+
+
+def recv_message(channel, content=True):
+    """Receive a message from a channel without copying its buffers. If
+    content is False, the content of the message is left as packed bytes,
+    which can be sent as it is with Session.send, or be unpacked later with
+    unpack_content."""
+    frames = channel.socket.recv_multipart(copy=False)
+    _, msg_list = channel.session.feed_identities(frames, copy=False)
+    return channel.session.deserialize(msg_list, content=content, copy=False)
+
+
+def needs_content(msg_type, capture=False, coalesce=False):
+    """Return True if the content of a message of msg_type has to be unpacked
+    before it is relayed, namely if SoS inspects the message, if output is
+    captured, or if stream messages are coalesced."""
+    return (
+        msg_type in INSPECTED_MSG_TYPES
+        or (capture and msg_type in OUTPUT_MSG_TYPES)
+        or (coalesce and msg_type == "stream")
+    )
+
+
+def unpack_content(session, msg):
+    """Unpack the content of a message received with content=False"""
+    if isinstance(msg["content"], bytes):
+        msg["content"] = session.unpack(msg["content"])
+    return msg["content"]
+
+
+class ResponseCollector:
+    """Collect iopub messages of msg_types, and optionally with content keys or
+    stream names in name, that are sent by a subkernel in response to execute
+    requests msg_ids. The collector is fed with names of ready channels from
+    ChannelPoller.wait or ChannelPoller.async_wait until it is done, namely
+    when all requests have been replied and the subkernel becomes idle after
+    processing them, so that several requests can be processed in one pass."""
+
+    def __init__(self, KC, msg_ids, msg_types, name=None):
+        self.KC = KC
+        self.msg_types = msg_types
+        self.name = name
+        self.responses = {msg_id: [] for msg_id in msg_ids}
+        self._running = set(msg_ids)
+        self._unreplied = set(msg_ids)
+
+    @property
+    def done(self):
+        return not self._running and not self._unreplied
+
+    @property
+    def pending(self):
+        """Requests that are not yet completed"""
+        return [x for x in self.responses if x in self._running | self._unreplied]
+
+    def process(self, channels):
+        if "iopub" in channels:
+            while self.KC.iopub_channel.msg_ready():
+                self._process_iopub(recv_message(self.KC.iopub_channel, content=False))
+        if "shell" in channels:
+            while self.KC.shell_channel.msg_ready():
+                reply = self.KC.get_shell_msg()
+                tracer.debug("MESSAGE", "GET SHELL MSG %s", reply)
+                self._unreplied.discard(reply["parent_header"].get("msg_id", None))
+
+    def _process_iopub(self, sub_msg):
+        msg_type = sub_msg["header"]["msg_type"]
+        msg_id = sub_msg["parent_header"].get("msg_id", None)
+        if msg_id not in self.responses:
+            tracer.debug("MESSAGE", "Overflow message in iopub %s", msg_type)
+            return
+        # messages that are not responses are ignored without being unpacked
+        if msg_type == "status" or msg_type in self.msg_types:
+            unpack_content(self.KC.session, sub_msg)
+        tracer.debug("MESSAGE", "Received %s %s", msg_type, sub_msg["content"])
+        if msg_type == "status":
+            if sub_msg["content"]["execution_state"] == "idle":
+                self._running.discard(msg_id)
+            return
+        if msg_type in self.msg_types and (
+            self.name is None
+            or sub_msg["content"].get("name", None) in self.name
+            or any(x in self.name for x in sub_msg["content"].keys())
+        ):
+            tracer.debug(
+                "MESSAGE", "Capture response: %s: %s", msg_type, sub_msg["content"]
+            )
+            self.responses[msg_id].append([msg_type, sub_msg["content"]])
+        else:
+            tracer.debug("MESSAGE", "Non-response: %s", msg_type)
+
+
+class StreamCoalescer:
+    """Send messages to a socket, merging consecutive stream messages with
+    the same name that arrive within window seconds, up to size characters,
+    into a single message. Coalescing is disabled if window is 0."""
+
+    def __init__(self, session, socket, window=0, size=65536):
+        self.session = session
+        self.socket = socket
+        self.window = window
+        self.size = size
+        self._pending = None
+        self._texts = []
+        self._length = 0
+        self._deadline = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def send(self, msg):
+        """Send msg, or hold it if it is a stream message that can be merged
+        with the following ones. The content of stream messages should have
+        been unpacked if coalescing is enabled."""
+        if not self.enabled:
+            self.session.send(self.socket, msg)
+            return
+        if msg["header"]["msg_type"] != "stream":
+            self.flush()
+            self.session.send(self.socket, msg)
+            return
+        if (
+            self._pending is not None
+            and self._pending["content"]["name"] != msg["content"]["name"]
+        ):
+            self.flush()
+        if self._pending is None:
+            self._pending = msg
+            self._deadline = time.monotonic() + self.window
+        self._texts.append(msg["content"]["text"])
+        self._length += len(msg["content"]["text"])
+        if self._length >= self.size:
+            self.flush()
+
+    def timeout(self):
+        """Seconds before pending messages have to be sent, None if there is
+        no pending message"""
+        if self._pending is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0)
+
+    def flush_expired(self):
+        """Send pending messages if the time window has passed"""
+        if self._pending is not None and time.monotonic() >= self._deadline:
+            self.flush()
+
+    def flush(self):
+        """Send pending messages as a single stream message"""
+        if self._pending is None:
+            return
+        msg = self._pending
+        msg["content"] = {
+            "name": msg["content"]["name"],
+            "text": "".join(self._texts),
+        }
+        self._pending = None
+        self._texts = []
+        self._length = 0
+        self.session.send(self.socket, msg)
+
+
+class OutputBudget:
+    """Limit the number of output messages and bytes a cell can send to the
+    frontend or capture. Output beyond the budget is discarded, or saved to a
+    spool file if spool is True (a temporary file) or a filename."""
+
+    def __init__(self, max_bytes=0, max_messages=0, spool=None):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.spool = spool
+        self.bytes = 0
+        self.messages = 0
+        self.exceeded = False
+        self.suppressed_bytes = 0
+        self.suppressed_messages = 0
+        self._spool_file = None
+
+    @property
+    def limited(self):
+        return bool(self.max_bytes or self.max_messages)
+
+    def charge(self, size):
+        """Account for an output message of size bytes. Return False if the
+        message exceeds the budget and should not be sent or captured."""
+        if not self.exceeded:
+            self.bytes += size
+            self.messages += 1
+            self.exceeded = bool(
+                (self.max_bytes and self.bytes > self.max_bytes)
+                or (self.max_messages and self.messages > self.max_messages)
+            )
+            if not self.exceeded:
+                return True
+        self.suppressed_bytes += size
+        self.suppressed_messages += 1
+        return False
+
+    def describe(self):
+        limits = []
+        if self.max_bytes:
+            limits.append(pretty_size(self.max_bytes))
+        if self.max_messages:
+            limits.append(f"{self.max_messages} messages")
+        return " or ".join(limits)
+
+    def save(self, msg_type, content):
+        """Save suppressed output to the spool file, if one is requested"""
+        if not self.spool:
+            return
+        if self._spool_file is None:
+            if self.spool is True:
+                fd, self.spool = tempfile.mkstemp(prefix="sos_output_", suffix=".txt")
+                self._spool_file = open(fd, "w")
+            else:
+                self._spool_file = open(self.spool, "w")
+        if msg_type == "stream":
+            self._spool_file.write(content["text"])
+        elif "data" in content and "text/plain" in content["data"]:
+            self._spool_file.write(content["data"]["text/plain"] + "\n")
+        else:
+            self._spool_file.write(json.dumps({msg_type: content}) + "\n")
+
+    def close(self):
+        """Close the spool file and return a summary of suppressed output"""
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+        if not self.suppressed_messages:
+            return None
+        return (
+            f"Output truncated: {self.suppressed_messages} messages "
+            f"({pretty_size(self.suppressed_bytes)}) beyond the output budget of "
+            f"{self.describe()} were "
+            + (f"saved to {self.spool}" if self.spool else "discarded")
+            + ".\n"
+        )
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+"""Resource usage of the SoS kernel, subkernels and workflow processes"""
+
+import time
+
+import psutil
+
+
+class ResourceUsage:
+    """Measure resident memory, CPU usage, threads, open files and uptime of
+    processes and their child processes. Processes are kept between calls
+    because psutil measures CPU usage since the last measurement of the same
+    process."""
+
+    def __init__(self):
+        self._procs = {}
+
+    def _process(self, pid):
+        proc = self._procs.get(pid, None)
+        if proc is None or not proc.is_running():
+            proc = psutil.Process(pid)
+            # the first call starts the measurement and returns 0
+            proc.cpu_percent(None)
+            self._procs[pid] = proc
+            return proc, True
+        return proc, False
+
+    def _processes(self, pid, children):
+        """Return the process pid, and its child processes if children, and if
+        any of them is new"""
+        proc, new = self._process(pid)
+        procs = [proc]
+        if children:
+            for child in proc.children(recursive=True):
+                try:
+                    child, child_new = self._process(child.pid)
+                except psutil.Error:
+                    continue
+                procs.append(child)
+                new = new or child_new
+        return procs, new
+
+    def _measure(self, procs):
+        usage = {
+            "pid": procs[0].pid,
+            "rss": 0,
+            "cpu": 0.0,
+            "threads": 0,
+            "open_files": 0,
+            "uptime": time.time() - procs[0].create_time(),
+        }
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    usage["rss"] += proc.memory_info().rss
+                    usage["cpu"] += proc.cpu_percent(None)
+                    usage["threads"] += proc.num_threads()
+                    usage["open_files"] += len(proc.open_files())
+            except psutil.Error:
+                pass
+        return usage
+
+    def measure(self, processes, delay=0.2):
+        """Measure processes, a list of (name, pid, children) in which children
+        specifies if child processes are included, and return a list of usages
+        with keys name, pid, rss (bytes), cpu (percent), threads, open_files and
+        uptime (seconds). The method waits delay seconds before measuring if
+        any process is new so that its CPU usage can be measured. Processes
+        that do not exist are skipped."""
+        measured = []
+        any_new = False
+        for name, pid, children in processes:
+            try:
+                procs, new = self._processes(pid, children)
+            except psutil.Error:
+                continue
+            measured.append((name, procs))
+            any_new = any_new or new
+        if any_new and delay > 0:
+            time.sleep(delay)
+        pids = set()
+        usages = []
+        for name, procs in measured:
+            try:
+                usage = self._measure(procs)
+            except psutil.Error:
+                continue
+            usages.append({"name": name, **usage})
+            pids.update(x.pid for x in procs)
+        # forget processes that are no longer measured
+        for pid in set(self._procs) - pids:
+            self._procs.pop(pid)
+        return usages
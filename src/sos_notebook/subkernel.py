@@ -1,8 +1,12 @@
+import contextlib
 import fnmatch
-from importlib import metadata
+import functools
+import re
 
 from sos.utils import env
 
+from .kernelspecs import kernel_info_cache, kernelspec_index
+
 
 class subkernel:
     # a class to information on subkernel
@@ -28,29 +32,42 @@ class subkernel:
         return f"subkernel {self.name} with kernel {self.kernel} for language {self.language} with color {self.color}"
 
 
+@functools.lru_cache(maxsize=None)
+def kernel_pattern(patterns):
+    """Precompiled regular expression that matches kernel names with any of
+    the glob patterns in tuple patterns"""
+    if not patterns:
+        return re.compile("(?!)")
+    return re.compile("|".join(fnmatch.translate(x) for x in patterns))
+
+
 class Subkernels:
     # a collection of subkernels
     def __init__(self, kernel):
         self.sos_kernel = kernel
         self.language_info = kernel.supported_languages
+        # kernel list last sent to the frontend, and pending notifications
+        self.delta_updates = False
+        self.version = 0
+        self._sent = {}
+        self._batched = 0
+        self._changed = False
+        self._full = False
 
-        from jupyter_client.kernelspec import KernelSpecManager
-
-        km = KernelSpecManager()
-        specs = km.find_kernel_specs()
+        specs = kernelspec_index.specs()
         # get supported languages
         self._kernel_list = []
         lan_map = {}
         for x in self.language_info.keys():
-            for lname, knames in kernel.supported_languages[
-                x
-            ].supported_kernels.items():
+            # read from the manifest of language modules without importing them
+            info = self.language_info.info(x)
+            for lname, knames in info.supported_kernels.items():
                 for kname in knames:
                     if x != kname:
                         lan_map[kname] = (
                             lname,
-                            self.get_background_color(self.language_info[x], lname),
-                            getattr(self.language_info[x], "options", {}),
+                            self.get_background_color(info, lname),
+                            getattr(info, "options", {}),
                             "",
                         )
         # kernel_list has the following items
@@ -96,7 +113,7 @@ class Subkernels:
                     )
                 )
             else:
-                lan_name = km.get_kernel_spec(spec).language
+                lan_name = specs[spec]["language"]
                 if lan_name == "python":
                     lan_name = "python3"
                 avail_names = [
@@ -116,15 +133,57 @@ class Subkernels:
                     # undefined language also use default theme color
                     self._kernel_list.append(
                         subkernel(
-                            name=km.get_kernel_spec(spec).display_name,
+                            name=specs[spec]["display_name"],
                             kernel=spec,
                             language=lan_name,
                         )
                     )
+        # codemirror modes of kernels that have been started before, which are
+        # otherwise known only after the subkernels are started. Signatures of
+        # kernelspecs are computed once instead of checking the index for
+        # each kernel
+        self._signatures = kernel_info_cache.signatures(specs)
+        for x in self._kernel_list:
+            if not x.codemirror_mode:
+                x.codemirror_mode = kernel_info_cache.codemirror_mode(
+                    x.kernel, self._signatures
+                )
+        self._reindex()
+
+    def _reindex(self):
+        # subkernels indexed by name and kernel name, pointing to the first
+        # matching subkernel in the kernel list
+        self._by_name = {}
+        self._by_kernel = {}
+        for x in self._kernel_list:
+            self._by_name.setdefault(x.name, x)
+            self._by_kernel.setdefault(x.kernel, x)
 
     def kernel_list(self):
         return self._kernel_list
 
+    def retry_language(self, name):
+        """Import language module name again if it has failed to load, and add
+        subkernels of the language to the kernel list if it is loaded"""
+        if not self.language_info.retry(name):
+            return False
+        languages = self.language_info.info(name).supported_kernels
+        added = [
+            x
+            for x in Subkernels(self.sos_kernel).kernel_list()
+            if x.language in languages and x.name not in self._by_name
+        ]
+        if added:
+            self._kernel_list.extend(added)
+            self._reindex()
+            self.notify_frontend()
+        return True
+
+    def _matching_kernels(self, patterns):
+        # kernels in the kernel list that match any of the glob patterns
+        pattern = kernel_pattern(tuple(patterns))
+        return [x for x in self._by_kernel if pattern.match(x)]
+
     default_cm_mode = {
         "sos": "",
         "python": {"name": "python", "version": 3},
@@ -150,12 +209,17 @@ class Subkernels:
     # now, no kernel is found, name has to be a new name and we need some definition
     # if kernel is defined
     def add_or_replace(self, kdef):
-        for idx, x in enumerate(self._kernel_list):
-            if x.name == kdef.name:
-                self._kernel_list[idx] = kdef
-                return self._kernel_list[idx]
-        self._kernel_list.append(kdef)
-        return self._kernel_list[-1]
+        if not kdef.codemirror_mode:
+            kdef.codemirror_mode = kernel_info_cache.codemirror_mode(
+                kdef.kernel, self._signatures
+            )
+        if kdef.name in self._by_name:
+            idx = self._kernel_list.index(self._by_name[kdef.name])
+            self._kernel_list[idx] = kdef
+        else:
+            self._kernel_list.append(kdef)
+        self._reindex()
+        return kdef
 
     def get_background_color(self, plugin, lan):
         # if a single color is defined, it is used for all supported
@@ -184,16 +248,14 @@ class Subkernels:
         )
 
         # find from subkernel name
-        def update_existing(idx):
-            x = self._kernel_list[idx]
-
+        def update_existing(x):
             #  [Bash, some_sh, ....]
             # but the provided kernel does not match...
             if kernel is not None and kernel != x.kernel:
                 # env.logger.warning(
                 #    f"Overriding kernel {x.kernel} used by subkernel {x.name} with kernel {kernel}."
                 # )
-                # self._kernel_list[idx].kernel = kernel
+                # x.kernel = kernel
                 if notify_frontend:
                     self.notify_frontend()
             #  similarly, identified by kernel but language names are different
@@ -201,22 +263,21 @@ class Subkernels:
                 env.logger.warning(
                     f"Overriding language {x.language} used by subkernel {x.name} with language {language}."
                 )
-                self._kernel_list[idx].language = language
+                x.language = language
                 if notify_frontend:
                     self.notify_frontend()
             if codemirror_mode:
-                self._kernel_list[idx].codemirror_mode = codemirror_mode
+                x.codemirror_mode = codemirror_mode
             if color is not None:
                 if color == "default":
-                    if self._kernel_list[idx].language:
-                        self._kernel_list[idx].color = self.get_background_color(
-                            self.language_info[self._kernel_list[idx].language],
-                            self._kernel_list[idx].language,
+                    if x.language:
+                        x.color = self.get_background_color(
+                            self.language_info.info(x.language), x.language
                         )
                     else:
-                        self._kernel_list[idx].color = ""
+                        x.color = ""
                 else:
-                    self._kernel_list[idx].color = color
+                    x.color = color
                 if notify_frontend:
                     self.notify_frontend()
 
@@ -224,38 +285,36 @@ class Subkernels:
         if name in self.sos_kernel._failed_languages:
             raise self.sos_kernel._failed_languages[name]
         # find from language name (subkernel name, which is usually language name)
-        for idx, x in enumerate(self._kernel_list):
-            if x.name == name:
-                if x.name == "SoS" or x.language or language is None:
-                    update_existing(idx)
-                    return x
-                if not kernel:
-                    kernel = name
-                break
-        # find from kernel name
-        for idx, x in enumerate(self._kernel_list):
-            if x.kernel == name:
-                # if exist language or no new language defined.
-                if x.language or language is None:
-                    update_existing(idx)
-                    return x
-                # otherwise, try to use the new language
+        x = self._by_name.get(name, None)
+        if x is not None:
+            if x.name == "SoS" or x.language or language is None:
+                update_existing(x)
+                return x
+            if not kernel:
                 kernel = name
-                break
+        # find from kernel name
+        x = self._by_kernel.get(name, None)
+        if x is not None:
+            # if exist language or no new language defined.
+            if x.language or language is None:
+                update_existing(x)
+                return x
+            # otherwise, try to use the new language
+            kernel = name
 
         if kernel is not None:
             # in this case kernel should have been defined in kernel list
-            if kernel not in [x.kernel for x in self._kernel_list]:
+            if kernel not in self._by_kernel:
                 raise ValueError(
                     f'Unrecognized Jupyter kernel name {kernel}. Please make sure it is properly installed and appear in the output of command "jupyter kenelspec list"'
                 )
             # now this a new instance for an existing kernel
-            kdef = [x for x in self._kernel_list if x.kernel == kernel][0]
+            kdef = self._by_kernel[kernel]
             if not language:
                 if color == "default":
                     if kdef.language:
                         color = self.get_background_color(
-                            self.language_info[kdef.language], kdef.language
+                            self.language_info.info(kdef.language), kdef.language
                         )
                     else:
                         color = kdef.color
@@ -265,7 +324,7 @@ class Subkernels:
                         kdef.kernel,
                         kdef.language,
                         kdef.color if color is None else color,
-                        getattr(self.language_info[kdef.language], "options", {})
+                        getattr(self.language_info.info(kdef.language), "options", {})
                         if kdef.language
                         else {},
                         codemirror_mode=codemirror_mode,
@@ -362,15 +421,9 @@ class Subkernels:
                         f"Failed to load language {language}: {e}"
                     ) from e
 
-                avail_kernels = [
-                    y.kernel
-                    for y in self._kernel_list
-                    if y.kernel in sum(plugin.supported_kernels.values(), [])
-                    or any(
-                        fnmatch.fnmatch(y.kernel, x)
-                        for x in sum(plugin.supported_kernels.values(), [])
-                    )
-                ]
+                avail_kernels = self._matching_kernels(
+                    x for y in plugin.supported_kernels.values() for x in y
+                )
 
                 if not avail_kernels:
                     raise ValueError(
@@ -381,14 +434,11 @@ class Subkernels:
                     )
                 # use the first available kernel
                 # find the language that has the kernel
-                lan_name = list(
-                    {
-                        x: y
-                        for x, y in plugin.supported_kernels.items()
-                        if avail_kernels[0] in y
-                        or any(fnmatch.fnmatch(avail_kernels[0], z) for z in y)
-                    }.keys()
-                )[0]
+                lan_name = [
+                    x
+                    for x, y in plugin.supported_kernels.items()
+                    if kernel_pattern(tuple(y)).match(avail_kernels[0])
+                ][0]
                 if color == "default":
                     color = self.get_background_color(plugin, lan_name)
                 new_def = self.add_or_replace(
@@ -410,25 +460,13 @@ class Subkernels:
                 #
                 plugin = self.language_info[language]
                 if language in plugin.supported_kernels:
-                    avail_kernels = [
-                        y.kernel
-                        for y in self._kernel_list
-                        if y.kernel in plugin.supported_kernels[language]
-                        or any(
-                            fnmatch.fnmatch(y.kernel, x)
-                            for x in plugin.supported_kernels[language]
-                        )
-                    ]
+                    avail_kernels = self._matching_kernels(
+                        plugin.supported_kernels[language]
+                    )
                 else:
-                    avail_kernels = [
-                        y.kernel
-                        for y in self._kernel_list
-                        if y.kernel in sum(plugin.supported_kernels.values(), [])
-                        or any(
-                            fnmatch.fnmatch(y.kernel, x)
-                            for x in sum(plugin.supported_kernels.values(), [])
-                        )
-                    ]
+                    avail_kernels = self._matching_kernels(
+                        x for y in plugin.supported_kernels.values() for x in y
+                    )
                 if not avail_kernels:
                     raise ValueError(
                         'Failed to find any of the kernels {} supported by language {}. Please make sure it is properly installed and appear in the output of command "jupyter kenelspec list"'.format(
@@ -463,10 +501,9 @@ class Subkernels:
             return new_def
 
         # let us check if there is something wrong with the pre-defined language
-        for entrypoint in metadata.entry_points(group="sos_languages"):
-            if entrypoint.name == name:
-                # there must be something wrong, let us trigger the exception here
-                entrypoint.load()
+        if self.language_info.registered(name):
+            # there must be something wrong, let us trigger the exception here
+            self.language_info.load(name)
         # if nothing is triggerred, kernel is not defined, return a general message
         raise ValueError(
             f'No subkernel named {name} is found. Please use magic "%use" without option to see a list of available kernels and language modules.'
@@ -490,12 +527,63 @@ class Subkernels:
                     f'Failed to locate subkernel {kinfo[0]} with kernel "{kinfo[1]}" and language "{kinfo[2]}": {e}'
                 )
 
-    def notify_frontend(self):
+    def notify_frontend(self, full=False):
+        """Send changes to the kernel list to the frontend. Changes made during
+        an execute request are sent once at the end of the request. If full is
+        True, the entire kernel list is sent immediately."""
+        self._changed = True
+        self._full = self._full or full
+        if full or not self._batched:
+            self.flush_notifications()
+
+    @contextlib.contextmanager
+    def batch_notifications(self):
+        """Defer notifications of the kernel list to the end of the block"""
+        self._batched += 1
+        try:
+            yield
+        finally:
+            self._batched -= 1
+            if not self._batched and self._changed:
+                self.flush_notifications()
+
+    def flush_notifications(self):
+        # frontends that support delta updates receive "kernel-list-delta"
+        # messages with changed and removed subkernels and an incremental
+        # version, others receive the entire kernel list if it has changed
+        full = self._full
+        self._changed = False
+        self._full = False
         self._kernel_list.sort(key=lambda x: x.name)
-        self.sos_kernel.send_frontend_msg(
-            "kernel-list",
-            [
-                [x.name, x.kernel, x.language, x.color, x.codemirror_mode, x.options]
-                for x in self._kernel_list
-            ],
-        )
+        self._reindex()
+        current = {
+            x.name: [
+                x.name,
+                x.kernel,
+                x.language,
+                x.color,
+                x.codemirror_mode,
+                dict(x.options),
+            ]
+            for x in self._kernel_list
+        }
+        if not self.delta_updates:
+            if full or current != self._sent:
+                self.sos_kernel.send_frontend_msg("kernel-list", list(current.values()))
+        else:
+            changed = [
+                y for x, y in current.items() if full or self._sent.get(x, None) != y
+            ]
+            removed = [] if full else [x for x in self._sent if x not in current]
+            if full or changed or removed:
+                self.version += 1
+                self.sos_kernel.send_frontend_msg(
+                    "kernel-list-delta",
+                    {
+                        "version": self.version,
+                        "full": full,
+                        "kernels": changed,
+                        "removed": removed,
+                    },
+                )
+        self._sent = current
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+"""Tracing of the message path of the SoS kernel.
+
+Tracing is enabled per topic with environment variable SOS_TRACE, e.g.
+
+    SOS_TRACE=MESSAGE:DEBUG,KERNEL:INFO
+
+where ALL can be used as a topic for all topics. Topics listed in SOS_DEBUG
+are traced at DEBUG level. Trace messages are formatted only if their topic
+is enabled at the requested level, long values are truncated, and records
+are written by a background thread to the log file specified by SOS_TRACE_FILE,
+or to the file and stream handlers of the SoS logger.
+"""
+
+import logging
+import os
+import pprint
+import queue
+import sys
+import threading
+import weakref
+
+from sos.utils import env
+
+# level that disables a topic
+OFF = logging.CRITICAL + 10
+
+
+class Tracer:
+    def __init__(self, spec=None, max_length=200):
+        self.max_length = max_length
+        self._levels = None
+        self._spec = spec
+        self._sources = None
+        self._queue = None
+        self._trace_file = None
+        self._stream_handlers = weakref.WeakKeyDictionary()
+
+    def _get_sources(self):
+        return env.config.get("SOS_DEBUG") or set(), os.environ.get("SOS_TRACE", "")
+
+    def configure(self, spec=None, max_length=None):
+        """Set levels of topics from a specification in the format of
+        TOPIC:LEVEL,TOPIC:LEVEL. If spec is None, SOS_TRACE and SOS_DEBUG
+        are used. Levels are set again if SOS_TRACE or SOS_DEBUG is changed."""
+        debug, trace = self._get_sources()
+        self._spec = spec
+        self._sources = (set(debug), trace)
+        levels = dict.fromkeys(debug, logging.DEBUG)
+        if spec is None:
+            spec = trace
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            topic, _, level = item.partition(":")
+            levels[topic.strip()] = logging.getLevelName(
+                level.strip().upper() or "DEBUG"
+            )
+            if not isinstance(levels[topic.strip()], int):
+                levels[topic.strip()] = logging.DEBUG
+        self._default = levels.pop("ALL", OFF)
+        self._levels = levels
+        if max_length is not None:
+            self.max_length = max_length
+
+    def level_of(self, topic):
+        if self._levels is None or self._sources != self._get_sources():
+            self.configure(self._spec)
+        return self._levels.get(topic, self._default)
+
+    def is_enabled(self, topic, level=logging.DEBUG):
+        return level >= self.level_of(topic)
+
+    def debug(self, topic, msg, *args):
+        self.trace(topic, logging.DEBUG, msg, *args)
+
+    def info(self, topic, msg, *args):
+        self.trace(topic, logging.INFO, msg, *args)
+
+    def trace(self, topic, level, msg, *args):
+        """Trace message msg, which is formatted with args in the % style only
+        if topic is enabled at level. Long strings in args, including those
+        in messages and other containers, are truncated."""
+        if level < self.level_of(topic):
+            return
+        if args:
+            msg = msg % tuple(self.format_arg(x) for x in args)
+        self._write(topic, level, msg)
+
+    def format_arg(self, arg):
+        if isinstance(arg, (dict, list, tuple)):
+            return pprint.pformat(self.truncate(arg))
+        return self.truncate(arg)
+
+    def truncate(self, obj):
+        if isinstance(obj, str):
+            if len(obj) <= self.max_length:
+                return obj
+            return obj[: self.max_length] + f"... ({len(obj) - self.max_length} more)"
+        if isinstance(obj, bytes):
+            # packed content of relayed messages
+            if len(obj) <= self.max_length:
+                return obj
+            return obj[: self.max_length] + b"..."
+        if isinstance(obj, dict):
+            return {k: self.truncate(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            items = [self.truncate(x) for x in obj[: self.max_length]]
+            if len(obj) > self.max_length:
+                items.append(f"... ({len(obj) - self.max_length} more)")
+            return items
+        if isinstance(obj, memoryview):
+            return f"<{obj.nbytes} bytes>"
+        return obj
+
+    def _write(self, topic, level, msg):
+        if self._queue is None:
+            self._queue = queue.SimpleQueue()
+            threading.Thread(
+                target=self._write_records, name="sos-trace", daemon=True
+            ).start()
+        self._queue.put(
+            logging.LogRecord(
+                "sos_notebook.trace", level, "", 0, f"{topic} - {msg}", None, None
+            )
+        )
+
+    def _get_handlers(self):
+        """Handlers of trace records, which are looked up for each batch of
+        records so that changes to the configuration of logging are followed"""
+        trace_file = os.environ.get("SOS_TRACE_FILE", "")
+        if trace_file:
+            if self._trace_file is None or self._trace_file.baseFilename != (
+                os.path.abspath(trace_file)
+            ):
+                self._trace_file = logging.FileHandler(trace_file, mode="a")
+                self._trace_file.setFormatter(
+                    logging.Formatter("%(asctime)s: %(levelname)s: %(message)s")
+                )
+            return [self._trace_file]
+        # handlers such as NotebookLoggingHandler send messages to the frontend
+        # and cannot be called from the writer thread
+        handlers = []
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.FileHandler):
+                handlers.append(handler)
+            elif type(handler) is logging.StreamHandler:
+                # the stream of the handler can be redirected to the frontend so
+                # records are written to the stderr of the process instead
+                handlers.append(self._get_stream_handler(handler))
+        return handlers
+
+    def _get_stream_handler(self, handler):
+        if handler not in self._stream_handlers:
+            stream_handler = logging.StreamHandler(sys.__stderr__)
+            stream_handler.setFormatter(handler.formatter)
+            self._stream_handlers[handler] = stream_handler
+        stream_handler = self._stream_handlers[handler]
+        stream_handler.setLevel(handler.level)
+        return stream_handler
+
+    def _write_records(self):
+        while True:
+            records = [self._queue.get()]
+            while not self._queue.empty():
+                records.append(self._queue.get())
+            handlers = self._get_handlers()
+            for record in records:
+                for handler in handlers:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        pass
+
+
+tracer = Tracer()
@@ -13,9 +13,7 @@ import sys
 import tempfile
 from threading import Event
 
-import psutil
 import zmq
-from sos.__main__ import get_run_parser
 from sos.controller import Controller, connect_controllers, disconnect_controllers
 from sos.parser import SoS_Script
 from sos.section_analyzer import analyze_section
@@ -36,6 +34,8 @@ class NotebookLoggingHandler(logging.Handler):
         self.title = title
 
     def emit(self, record):
+        # buffered output printed before the message is sent first
+        self.kernel.flush_sos_io()
         msg = re.sub(
             r"``([^`]*)``", r'<span class="sos_highlight">\1</span>', record.msg
         )
@@ -79,6 +79,8 @@ last_cell_id = None
 
 
 def execute_scratch_cell(code, raw_args, kernel):
+    from sos.__main__ import get_run_parser
+
     # we then have to change the parse to disable args.workflow when
     # there is no workflow option.
     raw_args = shlex.split(raw_args) if isinstance(raw_args, str) else raw_args
@@ -302,6 +304,8 @@ g_workflow_queue: list = []
 
 
 def run_next_workflow_in_queue():
+    import psutil
+
     # execute the first available item
     global g_workflow_queue
 
@@ -320,6 +324,15 @@ def run_next_workflow_in_queue():
         break
 
 
+def running_workflows():
+    """Return ids of cells and processes of workflows in the queue that are running"""
+    return [
+        (cid, proc)
+        for cid, proc in g_workflow_queue
+        if proc is not None and not isinstance(proc, tuple) and proc.is_alive()
+    ]
+
+
 def execute_pending_workflow(cell_ids, kernel):
     # we are giving a list of cell_ids because some cells might be removed
     # we use this list to clear workflow queue of removed cells
@@ -374,6 +387,8 @@ def run_sos_workflow(
 
 
 def cancel_workflow(cell_id, kernel):
+    import psutil
+
     global g_workflow_queue
     env.logger.info("A queued or running workflow in this cell is canceled")
     kernel.send_frontend_msg(
@@ -8,8 +8,17 @@ import tempfile
 
 import pytest
 
+from sos_notebook.kernelspecs import kernel_info_cache, kernelspec_index
 from sos_notebook.test_utils import Notebook
 
+# language modules defined in the test directory, such as npy_language, are
+# imported by the SoS kernel, which can be started from another directory
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    x
+    for x in (os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH"))
+    if x
+)
+
 
 @pytest.fixture(scope="class")
 def notebook():
@@ -17,6 +26,22 @@ def notebook():
     return Notebook()
 
 
+@pytest.fixture()
+def sos_cache(tmp_path, monkeypatch):
+    """Save the kernelspec index and kernel info of subkernels to tmp_path
+    instead of ~/.sos"""
+    monkeypatch.setattr(
+        kernelspec_index, "_index_file", str(tmp_path / "kernelspecs.json")
+    )
+    monkeypatch.setattr(kernelspec_index, "_signature", None)
+    monkeypatch.setattr(kernelspec_index, "_specs", None)
+    monkeypatch.setattr(
+        kernel_info_cache, "cache_file", str(tmp_path / "kernel_info.json")
+    )
+    monkeypatch.setattr(kernel_info_cache, "_cache", None)
+    return tmp_path
+
+
 @pytest.fixture()
 def sample_scripts():
     if not os.path.isdir("temp"):
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+# a language module that transfers numpy arrays with the data transfer protocol
+# of sos_notebook.data_plane, used by tests of %get and %put
+
+from sos_python.kernel import sos_Python
+
+
+class NpyPython(sos_Python):
+    data_formats = ["npy"]
+
+    async def import_data(self, files, fmt):
+        stmt = "import numpy as __np\n" + "".join(
+            f"{name} = __np.load({path!r}, mmap_mode='c')\n"
+            for name, path in files.items()
+        )
+        await self.sos_kernel.run_cell(stmt, True, False)
+
+    def export_data(self, items, fmt, directory):
+        stmt = f"""\
+import os, numpy as __np
+__files = {{}}
+for __name in {items!r}:
+    if type(globals()[__name]).__name__ in ('ndarray', 'memmap'):
+        __files[__name] = os.path.join({directory!r}, __name + '.npy')
+        __np.save(__files[__name], __np.asarray(globals()[__name]))
+__files"""
+        response = self.sos_kernel.get_response(stmt, ["execute_result"])[-1][1]
+        return eval(response["data"]["text/plain"])
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+
+from sos_notebook.config import ConfigCache
+
+
+def test_config_cache(tmp_path, monkeypatch):
+    """test that configuration files are parsed only if they are changed"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    os.makedirs(tmp_path / ".sos")
+    config_file = tmp_path / ".sos" / "config.yml"
+    config_file.write_text("value: 1\n")
+
+    cache = ConfigCache()
+    cfg = cache.load()
+    assert cfg["value"] == 1
+    assert cache.load() is cfg
+    # modified global config file
+    config_file.write_text("value: 10\n")
+    cfg = cache.load()
+    assert cfg["value"] == 10
+    # user-specified config file
+    user_config = tmp_path / "my.yml"
+    user_config.write_text("user_value: 2\n")
+    user_cfg = cache.load(str(user_config))
+    assert user_cfg["value"] == 10 and user_cfg["user_value"] == 2
+    assert cache.load() is not user_cfg
+    # removed config file
+    os.remove(config_file)
+    assert "value" not in cache.load()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sos_notebook import data_plane
+
+
+class Plugin:
+    data_formats = ["npy", "arrow"]
+
+
+def test_negotiate():
+    """test negotiation of data formats"""
+    assert data_plane.negotiate(["arrow", "npy"], data_plane.data_formats(Plugin))
+    assert data_plane.negotiate(["npy"], data_plane.data_formats(Plugin)) == "npy"
+    assert (
+        data_plane.negotiate(["arrow", "npy"], data_plane.data_formats(object)) is None
+    )
+
+
+def test_transfer_arrays():
+    """test transfer of arrays through memory-mapped files"""
+    directory = data_plane.transfer_directory()
+    try:
+        files = data_plane.write_vars(
+            {"a": np.arange(10), "b": "not an array"}, "npy", directory
+        )
+        assert list(files) == ["a"]
+        values = data_plane.read_vars(files, "npy")
+        assert isinstance(values["a"], np.memmap)
+        assert values["a"].tolist() == list(range(10))
+        values["a"][0] = 100
+        assert values["a"][0] == 100
+        # received arrays can be sent on
+        assert data_plane.can_write(values["a"], "npy")
+        files = data_plane.write_vars(
+            {
+                "c": values["a"],
+                "masked": np.ma.masked_array([1, 2], mask=[0, 1]),
+                "objects": np.array([None, 1]),
+            },
+            "npy",
+            directory,
+        )
+        assert list(files) == ["c"]
+        assert data_plane.read_vars(files, "npy")["c"][0] == 100
+    finally:
+        data_plane.remove_directory(directory)
+    assert not os.path.exists(directory)
+
+
+def test_transfer_data_frames():
+    """test transfer of data frames through Arrow IPC files"""
+    pytest.importorskip("pyarrow")
+    directory = data_plane.transfer_directory()
+    try:
+        df = pd.DataFrame({"x": [1, 2, 3], "y": ["a", "b", "c"]})
+        files = data_plane.write_vars({"df": df}, "arrow", directory)
+        values = data_plane.read_vars(files, "arrow")
+        assert values["df"].equals(df)
+    finally:
+        data_plane.remove_directory(directory)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import asyncio
+import os
+import signal
+
+import pytest
+
+from sos_notebook.kernel_pool import (
+    HealthMonitor,
+    KernelEvictor,
+    KernelPool,
+    start_subkernel,
+)
+from sos_notebook.languages import LanguageModules
+from sos_notebook.namespace import TransferredVars
+from sos_notebook.subkernel import subkernel
+
+# the kernelspec index and kernel info are not saved to ~/.sos
+pytestmark = pytest.mark.usefixtures("sos_cache")
+
+
+def test_start_subkernels():
+    """test concurrent start of subkernels"""
+
+    async def start():
+        return await asyncio.gather(
+            start_subkernel("python3", init_statements="__started = 1"),
+            start_subkernel("python3"),
+        )
+
+    for idx, (km, kc, codemirror_mode) in enumerate(asyncio.run(start())):
+        try:
+            assert km.sync_is_alive()
+            assert codemirror_mode
+            reply = kc.execute_interactive(
+                "__started", output_hook=lambda msg: None, timeout=10
+            )
+            # init statements are only executed in the first kernel
+            assert reply["content"]["status"] == ("ok" if idx == 0 else "error")
+        finally:
+            kc.stop_channels()
+            km.sync_shutdown_kernel(now=True)
+
+
+def test_slow_init_statements():
+    """test that init statements are not limited by the startup timeout"""
+
+    async def start():
+        return await start_subkernel(
+            "python3",
+            startup_timeout=5,
+            init_statements="import time; time.sleep(6); __started = 1",
+        )
+
+    km, kc, _ = asyncio.run(start())
+    try:
+        reply = kc.execute_interactive(
+            "__started", output_hook=lambda msg: None, timeout=10
+        )
+        assert reply["content"]["status"] == "ok"
+    finally:
+        kc.stop_channels()
+        km.sync_shutdown_kernel(now=True)
+
+
+def test_kernel_pool():
+    """test starting subkernels in the background"""
+    assert not KernelPool().enabled
+
+    async def use_pool():
+        pool = KernelPool(size=1, idle_timeout=0)
+        try:
+            assert pool.prestart("Python3", "python3", "__prestarted = 1")
+            # pool is full
+            assert not pool.prestart("Python2", "python3")
+            assert "Python3" in pool
+            km, kc, _ = await pool.take("Python3", "python3")
+            assert "Python3" not in pool
+            try:
+                reply = kc.execute_interactive(
+                    "__prestarted", output_hook=lambda msg: None, timeout=10
+                )
+                assert reply["content"]["status"] == "ok"
+            finally:
+                kc.stop_channels()
+                km.sync_shutdown_kernel(now=True)
+            # kernels started with another kernel are not used
+            assert pool.prestart("Python3", "python3")
+            assert await pool.take("Python3", "ir") is None
+            assert await pool.take("Python3", "python3") is None
+        finally:
+            pool.shutdown()
+            # let cancelled tasks shut down their kernels
+            await asyncio.sleep(0.1)
+
+    asyncio.run(use_pool())
+
+
+class MonitoredKernel:
+    def __init__(self):
+        self.kernels = {}
+        self.KM = self.KC = None
+        self.kernel = "SoS"
+        self.supported_languages = {}
+        self.language_modules = LanguageModules(self)
+        self.transferred_vars = TransferredVars()
+        self.messages = []
+
+    def send_frontend_msg(self, msg_type, msg=None):
+        self.messages.append((msg_type, msg))
+
+    def discard_subkernel(self, name):
+        self.kernels.pop(name, None)
+
+    @property
+    def subkernels(self):
+        return self
+
+    def find(self, name):
+        return subkernel(name, "python3", "")
+
+
+def test_health_monitor():
+    """test detection and restart of crashed subkernels"""
+
+    async def crash():
+        kernel = MonitoredKernel()
+        monitor = HealthMonitor(kernel, interval=0.1)
+        km, kc, _ = await start_subkernel("python3")
+        kernel.kernels["Python3"] = (km, kc)
+        kernel.KM, kernel.KC = km, kc
+        monitor.start()
+        try:
+            os.kill(km.provisioner.pid, signal.SIGKILL)
+            while not kernel.messages:
+                await asyncio.sleep(0.1)
+            assert kernel.messages[0][1]["status"] == "dead"
+            assert "SIGKILL" in await monitor.wait_for("Python3")
+            assert await monitor.wait_for("Python3") is None
+            assert kernel.messages[-1][1]["status"] == "restarted"
+            assert kernel.KM is not km and kernel.KM.sync_is_alive()
+            assert kernel.kernels["Python3"] == (kernel.KM, kernel.KC)
+        finally:
+            monitor.stop()
+            for km, kc in kernel.kernels.values():
+                kc.stop_channels()
+                km.sync_shutdown_kernel(now=True)
+
+    asyncio.run(crash())
+
+
+def test_kernel_evictor():
+    """test shutting down idle subkernels that exceed the memory budget"""
+
+    async def evict():
+        kernel = MonitoredKernel()
+        evictor = KernelEvictor(kernel, budget=1, idle_timeout=0)
+        for name in ("A", "B", "C"):
+            km, kc, _ = await start_subkernel("python3")
+            kernel.kernels[name] = (km, kc)
+        started = dict(kernel.kernels)
+        kernel.kernel = "C"
+        evictor.touch("A")
+        evictor.touch("B", executed=False)
+        evictor.touch("C")
+        try:
+            # A holds variables and is only warned, C is the current kernel
+            assert evictor.evict() == ["B"]
+            assert not started["B"][0].sync_is_alive()
+            assert [x[1]["status"] for x in kernel.messages] == ["idle", "evicted"]
+            assert evictor.evicted("B") and not evictor.evicted("B")
+            # A is warned again if it is used after the warning
+            evictor.touch("A")
+            assert evictor.evict() == []
+            assert evictor.evict() == ["A"]
+            assert list(kernel.kernels) == ["C"]
+        finally:
+            for km, kc in started.values():
+                kc.stop_channels()
+                km.sync_shutdown_kernel(now=True)
+
+    asyncio.run(evict())
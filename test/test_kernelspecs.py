@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import os
+
+import pytest
+from jupyter_client.kernelspec import NoSuchKernel
+
+from sos_notebook.kernelspecs import KernelInfoCache, KernelSpecIndex
+
+
+def write_kernelspec(kernel_dir, name, language, display_name=None):
+    os.makedirs(kernel_dir / name, exist_ok=True)
+    with open(kernel_dir / name / "kernel.json", "w") as spec:
+        json.dump(
+            {
+                "argv": [f"/usr/bin/{name}", "-f", "{connection_file}"],
+                "display_name": display_name or name,
+                "language": language,
+            },
+            spec,
+        )
+
+
+class CountedIndex(KernelSpecIndex):
+    builds = 0
+
+    def _build(self):
+        CountedIndex.builds += 1
+        return super()._build()
+
+
+def test_kernelspec_index(tmp_path, monkeypatch):
+    """test rebuild and persistence of kernelspec index"""
+    monkeypatch.setenv("JUPYTER_PATH", str(tmp_path / "jupyter"))
+    kernel_dir = tmp_path / "jupyter" / "kernels"
+    write_kernelspec(kernel_dir, "mykernel", "mylang", "My Kernel")
+    index_file = str(tmp_path / "index.json")
+
+    index = CountedIndex(index_file)
+    spec = index.get("mykernel")
+    assert spec["language"] == "mylang"
+    assert spec["display_name"] == "My Kernel"
+    assert spec["argv"][0] == "/usr/bin/mykernel"
+    with pytest.raises(NoSuchKernel):
+        index.get("nokernel")
+    assert CountedIndex.builds == 1
+    # the saved index is used by another instance
+    assert CountedIndex(index_file).get("mykernel") == spec
+    assert CountedIndex.builds == 1
+    # modified kernelspec
+    write_kernelspec(kernel_dir, "mykernel", "mylang", "My Modified Kernel")
+    assert index.get("mykernel")["display_name"] == "My Modified Kernel"
+    assert CountedIndex.builds == 2
+    # new kernelspec
+    write_kernelspec(kernel_dir, "newkernel", "newlang")
+    assert index.get("newkernel")["language"] == "newlang"
+    assert CountedIndex.builds == 3
+
+
+def test_kernel_info_cache(tmp_path, monkeypatch):
+    """test kernel info saved for kernelspecs"""
+    monkeypatch.setenv("JUPYTER_PATH", str(tmp_path / "jupyter"))
+    kernel_dir = tmp_path / "jupyter" / "kernels"
+    write_kernelspec(kernel_dir, "mykernel", "mylang")
+    index = KernelSpecIndex(str(tmp_path / "index.json"))
+    cache_file = str(tmp_path / "kernel_info.json")
+
+    cache = KernelInfoCache(cache_file, index)
+    assert cache.codemirror_mode("mykernel") == ""
+    cache.set("mykernel", {"name": "mylang", "codemirror_mode": {"name": "mylang"}})
+    cache.set("nokernel", {"name": "nolang", "codemirror_mode": "nolang"})
+    assert cache.codemirror_mode("nokernel") == ""
+    # the saved kernel info is used by another instance
+    cache = KernelInfoCache(cache_file, index)
+    assert cache.codemirror_mode("mykernel") == {"name": "mylang"}
+    # modified kernelspec
+    write_kernelspec(kernel_dir, "mykernel", "mylang", "My Modified Kernel")
+    assert cache.get("mykernel") is None
+
+
+def test_kernel_info_signatures(tmp_path, monkeypatch):
+    """test lookup of kernel info with signatures computed in advance"""
+    monkeypatch.setenv("JUPYTER_PATH", str(tmp_path / "jupyter"))
+    kernel_dir = tmp_path / "jupyter" / "kernels"
+    for i in range(3):
+        write_kernelspec(kernel_dir, f"kernel{i}", f"lang{i}")
+    index = KernelSpecIndex(str(tmp_path / "index.json"))
+    cache = KernelInfoCache(str(tmp_path / "kernel_info.json"), index)
+    for i in range(3):
+        cache.set(f"kernel{i}", {"name": f"lang{i}", "codemirror_mode": f"lang{i}"})
+    signatures = cache.signatures()
+    assert {"kernel0", "kernel1", "kernel2"} <= set(signatures)
+    # the index is not checked if signatures are specified
+    monkeypatch.setattr(index, "specs", lambda: pytest.fail("index checked"))
+    assert [cache.codemirror_mode(f"kernel{i}", signatures) for i in range(3)] == [
+        "lang0",
+        "lang1",
+        "lang2",
+    ]
+    # signatures of modified kernelspecs do not match
+    write_kernelspec(kernel_dir, "kernel0", "lang0", "Modified Kernel")
+    assert cache.codemirror_mode("kernel0", cache.signatures(index._specs)) == ""
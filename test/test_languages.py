@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+from types import SimpleNamespace
+
+from sos_notebook import languages
+from sos_notebook.languages import LanguageModules, LanguagePlugins
+from sos_notebook.subkernel import subkernel
+
+
+def test_language_manifest(tmp_path):
+    """test that language modules in the manifest are loaded on demand"""
+    manifest_file = str(tmp_path / "language_plugins.json")
+    plugins = LanguagePlugins(manifest_file=manifest_file)
+    assert "Python3" in plugins.keys()
+    with open(manifest_file) as manifest:
+        assert any(x.startswith("Python3=") for x in json.load(manifest))
+
+    plugins = LanguagePlugins(manifest_file=manifest_file)
+    assert "Python3" in plugins.keys()
+    assert not plugins._plugins
+    info = plugins.info("Python3")
+    assert "Python3" in info.supported_kernels
+    assert plugins.module("Python3") == "sos_python"
+    # the module is loaded when it is used
+    assert "Python3" in plugins
+    assert plugins["Python3"].supported_kernels == info.supported_kernels
+    assert plugins.info("Python3") is plugins["Python3"]
+    assert "NoSuchLanguage" not in plugins
+
+
+class FlakyLanguage:
+    supported_kernels = {"Flaky": ["python3"]}
+    background_color = "#FFFFFF"
+    options = {}
+
+
+class FlakyEntryPoint:
+    """Entry point of a language module that fails to load until fixed"""
+
+    def __init__(self):
+        self.name = "Flaky"
+        self.value = "flaky_language:FlakyLanguage"
+        self.dist = SimpleNamespace(name="flaky-language", version="1.0")
+        self.fixed = False
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        if not self.fixed:
+            raise ImportError("No module named 'flaky_dependency'")
+        return FlakyLanguage
+
+
+def test_failed_language(tmp_path, monkeypatch):
+    """test that language modules that failed to load can be imported again"""
+    manifest_file = str(tmp_path / "language_plugins.json")
+    entrypoint = FlakyEntryPoint()
+    monkeypatch.setattr(languages.metadata, "entry_points", lambda group: [entrypoint])
+    plugins = LanguagePlugins(manifest_file=manifest_file)
+    assert entrypoint.loads == 1
+    assert "Flaky" in plugins.failed and "Flaky" not in plugins.keys()
+    # the failure is not imported again by the kernel
+    assert "Flaky" not in plugins and entrypoint.loads == 1
+    assert not plugins.retry("Flaky") and entrypoint.loads == 2
+    # failures are not saved so the module is imported again by other kernels
+    plugins = LanguagePlugins(manifest_file=manifest_file)
+    assert entrypoint.loads == 3
+    entrypoint.fixed = True
+    assert plugins.retry("Flaky")
+    assert "Flaky" not in plugins.failed and plugins["Flaky"] is FlakyLanguage
+
+
+class CountedModule:
+    instances = 0
+
+    def __init__(self, sos_kernel, kernel_name):
+        CountedModule.instances += 1
+        self.kernel_name = kernel_name
+
+    async def get_vars(self, items, as_var=None):
+        pass
+
+    def put_vars(self, items, to_kernel=None):
+        pass
+
+    def sessioninfo(self):
+        return {}
+
+
+class MockKernel:
+    def __init__(self, languages):
+        self.supported_languages = languages
+
+
+def test_language_modules():
+    """test cached instances of language modules and their capabilities"""
+    kernel = MockKernel({"Counted": CountedModule})
+    modules = LanguageModules(kernel)
+    kinfo = subkernel("C", "counted", "Counted")
+    module = modules.get(kinfo)
+    assert module.instance.kernel_name == "counted"
+    assert module.get_vars_as_var and not module.put_vars_as_var
+    assert module.sessioninfo and not module.expand and not module.preview
+    assert module.cd_command is None
+    assert modules.get(kinfo) is module
+    assert CountedModule.instances == 1
+    # redefined subkernel
+    assert modules.get(subkernel("C", "counted2", "Counted")).kernel == "counted2"
+    assert CountedModule.instances == 2
+    modules.invalidate("C")
+    modules.get(subkernel("C", "counted2", "Counted"))
+    assert CountedModule.instances == 3
+    assert modules.get(subkernel("D", "unknown", "Unknown")) is None
@@ -23,6 +23,7 @@ class TestMagics(NotebookTest):
             "cd",
             "convert",
             "get",
+            "limit",
             "matplotlib",
             "preview",
             "put",
@@ -36,6 +37,7 @@ class TestMagics(NotebookTest):
             "sosrun",
             "shutdown",
             "task",
+            "top",
             "use",
             "with",
         ):
@@ -354,6 +356,46 @@ class TestMagics(NotebookTest):
             kernel="R",
         )
 
+    def test_magic_get_reassigned(self, notebook):
+        # variables are transferred again if they are changed in the subkernel
+        notebook.call("reassigned = 1", kernel="SoS")
+        notebook.call(
+            """\
+            %with Python3 -i reassigned
+            reassigned = 200
+            """,
+            kernel="SoS",
+        )
+        assert "1" == notebook.check_output(
+            """\
+            %with Python3 -i reassigned
+            reassigned
+            """,
+            kernel="SoS",
+        )
+        notebook.call("reassigned = 100", kernel="Python3")
+        assert "1" == notebook.check_output(
+            """\
+            %get reassigned
+            reassigned
+            """,
+            kernel="Python3",
+        )
+        assert "1" == notebook.check_output("reassigned", kernel="SoS")
+        # users are told about variables that are not sent again
+        notebook.call("%get reassigned", kernel="Python3")
+        assert "Unchanged reassigned" in notebook.check_output(
+            "%get reassigned", kernel="Python3"
+        )
+        assert "Unchanged" not in notebook.check_output(
+            "%get reassigned --force", kernel="Python3"
+        )
+        # variables that are forced to be sent are sent again
+        assert "Unchanged" not in notebook.check_output(
+            "%get reassigned", kernel="Python3"
+        )
+        notebook.call("%use SoS")
+
     def test_magic_get_between_subkernels(self, notebook):
         # test variable transfer between subkernels, which should not leave a trace in
         # SoS
@@ -389,6 +431,41 @@ class TestMagics(NotebookTest):
         )
         assert "python_b" in notebook.check_output("subr", kernel="R")
 
+    def test_magic_get_arrays_between_subkernels(self, notebook):
+        # arrays are transferred directly between kernels that support the npy
+        # format, other variables are transferred through SoS
+        pytest.importorskip("numpy")
+        try:
+            notebook.call(
+                "%use NpyA -l npy_language:NpyPython -k python3",
+                kernel="SoS",
+            )
+            notebook.call(
+                """\
+                import numpy as np
+                npy_arr = np.arange(6).reshape(2, 3)
+                npy_str = 'npy_str'
+                """,
+                kernel="NpyA",
+            )
+            notebook.call(
+                "%use NpyB -l npy_language:NpyPython -k python3",
+                kernel="SoS",
+            )
+            notebook.call("%get npy_arr npy_str --from NpyA", kernel="NpyB")
+            assert "memmap 15 npy_str" in notebook.check_output(
+                "print(type(npy_arr).__name__, npy_arr.sum(), npy_str)", kernel="NpyB"
+            )
+            notebook.call("%put npy_arr --to NpyB --as npy_arr2", kernel="NpyA")
+            assert "[[0, 1, 2], [3, 4, 5]]" in notebook.check_output(
+                "print(npy_arr2.tolist())", kernel="NpyB"
+            )
+            assert "False" in notebook.check_output(
+                "'npy_arr' in globals()", kernel="SoS"
+            )
+        finally:
+            notebook.call("%use SoS", kernel="SoS")
+
     def test_magic_matplotlib(self, notebook):
         # test %capture
         pytest.importorskip("matplotlib")
@@ -407,6 +484,20 @@ class TestMagics(NotebookTest):
             attribute="src",
         )
 
+    def test_magic_limit(self, notebook):
+        """test truncation of output with %limit"""
+        output = notebook.check_output(
+            """\
+            %limit --messages 5
+            import sys
+            for i in range(20):
+                print(f'line {i}')
+                sys.stdout.flush()
+            """,
+            kernel="Python3",
+        )
+        assert "line 4" in output and "line 5" not in output
+
     def test_magic_render(self, notebook):
         # test %put from subkernel to SoS Kernel
         output = notebook.check_output(
@@ -912,11 +1003,38 @@ class TestMagics(NotebookTest):
             for x in ("rsync 3.2", "v1", "v2", "v3", "v4", "d1", "d2", "d3", "d4")
         )
 
+    def test_output_order(self, notebook):
+        """test that buffered output is sent before results and log messages"""
+
+        def sent(code):
+            return [
+                (msg["msg_type"], msg["content"].get("text", ""))
+                for msg in notebook._execute_and_collect(code)[3]
+                if msg["msg_type"] in ("stream", "display_data", "execute_result")
+            ]
+
+        notebook.call("%use SoS")
+        messages = sent("print('hello')\n1 + 1")
+        assert [x[0] for x in messages] == ["stream", "execute_result"]
+        assert messages[0][1] == "hello\n"
+        messages = sent(
+            "from sos.utils import env\n"
+            "print('before')\nenv.logger.warning('logged')\nprint('after')"
+        )
+        assert messages == [
+            ("stream", "before\n"),
+            ("display_data", ""),
+            ("stream", "after\n"),
+        ]
+
     @pytest.mark.skipif(
         sys.platform == "win32", reason="! magic does not support built-in command #203"
     )
     def test_magic_shell(self, notebook):
         assert "haha" in notebook.check_output("!echo haha", kernel="SoS")
+        # output of shell commands is buffered and sent in order
+        output = notebook.check_output("!seq 1 500", kernel="SoS")
+        assert output.split() == [str(x) for x in range(1, 501)]
 
     @pytest.mark.xfail(reason="Cannot figure out why the file sometimes does not exist")
     def test_magic_convert(self, notebook):
@@ -974,6 +1092,40 @@ class TestMagics(NotebookTest):
         with open(tmp_file) as tt:
             assert "kkk" in tt.read()
 
+    def test_magic_top(self, notebook):
+        output = notebook.check_output(
+            """\
+            %use Python3
+            %use SoS
+            %top -i 0.1 -n 2
+            """,
+            kernel="SoS",
+        )
+        assert "RSS" in output and "Python3" in output
+        # usage is refreshed a limited number of times by default
+        messages = notebook._execute_and_collect("%top -i 0.1")[3]
+        assert [x["msg_type"] for x in messages].count("update_display_data") == 9
+
+    def test_magic_use_several(self, notebook):
+        # several subkernels are (re)started at the same time and the last one
+        # is used
+        try:
+            notebook.call("%use PyC -l Python3 -k python3", kernel="SoS")
+            notebook.call("%use PyD -l Python3 -k python3", kernel="SoS")
+            notebook.call("in_pyc = 1", kernel="PyC")
+            assert "in PyD" in notebook.check_output(
+                """\
+                %use PyC PyD -r
+                print('in PyD')
+                """,
+                kernel="SoS",
+            )
+            assert "False" in notebook.check_output(
+                "print('in_pyc' in globals())", kernel="PyC"
+            )
+        finally:
+            notebook.call("%use SoS", kernel="SoS")
+
     def test_magic_use(self, notebook):
         # Background color assertions require frontend, skip those
         notebook.call("%use R0 -l sos_r.kernel:sos_R -c #CCCCCC", kernel="SoS")
@@ -1006,3 +1158,49 @@ class TestMagics(NotebookTest):
             kernel="SoS",
         )
         assert len(notebook.check_output("ran", kernel="SoS")) > 0
+
+    def test_magic_with_between_subkernels(self, notebook):
+        # arrays are passed directly between subkernels that support the npy
+        # format, other variables are passed through SoS
+        pytest.importorskip("numpy")
+        try:
+            notebook.call("with_sos = 'sos_value'", kernel="SoS")
+            notebook.call(
+                "%use NpyV -l npy_language:NpyPython -k python3",
+                kernel="SoS",
+            )
+            notebook.call(
+                "%use NpyW -l npy_language:NpyPython -k python3",
+                kernel="SoS",
+            )
+            notebook.call(
+                """\
+                import numpy as np
+                with_arr = np.arange(3)
+                with_str = 'str_value'
+                """,
+                kernel="NpyV",
+            )
+            assert "memmap 3 str_value" in notebook.check_output(
+                """\
+                %with NpyW -i with_arr with_str -o with_out
+                with_out = with_str.upper()
+                print(type(with_arr).__name__, with_arr.sum(), with_str)
+                """,
+                kernel="NpyV",
+            )
+            assert "STR_VALUE" in notebook.check_output(
+                "print(with_out)", kernel="NpyV"
+            )
+            assert "sos_value" in notebook.check_output(
+                """\
+                %with NpyW -i with_sos
+                print(with_sos)
+                """,
+                kernel="NpyV",
+            )
+            assert "False" in notebook.check_output(
+                "'with_arr' in globals()", kernel="SoS"
+            )
+        finally:
+            notebook.call("%use SoS", kernel="SoS")
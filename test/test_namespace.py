@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import pytest
+
+from sos_notebook.namespace import DictChanges, TransferredVars, fingerprint
+
+
+def test_dict_changes():
+    """test detection of added, changed and removed keys"""
+    tracker = DictChanges()
+    d = {"a": 1, "b": [1], "c": "c"}
+    assert tracker.changes(d) == (["a", "b", "c"], [], [])
+    assert tracker.changes(d) == ([], [], [])
+    # changed values are detected by identity
+    d["b"] = [1]
+    d["d"] = 4
+    assert tracker.changes(d) == (["d"], ["b"], [])
+    # removed keys
+    del d["a"]
+    d["c"] = "C"
+    assert tracker.changes(d) == ([], ["c"], ["a"])
+    # keys removed and added again
+    d.pop("b")
+    d["b"] = 2
+    d["e"] = 5
+    assert tracker.changes(d) == (["e"], ["b"], [])
+    d.pop("c")
+    d.pop("d")
+    d["c"] = ["C"]
+    assert tracker.changes(d) == ([], ["c"], ["d"])
+
+
+def test_fingerprint():
+    """test fingerprints of changed and unchanged objects"""
+    assert fingerprint({"a": [1, 2]}) == fingerprint({"a": [1, 2]})
+    assert fingerprint({"a": [1, 2]}) != fingerprint({"a": [1, 3]})
+    assert fingerprint(lambda x: x) is None
+    np = pytest.importorskip("numpy")
+    arr = np.arange(10)
+    copy = arr.copy()
+    assert fingerprint(arr) == fingerprint(copy)
+    copy[0] = 10
+    assert fingerprint(arr) != fingerprint(copy)
+    assert fingerprint(arr) != fingerprint(arr.reshape(2, 5))
+    assert fingerprint(arr[::2]) == fingerprint(np.arange(0, 10, 2))
+    pd = pytest.importorskip("pandas")
+    df = pd.DataFrame({"a": range(5), "b": list("abcde")})
+    copy = df.copy()
+    assert fingerprint(df) == fingerprint(copy)
+    copy.iloc[0, 1] = "z"
+    assert fingerprint(df) != fingerprint(copy)
+    assert fingerprint(df) != fingerprint(df.rename(columns={"a": "c"}))
+    assert fingerprint(df) != fingerprint(df.set_index("b"))
+
+
+def test_transferred_vars():
+    """test recording of variables sent to subkernels"""
+    sent = TransferredVars()
+    assert not sent.unchanged("R", "a", "a", "d1")
+    sent.record("R", "a", "a", "d1")
+    sent.record("R", "b", "c", "d2")
+    assert sent.unchanged("R", "a", "a", "d1")
+    assert not sent.unchanged("R", "a", "a", "d2")
+    assert not sent.unchanged("Python3", "a", "a", "d1")
+    # variable sent with --as
+    assert sent.unchanged("R", "b", "c", "d2")
+    assert not sent.unchanged("R", "b", "b", "d2")
+    # objects without fingerprints are always sent
+    sent.record("R", "a", "a", None)
+    assert not sent.unchanged("R", "a", "a", None)
+    sent.forget("R", ["b"])
+    assert not sent.unchanged("R", "b", "c", "d2")
+    sent.record("R", "a", "a", "d1")
+    sent.forget("R")
+    assert not sent.unchanged("R", "a", "a", "d1")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+import zmq
+from jupyter_client.session import Session
+
+from sos_notebook.kernel import SoS_Kernel
+from sos_notebook.kernel_pool import start_subkernel
+from sos_notebook.relay import (
+    INSPECTED_MSG_TYPES,
+    OUTPUT_MSG_TYPES,
+    OutputBudget,
+    StreamCoalescer,
+    needs_content,
+    recv_message,
+    unpack_content,
+)
+
+# the kernelspec index and kernel info are not saved to ~/.sos
+pytestmark = pytest.mark.usefixtures("sos_cache")
+
+
+class FakeSession:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, socket, msg):
+        self.sent.append((msg["header"]["msg_type"], msg["content"]))
+
+
+def stream_msg(name, text):
+    return {"header": {"msg_type": "stream"}, "content": {"name": name, "text": text}}
+
+
+def test_relay_messages():
+    """test relay of messages with packed content and buffers between sessions"""
+    context = zmq.Context()
+    subkernel, sos, iopub, frontend = (context.socket(zmq.PAIR) for _ in range(4))
+    subkernel.bind("inproc://subkernel")
+    sos.connect("inproc://subkernel")
+    iopub.bind("inproc://frontend")
+    frontend.connect("inproc://frontend")
+    # subkernels and the frontend use different keys
+    kernel_session = Session(key=b"kernel")
+    frontend_session = Session(key=b"frontend")
+    channel = SimpleNamespace(socket=sos, session=kernel_session)
+    messages = [
+        ("status", {"execution_state": "busy"}, []),
+        ("comm_msg", {"comm_id": "id", "data": {"shape": [4]}}, [b"\0\1\2\3"]),
+        ("display_data", {"data": {"text/plain": "x" * 1000}, "metadata": {}}, []),
+        ("stream", {"name": "stdout", "text": "text\n"}, []),
+        ("error", {"ename": "ValueError", "evalue": "", "traceback": []}, []),
+    ]
+    try:
+        for msg_type, content, buffers in messages:
+            kernel_session.send(subkernel, msg_type, content, buffers=buffers)
+            msg = recv_message(channel, content=False)
+            assert msg["header"]["msg_type"] == msg_type
+            assert [bytes(x) for x in msg["buffers"]] == buffers
+            # only messages that SoS looks into are unpacked
+            if needs_content(msg_type):
+                assert msg_type in INSPECTED_MSG_TYPES
+                assert unpack_content(kernel_session, msg) == content
+            else:
+                assert isinstance(msg["content"], bytes)
+            frontend_session.send(iopub, msg)
+            _, msg_list = frontend_session.feed_identities(frontend.recv_multipart())
+            relayed = frontend_session.deserialize(msg_list)
+            assert relayed["header"]["msg_type"] == msg_type
+            assert relayed["content"] == content
+            assert [bytes(x) for x in relayed["buffers"]] == buffers
+    finally:
+        for socket in (subkernel, sos, iopub, frontend):
+            socket.close(linger=0)
+        context.term()
+    # output is unpacked if it is captured, and streams if they are coalesced
+    assert all(needs_content(x, capture=True) for x in OUTPUT_MSG_TYPES)
+    assert not needs_content("display_data", coalesce=True)
+    assert needs_content("stream", coalesce=True)
+    assert not needs_content("comm_msg", capture=True, coalesce=True)
+
+
+def test_coalesce_stream():
+    """test merging of consecutive stream messages"""
+    session = FakeSession()
+    iopub = StreamCoalescer(session, None, window=10)
+    for i in range(5):
+        iopub.send(stream_msg("stdout", f"{i}\n"))
+    assert not session.sent
+    # messages of a different stream are not merged
+    iopub.send(stream_msg("stderr", "error\n"))
+    assert session.sent == [("stream", {"name": "stdout", "text": "0\n1\n2\n3\n4\n"})]
+    # other messages flush pending stream messages
+    iopub.send({"header": {"msg_type": "display_data"}, "content": {}})
+    assert session.sent[1:] == [
+        ("stream", {"name": "stderr", "text": "error\n"}),
+        ("display_data", {}),
+    ]
+
+
+def test_coalesce_limits():
+    """test flush of stream messages by size and time window"""
+    session = FakeSession()
+    iopub = StreamCoalescer(session, None, window=0.05, size=10)
+    iopub.send(stream_msg("stdout", "12345"))
+    iopub.send(stream_msg("stdout", "67890"))
+    assert session.sent == [("stream", {"name": "stdout", "text": "1234567890"})]
+    iopub.send(stream_msg("stdout", "a"))
+    assert 0 < iopub.timeout() <= 0.05
+    iopub.flush_expired()
+    assert len(session.sent) == 1
+    time.sleep(0.06)
+    iopub.flush_expired()
+    assert session.sent[-1] == ("stream", {"name": "stdout", "text": "a"})
+    assert iopub.timeout() is None
+
+
+def test_no_coalesce():
+    """test that messages are sent directly if coalescing is disabled"""
+    session = FakeSession()
+    iopub = StreamCoalescer(session, None, window=0)
+    iopub.send(stream_msg("stdout", "a"))
+    iopub.send(stream_msg("stdout", "b"))
+    assert len(session.sent) == 2
+
+
+def test_output_budget():
+    """test limits of output budget"""
+    budget = OutputBudget(max_messages=2)
+    assert budget.limited
+    assert budget.charge(10) and budget.charge(10)
+    assert not budget.charge(10)
+    assert not budget.charge(5)
+    assert budget.suppressed_messages == 2 and budget.suppressed_bytes == 15
+    assert "2 messages" in budget.close()
+    #
+    budget = OutputBudget(max_bytes=100)
+    assert budget.charge(60)
+    assert not budget.charge(60)
+    # once exceeded, smaller messages are also suppressed
+    assert not budget.charge(1)
+    assert "discarded" in budget.close()
+    #
+    assert not OutputBudget().limited
+    assert OutputBudget().close() is None
+
+
+def test_output_spool():
+    """test saving of suppressed output to spool file"""
+    budget = OutputBudget(max_messages=1, spool=True)
+    budget.charge(1)
+    for i in range(3):
+        budget.charge(1)
+        budget.save("stream", {"name": "stdout", "text": f"line {i}\n"})
+    budget.save("display_data", {"data": {"text/plain": "text"}})
+    summary = budget.close()
+    assert budget.spool in summary
+    with open(budget.spool) as spool:
+        assert spool.read() == "line 0\nline 1\nline 2\ntext\n"
+    os.remove(budget.spool)
+
+
+class ResponseKernel:
+    """Part of SoS_Kernel that executes statements in a subkernel"""
+
+    _execute_requests = SoS_Kernel._execute_requests
+    _get_deadline = SoS_Kernel._get_deadline
+    _abort_requests = SoS_Kernel._abort_requests
+    _wait_for_interrupted = SoS_Kernel._wait_for_interrupted
+    _collected_responses = SoS_Kernel._collected_responses
+    get_response = SoS_Kernel.get_response
+    get_responses = SoS_Kernel.get_responses
+    async_get_response = SoS_Kernel.async_get_response
+    async_get_responses = SoS_Kernel.async_get_responses
+
+    def __init__(self):
+        self.kernel = "python3"
+        self.response_timeout = 0
+        self.KM, self.KC, _ = asyncio.run(start_subkernel("python3"))
+
+    def shutdown(self):
+        self.KC.stop_channels()
+        self.KM.sync_shutdown_kernel(now=True)
+
+
+def texts(response):
+    return "".join(content.get("text", "") for _, content in response)
+
+
+def test_get_responses():
+    """test execution of several statements and timeout of execution"""
+    kernel = ResponseKernel()
+    try:
+        responses = kernel.get_responses(
+            ["print('a')", "print('b'); print('c')", "1 + 1"],
+            ("stream", "execute_result"),
+        )
+        assert [texts(x) for x in responses[:2]] == ["a\n", "b\nc\n"]
+        assert [x[0] for x in responses[2]] == ["execute_result"]
+        assert responses[2][0][1]["data"]["text/plain"] == "2"
+        # responses are filtered by stream names
+        assert kernel.get_response(
+            "import sys; print('out'); print('err', file=sys.stderr)",
+            ("stream",),
+            name=("stderr",),
+        ) == [["stream", {"name": "stderr", "text": "err\n"}]]
+        #
+        start = time.monotonic()
+        with pytest.raises(TimeoutError, match="No response"):
+            kernel.get_responses(
+                ["print('slept')", "import time; time.sleep(30)", "print('never')"],
+                ("stream", "error"),
+                timeout=2,
+            )
+        assert time.monotonic() - start < 15
+        # the kernel is interrupted and replies to interrupted requests are
+        # consumed so that they do not leak into the next cell
+        time.sleep(1)
+        assert not kernel.KC.iopub_channel.msg_ready()
+        assert not kernel.KC.shell_channel.msg_ready()
+        kernel.response_timeout = 10
+        assert kernel.get_response("print('next')", ("stream", "error")) == [
+            ["stream", {"name": "stdout", "text": "next\n"}]
+        ]
+    finally:
+        kernel.shutdown()
+
+
+def test_async_get_responses():
+    """test awaitable execution of statements, with timeout and cancellation"""
+    kernel = ResponseKernel()
+
+    async def execute():
+        responses = await kernel.async_get_responses(
+            ["print('a')", "print('b')"], ("stream",)
+        )
+        assert [texts(x) for x in responses] == ["a\n", "b\n"]
+        #
+        with pytest.raises(TimeoutError, match="No response"):
+            await kernel.async_get_response(
+                "import time; time.sleep(30)", ("stream", "error"), timeout=1
+            )
+        assert (
+            texts(await kernel.async_get_response("print('next')", ("stream", "error")))
+            == "next\n"
+        )
+        # the kernel is interrupted if the request is cancelled
+        task = asyncio.create_task(
+            kernel.async_get_response(
+                "import time; time.sleep(30)", ("stream", "error")
+            )
+        )
+        await asyncio.sleep(1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(1)
+        assert not kernel.KC.iopub_channel.msg_ready()
+        assert not kernel.KC.shell_channel.msg_ready()
+        assert await kernel.async_get_response(
+            "print('after')", ("stream", "error"), timeout=10
+        ) == [["stream", {"name": "stdout", "text": "after\n"}]]
+
+    try:
+        asyncio.run(execute())
+    finally:
+        kernel.shutdown()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import subprocess
+import sys
+
+from sos_notebook.resources import ResourceUsage
+
+
+def test_resource_usage():
+    """test measuring resource usage of processes and their children"""
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        usage = ResourceUsage()
+        processes = [("self", os.getpid(), False), ("tree", os.getpid(), True)]
+        alone, tree = usage.measure(processes)
+        assert alone["name"] == "self" and alone["pid"] == os.getpid()
+        assert alone["rss"] > 0 and alone["threads"] >= 1 and alone["uptime"] > 0
+        # child processes are included
+        assert tree["rss"] > alone["rss"]
+        assert tree["threads"] > alone["threads"]
+        # processes that do not exist are skipped
+        child.kill()
+        child.wait()
+        assert len(usage.measure([("child", child.pid, False)])) == 0
+    finally:
+        child.kill()
+        child.wait()
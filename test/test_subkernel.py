@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from types import SimpleNamespace
+
+import pytest
+
+from sos_notebook import languages
+from sos_notebook.languages import LanguagePlugins
+from sos_notebook.subkernel import Subkernels, kernel_pattern
+
+# the kernelspec index and kernel info are not saved to ~/.sos
+pytestmark = pytest.mark.usefixtures("sos_cache")
+
+
+class FakeKernel:
+    def __init__(self, tmp_path):
+        self._failed_languages = {}
+        self.supported_languages = LanguagePlugins(
+            self._failed_languages, str(tmp_path / "language_plugins.json")
+        )
+        self.messages = []
+
+    def send_frontend_msg(self, msg_type, msg):
+        self.messages.append((msg_type, msg))
+
+
+def test_kernel_pattern():
+    """test matching of kernel names with glob patterns"""
+    assert kernel_pattern(("python3", "conda-env-*-py")).match("conda-env-base-py")
+    assert not kernel_pattern(("python3",)).match("python")
+    assert not kernel_pattern(()).match("python3")
+
+
+def test_find_subkernel(tmp_path):
+    """test lookup of subkernels by name and kernel name"""
+    subkernels = Subkernels(FakeKernel(tmp_path))
+    assert subkernels.find("SoS").kernel == "sos"
+    python3 = subkernels.find("Python3")
+    assert python3.kernel == "python3"
+    assert subkernels.find("python3") is python3
+    # new subkernel with an existing kernel
+    mypy = subkernels.find("mypy", kernel="python3", notify_frontend=False)
+    assert mypy.kernel == "python3" and mypy.language == "Python3"
+    assert subkernels.find("mypy") is mypy
+    # new subkernel with a language
+    other = subkernels.find("other", language="Python3")
+    assert other.kernel == "python3"
+    assert subkernels.find("python3") is python3
+
+
+def test_kernel_list_notifications(tmp_path):
+    """test batched and delta notifications of the kernel list"""
+    kernel = FakeKernel(tmp_path)
+    subkernels = Subkernels(kernel)
+    subkernels.notify_frontend(full=True)
+    assert [x[0] for x in kernel.messages] == ["kernel-list"]
+    # unchanged kernel list is not sent again
+    subkernels.notify_frontend()
+    assert len(kernel.messages) == 1
+
+    subkernels.delta_updates = True
+    subkernels.notify_frontend(full=True)
+    msg_type, msg = kernel.messages[-1]
+    assert msg_type == "kernel-list-delta" and msg["full"]
+    assert len(msg["kernels"]) == len(subkernels.kernel_list())
+    # changes in an execute request are sent once
+    with subkernels.batch_notifications():
+        subkernels.find("mypy", kernel="python3")
+        subkernels.find("mypy", color="red")
+        assert len(kernel.messages) == 2
+    msg_type, msg = kernel.messages[-1]
+    assert len(kernel.messages) == 3
+    assert msg["version"] == 2 and not msg["full"]
+    assert [x[0] for x in msg["kernels"]] == ["mypy"]
+    assert msg["kernels"][0][3] == "red"
+
+
+class FlakyLanguage:
+    supported_kernels = {"Flaky": ["python3"]}
+    background_color = "#FFFFFF"
+    options = {}
+
+
+def test_retry_language(tmp_path, monkeypatch):
+    """test adding subkernels of a language module that is loaded again"""
+    fixed = []
+
+    def load():
+        if not fixed:
+            raise ImportError("No module named 'flaky_dependency'")
+        return FlakyLanguage
+
+    entrypoint = SimpleNamespace(
+        name="Flaky",
+        value="flaky_language:FlakyLanguage",
+        dist=SimpleNamespace(name="flaky-language", version="1.0"),
+        load=load,
+    )
+    monkeypatch.setattr(languages.metadata, "entry_points", lambda group: [entrypoint])
+    kernel = FakeKernel(tmp_path)
+    subkernels = Subkernels(kernel)
+    assert "Flaky" in kernel._failed_languages
+    assert not subkernels.retry_language("Flaky")
+    fixed.append(True)
+    assert subkernels.retry_language("Flaky")
+    flaky = subkernels.find("Flaky")
+    assert flaky.kernel == "python3" and flaky.language == "Flaky"
+    assert kernel.messages[-1][0] == "kernel-list"
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import io
+import logging
+import sys
+import time
+
+from sos.utils import env
+
+from sos_notebook.tracing import Tracer
+
+
+def test_trace_levels():
+    """test per-topic levels of tracer"""
+    tracer = Tracer()
+    tracer.configure("MESSAGE:DEBUG,KERNEL:INFO")
+    assert tracer.is_enabled("MESSAGE", logging.DEBUG)
+    assert not tracer.is_enabled("KERNEL", logging.DEBUG)
+    assert tracer.is_enabled("KERNEL", logging.INFO)
+    assert not tracer.is_enabled("MAGIC", logging.CRITICAL)
+    tracer.configure("ALL:INFO")
+    assert tracer.is_enabled("MAGIC", logging.INFO)
+
+
+def test_lazy_formatting():
+    """test that messages of disabled topics are not formatted"""
+
+    class Unformattable:
+        def __repr__(self):
+            raise RuntimeError("should not be formatted")
+
+        __str__ = __repr__
+
+    tracer = Tracer()
+    tracer.configure("KERNEL:INFO")
+    tracer.debug("KERNEL", "message %s", Unformattable())
+    tracer.debug("MESSAGE", "message %s", Unformattable())
+
+
+def test_truncate():
+    """test truncation of long values in traced messages"""
+    tracer = Tracer(max_length=10)
+    msg = {
+        "content": {"data": {"image/png": "x" * 100}},
+        "buffers": [memoryview(b"0" * 100)],
+    }
+    truncated = tracer.truncate(msg)
+    assert truncated["content"]["data"]["image/png"] == "x" * 10 + "... (90 more)"
+    assert truncated["buffers"] == ["<100 bytes>"]
+    assert msg["content"]["data"]["image/png"] == "x" * 100
+
+
+def test_reconfigure(monkeypatch):
+    """test that levels follow changes of SOS_DEBUG and SOS_TRACE"""
+    monkeypatch.setitem(env.config, "SOS_DEBUG", {"MAGIC"})
+    monkeypatch.delenv("SOS_TRACE", raising=False)
+    tracer = Tracer()
+    assert tracer.is_enabled("MAGIC") and not tracer.is_enabled("KERNEL")
+    env.config["SOS_DEBUG"] = set()
+    assert not tracer.is_enabled("MAGIC")
+    monkeypatch.setenv("SOS_TRACE", "KERNEL:INFO")
+    assert tracer.is_enabled("KERNEL", logging.INFO)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_trace_handlers(tmp_path, monkeypatch):
+    """test that trace records are written to handlers added after tracing"""
+    monkeypatch.delenv("SOS_TRACE_FILE", raising=False)
+    stderr = io.StringIO()
+    monkeypatch.setattr(sys, "__stderr__", stderr)
+    logger = logging.getLogger()
+    tracer = Tracer("KERNEL:DEBUG")
+    tracer.debug("KERNEL", "before handlers")
+    assert wait_for(tracer._queue.empty)
+    time.sleep(0.1)
+    file_handler = logging.FileHandler(str(tmp_path / "trace.log"))
+    # stream handlers write to stderr of the process, not to their streams
+    stream_handler = logging.StreamHandler(io.StringIO())
+    logger.addHandler(file_handler)
+    logger.addHandler(stream_handler)
+    try:
+        tracer.debug("KERNEL", "after handlers")
+        assert wait_for(lambda: "after handlers" in stderr.getvalue())
+        file_handler.flush()
+        with open(tmp_path / "trace.log") as log:
+            assert log.read() == "KERNEL - after handlers\n"
+        assert not stream_handler.stream.getvalue()
+    finally:
+        logger.removeHandler(file_handler)
+        logger.removeHandler(stream_handler)
+        file_handler.close()